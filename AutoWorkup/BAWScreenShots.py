@@ -1,12 +1,12 @@
 from __future__ import print_function
 
-import ast
 import getopt
 import os
 import sys
 
 import nipype.pipeline.engine as pe  # pypeline engine
 from nipype.interfaces.semtools import BRAINSSnapShotWriter
+from utilities.subjectListReader import isSessionLiteralList, readSessionLiteralList, readSubjectList
 
 
 def print_usage():
@@ -23,20 +23,17 @@ def print_usage():
 
 def readInputFile(inputFilename):
     inputList = []
-    with open(inputFilename) as infile:
-        for line in infile:
-            sessionInfo = ast.literal_eval(line)
-            # print sessionInfo
-            if type(sessionInfo) is list:
-                pass
-            else:
-                sessionDict = dict()
-                sessionDict['project'] = sessionInfo[0]
-                sessionDict['subject'] = sessionInfo[1]
-                sessionDict['session'] = sessionInfo[2]
-                sessionDict['imagefiles'] = ast.literal_eval(sessionInfo[3])
-
-            inputList.append(sessionDict)
+    if isSessionLiteralList(inputFilename):
+        records = readSessionLiteralList(inputFilename)
+    else:
+        records = readSubjectList(inputFilename)
+    for record in records:
+        sessionDict = dict()
+        sessionDict['project'] = record.project
+        sessionDict['subject'] = record.subject
+        sessionDict['session'] = record.session
+        sessionDict['imagefiles'] = record.imagefiles
+        inputList.append(sessionDict)
     """
     printing for debugging
     """
@@ -17,45 +17,16 @@ USAGE:
 """
 from __future__ import print_function
 
-import csv
 import getopt
 import os.path
 import sys
+from collections import OrderedDict
 
 import SimpleITK as sitk
 
-print(sitk.Version())
-
+from utilities.landmarkIO import SLICER3_FCSV, ReadLandmarks, WriteLandmarks
 
-def csv_file_writer(filename, data):
-    with open(filename, 'w') as lf:
-        headerdata1 = [['#Fiducial', 'List', 'file', filename],
-                       ['#numPoints', '=', len(data)]]
-        headerdata2 = [['#symbolScale = 5'],
-                       ['#visibility = 1'],
-                       ['#textScale = 4.5'],
-                       ['#color = 0.4', '1', '1'],
-                       ['#selectedColor = 1', '0.5', '0.5'],
-                       ['#label', 'x', 'y', 'z', 'sel', 'vis']]
-        wr = csv.writer(lf, delimiter=' ')
-        wr.writerows(headerdata1)
-        wr = csv.writer(lf, delimiter=',')
-        wr.writerows(headerdata2)
-        wr.writerows(data)
-
-
-def csv_file_reader(filename, dataList):
-    import csv
-    with open(filename) as lf:
-        reader = csv.reader(lf, delimiter=',')
-        for line in reader:
-            lmkName = line[0]
-            if lmkName == "AC":
-                dataList.append(line)
-            elif lmkName == "PC":
-                dataList.append(line)
-            else:
-                continue
+print(sitk.Version())
 
 
 def main(argv):
@@ -131,20 +102,15 @@ def main(argv):
     print(("IRP indeces: ", indx_IRP))
     print(("SLA indeces: ", indx_SLA))
 
-    itk_IRP = unified_important_labels.TransformIndexToPhysicalPoint(indx_IRP)
-    itk_SLA = unified_important_labels.TransformIndexToPhysicalPoint(indx_SLA)
-
-    IRP = [-itk_IRP[0], -itk_IRP[1], itk_IRP[2]]
-    SLA = [-itk_SLA[0], -itk_SLA[1], itk_SLA[2]]
-
-    print(("IRP: ", IRP))
-    print(("SLA: ", SLA))
+    IRP = unified_important_labels.TransformIndexToPhysicalPoint(indx_IRP)
+    SLA = unified_important_labels.TransformIndexToPhysicalPoint(indx_SLA)
 
-    data = [['SLA', SLA[0], SLA[1], SLA[2], 1, 1],
-            ['IRP', IRP[0], IRP[1], IRP[2], 1, 1]]
+    print(("IRP (LPS): ", IRP))
+    print(("SLA (LPS): ", SLA))
 
-    csv_file_reader(inputLandmarksFile, data)
-    csv_file_writer(outputTalairachLandmarksFile, data)
+    inputLandmarks = ReadLandmarks(inputLandmarksFile, coordinateSystem='LPS')
+    data = OrderedDict([('SLA', SLA), ('IRP', IRP), ('AC', inputLandmarks['AC']), ('PC', inputLandmarks['PC'])])
+    WriteLandmarks(outputTalairachLandmarksFile, data, coordinateSystem='LPS', fileVersion=SLICER3_FCSV)
 
 
 if __name__ == "__main__":
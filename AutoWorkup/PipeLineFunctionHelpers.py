@@ -10,6 +10,34 @@ POSTERIORS = ['WM', 'SURFGM', 'BASAL', 'GLOBUS', 'THALAMUS',
               'HIPPOCAMPUS', 'CRBLGM', 'CRBLWM', 'CSF', 'VB', 'NOTCSF', 'NOTGM', 'NOTWM',
               'NOTVB', 'AIR']
 
+## (FG,Label) of each posterior, see FixWMPartitioning
+POSTERIOR_LABELS = {'POSTERIOR_WM.nii.gz': (1, 1),
+                    'POSTERIOR_SURFGM.nii.gz': (1, 2),
+                    'POSTERIOR_BASAL.nii.gz': (1, 21),
+                    'POSTERIOR_GLOBUS.nii.gz': (1, 23),
+                    'POSTERIOR_THALAMUS.nii.gz': (1, 24),
+                    'POSTERIOR_HIPPOCAMPUS.nii.gz': (1, 25),
+                    'POSTERIOR_CRBLGM.nii.gz': (1, 11),
+                    'POSTERIOR_CRBLWM.nii.gz': (1, 12),
+                    'POSTERIOR_CSF.nii.gz': (1, 4),
+                    'POSTERIOR_VB.nii.gz': (1, 5),
+                    'POSTERIOR_NOTCSF.nii.gz': (0, 6),
+                    'POSTERIOR_NOTGM.nii.gz': (0, 7),
+                    'POSTERIOR_NOTWM.nii.gz': (0, 8),
+                    'POSTERIOR_NOTVB.nii.gz': (0, 9),
+                    'POSTERIOR_AIR.nii.gz': (0, 0)}
+
+## (output name, posteriors summed in this order), see AccumulateLikeTissuePosteriors
+ACCUMULATED_POSTERIORS = [
+    ('POSTERIOR_GM_TOTAL.nii.gz', ['POSTERIOR_SURFGM.nii.gz', 'POSTERIOR_BASAL.nii.gz', 'POSTERIOR_THALAMUS.nii.gz',
+                                   'POSTERIOR_HIPPOCAMPUS.nii.gz', 'POSTERIOR_CRBLGM.nii.gz']),
+    ('POSTERIOR_WM_TOTAL.nii.gz', ['POSTERIOR_CRBLWM.nii.gz', 'POSTERIOR_WM.nii.gz']),
+    ('POSTERIOR_CSF_TOTAL.nii.gz', ['POSTERIOR_CSF.nii.gz']),
+    ('POSTERIOR_VB_TOTAL.nii.gz', ['POSTERIOR_VB.nii.gz']),
+    ('POSTERIOR_GLOBUS_TOTAL.nii.gz', ['POSTERIOR_GLOBUS.nii.gz']),
+    ('POSTERIOR_BACKGROUND_TOTAL.nii.gz', ['POSTERIOR_AIR.nii.gz', 'POSTERIOR_NOTCSF.nii.gz', 'POSTERIOR_NOTGM.nii.gz',
+                                           'POSTERIOR_NOTVB.nii.gz', 'POSTERIOR_NOTWM.nii.gz'])]
+
 
 def convertToList(element):
     if element is None:
@@ -38,9 +66,8 @@ def MakeInclusionMaskForGMStructures(posteriorDictionary, candidateRegionFileNam
     outputCandidateRegion = sitk.BinaryThreshold(AIR_Region + CSF_Region + VB_Region + WM_Region, 1, 100, 0,
                                                  1)  # NOTE: Inversion of input/output definitions
     ##  Now write out the candidate region name.
-    import os
-    outputCandidateRegionFileName = os.path.realpath(candidateRegionFileName)
-    sitk.WriteImage(outputCandidateRegion, outputCandidateRegionFileName)
+    from utilities.imageIO import WriteImage
+    outputCandidateRegionFileName = WriteImage(outputCandidateRegion, candidateRegionFileName)
 
     return outputCandidateRegionFileName
 
@@ -73,8 +100,8 @@ def ClipT1ImageWithBrainMask(t1_image, brain_labels, clipped_file_name):
     bl = sitk.Cast(sitk.ReadImage(brain_labels), sitk.sitkFloat32)
     bl_binary = sitk.Cast(sitk.BinaryThreshold(bl, 1, 1000000), sitk.sitkFloat32)
     clipped = t1 * bl_binary
-    sitk.WriteImage(clipped, clipped_file_name)
-    clipped_file = os.path.realpath(clipped_file_name)
+    from utilities.imageIO import WriteImage
+    clipped_file = WriteImage(clipped, clipped_file_name)
     return clipped_file
 
 
@@ -121,6 +148,8 @@ def FixWMPartitioning(brainMask, PosteriorsList):
     """"There were some errors in mis-classifications for WM/NON_WM"""
     import SimpleITK as sitk
     import os
+    from utilities.imageIO import WriteImage
+    from PipeLineFunctionHelpers import POSTERIOR_LABELS
 
     brainMask = brainMask
     PosteriorsList = [x for x in PosteriorsList]
@@ -134,7 +163,8 @@ def FixWMPartitioning(brainMask, PosteriorsList):
         return sitk.BinaryThreshold(
             inputMask +
             sitk.ErodeObjectMorphology(
-                sitk.VotingBinaryHoleFilling(BM, [HOLE_FILL_SIZE, HOLE_FILL_SIZE, HOLE_FILL_SIZE]), HOLE_FILL_SIZE), 1,
+                sitk.VotingBinaryHoleFilling(BM, [HOLE_FILL_SIZE, HOLE_FILL_SIZE, HOLE_FILL_SIZE]),
+                [HOLE_FILL_SIZE, HOLE_FILL_SIZE, HOLE_FILL_SIZE]), 1,
             10000)
 
     print("Reading {0} of type {1}".format(brainMask, type(brainMask)))
@@ -184,8 +214,8 @@ def FixWMPartitioning(brainMask, PosteriorsList):
         NEW_NOTREGION = ALL_REGION * sitk.Cast((1 - BM_FILLED), sitk.sitkFloat32)
         NEW_REGION_FN = os.path.realpath('POSTERIOR_{0}.nii.gz'.format(REGION_NAME))
         NEW_NOTREGION_FN = os.path.realpath('POSTERIOR_{0}.nii.gz'.format(NOTREGION_NAME))
-        sitk.WriteImage(NEW_REGION, NEW_REGION_FN)
-        sitk.WriteImage(NEW_NOTREGION, NEW_NOTREGION_FN)
+        WriteImage(NEW_REGION, NEW_REGION_FN)
+        WriteImage(NEW_NOTREGION, NEW_NOTREGION_FN)
         ShiftPosteriorsList[NOTREGION_index] = NEW_NOTREGION_FN
         ShiftPosteriorsList[REGION_index] = NEW_REGION_FN
         return ShiftPosteriorsList
@@ -204,24 +234,7 @@ def FixWMPartitioning(brainMask, PosteriorsList):
     AirMask = sitk.BinaryThreshold(sitk.ReadImage(PosteriorsList[AIR_index]), 0.50, 1000000)
     nonAirMask = sitk.Cast(1 - AirMask, sitk.sitkUInt8)
     nonAirRegionMask = os.path.realpath('NonAirMask.nii.gz')
-    sitk.WriteImage(nonAirMask, nonAirRegionMask)
-
-    POSTERIOR_LABELS = dict()  # (FG,Label)
-    POSTERIOR_LABELS["POSTERIOR_WM.nii.gz"] = (1, 1)
-    POSTERIOR_LABELS["POSTERIOR_SURFGM.nii.gz"] = (1, 2)
-    POSTERIOR_LABELS["POSTERIOR_BASAL.nii.gz"] = (1, 21)
-    POSTERIOR_LABELS["POSTERIOR_GLOBUS.nii.gz"] = (1, 23)
-    POSTERIOR_LABELS["POSTERIOR_THALAMUS.nii.gz"] = (1, 24)
-    POSTERIOR_LABELS["POSTERIOR_HIPPOCAMPUS.nii.gz"] = (1, 25)
-    POSTERIOR_LABELS["POSTERIOR_CRBLGM.nii.gz"] = (1, 11)
-    POSTERIOR_LABELS["POSTERIOR_CRBLWM.nii.gz"] = (1, 12)
-    POSTERIOR_LABELS["POSTERIOR_CSF.nii.gz"] = (1, 4)
-    POSTERIOR_LABELS["POSTERIOR_VB.nii.gz"] = (1, 5)
-    POSTERIOR_LABELS["POSTERIOR_NOTCSF.nii.gz"] = (0, 6)
-    POSTERIOR_LABELS["POSTERIOR_NOTGM.nii.gz"] = (0, 7)
-    POSTERIOR_LABELS["POSTERIOR_NOTWM.nii.gz"] = (0, 8)
-    POSTERIOR_LABELS["POSTERIOR_NOTVB.nii.gz"] = (0, 9)
-    POSTERIOR_LABELS["POSTERIOR_AIR.nii.gz"] = (0, 0)
+    WriteImage(nonAirMask, nonAirRegionMask)
 
     MatchingFGCodeList = list()
     MatchingLabelList = list()
@@ -233,64 +246,159 @@ def FixWMPartitioning(brainMask, PosteriorsList):
     return UpdatedPosteriorsList, MatchingFGCodeList, MatchingLabelList, nonAirRegionMask
 
 
-def AccumulateLikeTissuePosteriors(posteriorImages):
+def AccumulateLikeTissuePosteriors(posteriorImages, backgroundWriter=False):
+    """Sum the BRAINSABC posteriors into the *_TOTAL tissue groups.
+
+    The posteriors are streamed: each one is read once, added into the float32 accumulator of its
+    group and released, so only one posterior and one group sum are held in memory.  With
+    backgroundWriter=True each finished group is written by a background thread while the
+    posteriors of the next group are read."""
     import os
     import sys
     import SimpleITK as sitk
+    import numpy as np
+    from utilities.imageIO import ImageWriter
+    from PipeLineFunctionHelpers import ACCUMULATED_POSTERIORS
     ## Now clean up the posteriors based on anatomical knowlege.
     ## sometimes the posteriors are not relevant for priors
     ## due to anomolies around the edges.
 
-    load_images_list = dict()
+    posterior_paths = dict()
     for full_pathname in posteriorImages:
         base_name = os.path.basename(full_pathname)
-        load_images_list[base_name] = sitk.ReadImage(full_pathname)
-    GM_ACCUM = [
-        'POSTERIOR_SURFGM.nii.gz',
-        'POSTERIOR_BASAL.nii.gz',
-        'POSTERIOR_THALAMUS.nii.gz',
-        'POSTERIOR_HIPPOCAMPUS.nii.gz',
-        'POSTERIOR_CRBLGM.nii.gz',
-    ]
-    WM_ACCUM = [
-        'POSTERIOR_CRBLWM.nii.gz',
-        'POSTERIOR_WM.nii.gz'
-    ]
-    CSF_ACCUM = [
-        'POSTERIOR_CSF.nii.gz',
-    ]
-    VB_ACCUM = [
-        'POSTERIOR_VB.nii.gz',
-    ]
-    GLOBUS_ACCUM = [
-        'POSTERIOR_GLOBUS.nii.gz',
-    ]
-    BACKGROUND_ACCUM = [
-        'POSTERIOR_AIR.nii.gz',
-        'POSTERIOR_NOTCSF.nii.gz',
-        'POSTERIOR_NOTGM.nii.gz',
-        'POSTERIOR_NOTVB.nii.gz',
-        'POSTERIOR_NOTWM.nii.gz',
-    ]
-    ## The next 2 items MUST be syncronized
-    AccumulatePriorsNames = ['POSTERIOR_GM_TOTAL.nii.gz', 'POSTERIOR_WM_TOTAL.nii.gz',
-                             'POSTERIOR_CSF_TOTAL.nii.gz', 'POSTERIOR_VB_TOTAL.nii.gz',
-                             'POSTERIOR_GLOBUS_TOTAL.nii.gz', 'POSTERIOR_BACKGROUND_TOTAL.nii.gz']
-    ForcedOrderingLists = [GM_ACCUM, WM_ACCUM, CSF_ACCUM, VB_ACCUM, GLOBUS_ACCUM, BACKGROUND_ACCUM]
+        posterior_paths[base_name] = full_pathname
     AccumulatePriorsList = list()
-    for index in range(0, len(ForcedOrderingLists)):
-        outname = AccumulatePriorsNames[index]
-        inlist = ForcedOrderingLists[index]
-        accum_image = load_images_list[inlist[0]]  # copy first image
-        for curr_image in range(1, len(inlist)):
-            accum_image = accum_image + load_images_list[inlist[curr_image]]
-        sitk.WriteImage(accum_image, outname)
-        AccumulatePriorsList.append(os.path.realpath(outname))
+    with ImageWriter(background=backgroundWriter) as imageWriter:
+        for outname, inlist in ACCUMULATED_POSTERIORS:
+            accum_array = None
+            for posterior_name in inlist:  # summed in list order, as the image expression did
+                posterior_image = sitk.ReadImage(posterior_paths[posterior_name])
+                posterior_array = sitk.GetArrayViewFromImage(posterior_image)
+                if accum_array is None:
+                    accum_array = posterior_array.astype(np.float32)  # copy first image
+                    reference_image = posterior_image
+                else:
+                    accum_array += posterior_array
+                del posterior_array
+            accum_image = sitk.GetImageFromArray(accum_array)
+            accum_image.CopyInformation(reference_image)
+            del accum_array, reference_image, posterior_image
+            AccumulatePriorsList.append(imageWriter.Write(accum_image, outname))
+            del accum_image
+    AccumulatePriorsNames = [outname for outname, _ in ACCUMULATED_POSTERIORS]
     print("HACK \n\n\n\n\n\n\n HACK \n\n\n: {APL}\n".format(APL=AccumulatePriorsList))
     print(": {APN}\n".format(APN=AccumulatePriorsNames))
     return AccumulatePriorsList, AccumulatePriorsNames
 
 
+def PostProcessPosteriors(brainMask, PosteriorsList, candidateRegionFileName='RF12_CandidateRegionMask.nii.gz',
+                          backgroundWriter=True, nonAirRegionMaskFileName='NonAirMask.nii.gz'):
+    """Posterior post-processing in one node: the posteriors are read once and kept in memory for
+
+    * the WM/NON_WM hard partitioning of FixWMPartitioning,
+    * the non-air mask,
+    * the like-tissue *_TOTAL accumulation of AccumulateLikeTissuePosteriors,
+    * the GM structures inclusion mask of MakeInclusionMaskForGMStructures (from the posteriors
+      before partitioning, as BRAINSCut uses them).
+
+    All outputs are written at the end, by a background thread if backgroundWriter is True.  Uncompressed
+    posteriors are memory-mapped rather than read.
+    Returns the outputs of FixWMPartitioning, then those of AccumulateLikeTissuePosteriors, then
+    the inclusion mask file name."""
+    import os
+    import SimpleITK as sitk
+    import numpy as np
+    from utilities.imageIO import ImageWriter, ReadImageArray
+    from PipeLineFunctionHelpers import POSTERIOR_LABELS, ACCUMULATED_POSTERIORS
+
+    def FillHolePreserveEdge(inputMask, HOLE_FILL_SIZE):
+        """See FixWMPartitioning"""
+        return sitk.BinaryThreshold(
+            inputMask +
+            sitk.ErodeObjectMorphology(
+                sitk.VotingBinaryHoleFilling(inputMask, [HOLE_FILL_SIZE, HOLE_FILL_SIZE, HOLE_FILL_SIZE]),
+                [HOLE_FILL_SIZE, HOLE_FILL_SIZE, HOLE_FILL_SIZE]), 1,
+            10000)
+
+    def InRange(array, lower, upper):
+        """NumPy version of sitk.BinaryThreshold(image, lower, upper, 1, 0), as a boolean array"""
+        return (array >= lower) & (array <= upper)
+
+    arrays = dict()
+    for full_post_path_fn in PosteriorsList:
+        print("Reading {0}".format(full_post_path_fn))
+        arrays[os.path.basename(full_post_path_fn)] = ReadImageArray(full_post_path_fn)
+    ## Only the header of the reference image is needed, for the physical space of the outputs
+    referenceReader = sitk.ImageFileReader()
+    referenceReader.SetFileName([x for x in PosteriorsList if os.path.basename(x) == 'POSTERIOR_AIR.nii.gz'][0])
+    referenceReader.ReadImageInformation()
+
+    outputs = list()  # (array, file name), written at the end
+
+    ## GM structures inclusion mask, from the posteriors before partitioning
+    excludedRegion = (InRange(arrays['POSTERIOR_AIR.nii.gz'], 0.51, 1.01) |
+                      InRange(arrays['POSTERIOR_CSF.nii.gz'], 0.51, 1.01) |
+                      InRange(arrays['POSTERIOR_VB.nii.gz'], 0.51, 1.01) |
+                      InRange(arrays['POSTERIOR_WM.nii.gz'], 0.99, 1.01))  # NOTE: Higher tolerance for WM regions!
+    outputCandidateRegionFileName = os.path.realpath(candidateRegionFileName)
+    outputs.append(((~excludedRegion).astype(np.uint8), outputCandidateRegionFileName))
+    del excludedRegion
+
+    ## Non air mask
+    nonAirRegionMask = os.path.realpath(nonAirRegionMaskFileName)
+    outputs.append(((~InRange(arrays['POSTERIOR_AIR.nii.gz'], 0.50, 1000000)).astype(np.uint8), nonAirRegionMask))
+
+    ## WM/NON_WM hard partitioning
+    print("Reading {0} of type {1}".format(brainMask, type(brainMask)))
+    BM = sitk.BinaryThreshold(sitk.ReadImage(brainMask), 1, 1000)
+    BM_FILLED = sitk.GetArrayFromImage(FillHolePreserveEdge(BM, 3)).astype(np.float32)
+    NOT_BM_FILLED = (1 - BM_FILLED)
+    del BM
+    UpdatedPosteriorsList = list(PosteriorsList)
+    for REGION_NAME, NOTREGION_NAME in [('CSF', 'NOTCSF'), ('SURFGM', 'NOTGM'), ('WM', 'NOTWM'), ('VB', 'NOTVB')]:
+        REGION_KEY = 'POSTERIOR_{0}.nii.gz'.format(REGION_NAME)
+        NOTREGION_KEY = 'POSTERIOR_{0}.nii.gz'.format(NOTREGION_NAME)
+        ALL_REGION = arrays[NOTREGION_KEY] + arrays[REGION_KEY]
+        arrays[REGION_KEY] = ALL_REGION * BM_FILLED
+        arrays[NOTREGION_KEY] = ALL_REGION * NOT_BM_FILLED
+        del ALL_REGION
+        for key in [REGION_KEY, NOTREGION_KEY]:
+            NEW_FN = os.path.realpath(key)
+            outputs.append((arrays[key], NEW_FN))
+            UpdatedPosteriorsList[[os.path.basename(x) for x in PosteriorsList].index(key)] = NEW_FN
+    del BM_FILLED, NOT_BM_FILLED
+
+    MatchingFGCodeList = list()
+    MatchingLabelList = list()
+    for full_post_path_fn in UpdatedPosteriorsList:
+        post_key = os.path.basename(full_post_path_fn)
+        MatchingFGCodeList.append(POSTERIOR_LABELS[post_key][0])
+        MatchingLabelList.append(POSTERIOR_LABELS[post_key][1])
+
+    ## Like tissue accumulation, of the partitioned posteriors
+    AccumulatePriorsNames = list()
+    AccumulatePriorsList = list()
+    for outname, inlist in ACCUMULATED_POSTERIORS:
+        accum_array = arrays[inlist[0]].astype(np.float32)  # copy first image
+        for posterior_name in inlist[1:]:
+            accum_array += arrays[posterior_name]
+        outputs.append((accum_array, outname))
+        AccumulatePriorsNames.append(outname)
+        AccumulatePriorsList.append(os.path.realpath(outname))
+
+    with ImageWriter(background=backgroundWriter) as imageWriter:
+        for array, fileName in outputs:
+            image = sitk.GetImageFromArray(array)
+            image.SetOrigin(referenceReader.GetOrigin())
+            image.SetSpacing(referenceReader.GetSpacing())
+            image.SetDirection(referenceReader.GetDirection())
+            imageWriter.Write(image, fileName)
+            del image
+
+    return (UpdatedPosteriorsList, MatchingFGCodeList, MatchingLabelList, nonAirRegionMask,
+            AccumulatePriorsList, AccumulatePriorsNames, outputCandidateRegionFileName)
+
+
 def mkdir_p(path):
     """ Safely make a new directory, checking if it already exists"""
     try:
@@ -1,6 +1,5 @@
 from __future__ import print_function
 
-import csv
 import os
 import sqlite3 as lite
 import sys
@@ -9,259 +8,409 @@ from builtins import range
 from builtins import str
 from collections import OrderedDict
 
+from utilities.subjectListReader import readSubjectList
+
 
 class SessionDB(object):
+    """
+    Thin wrapper around the sqlite database of experiment images.
+
+    A single connection is kept open per process (re-opened automatically after a fork),
+    all queries are parameterized, and the table is indexed on the columns used for lookups.
+    Every csv row is tracked by a content hash so the database can be refreshed incrementally,
+    and the size/mtime of each image is recorded in a side table when it is validated.
+    """
+    MasterColumns = ('project', 'subj', 'session', 'type', 'Qpos', 'filename')
+    MasterIndexes = OrderedDict([('idx_subj', ('subj',)),
+                                 ('idx_session_type_qpos', ('session', 'type', 'Qpos')),
+                                 ('idx_project', ('project',)),
+                                 ('idx_rowhash', ('rowhash',))])
+    RowTableName = "CsvRows"
+    StatTableName = "FileStat"
+    DefaultStatWorkers = 16
+
     def __init__(self, defaultDBName='TempFileForDB.db', subject_list=[]):
         self.MasterTableName = "MasterDB"
         self.dbName = defaultDBName
-        self.subjectList = subject_list
+        self.subjectList = list(subject_list)
         self.cursor = None
         self.connection = None
-        subject_filter = "( "
-        for curr_subject in subject_list:
-            subject_filter += "'" + curr_subject + "',"
-        subject_filter = subject_filter.rstrip(',')  # Remove last ,
-        subject_filter += " )"
-        if subject_list[0] == 'all':
+        self._connection_pid = None
+        self._manifest = None
+        if len(self.subjectList) == 0 or self.subjectList[0] == 'all':
+            self._subjectFilterSQL = ""
+            self._subjectFilterParams = tuple()
             self.MasterQueryFilter = "SELECT * FROM {_tablename}".format(
                 _tablename=self.MasterTableName)
         else:
-            self.MasterQueryFilter = "SELECT * FROM {_tablename} WHERE subj IN {_subjid}".format(
+            self._subjectFilterSQL = "subj IN ({0})".format(",".join(["?"] * len(self.subjectList)))
+            self._subjectFilterParams = tuple(self.subjectList)
+            self.MasterQueryFilter = "SELECT * FROM {_tablename} WHERE subj IN ( {_subjid} )".format(
                 _tablename=self.MasterTableName,
-                _subjid=subject_filter)
+                _subjid=",".join(["'" + curr_subject + "'" for curr_subject in self.subjectList]))
+
+    def __getstate__(self):
+        # sqlite connections can not be pickled; they are re-opened lazily on first use.
+        state = self.__dict__.copy()
+        state['cursor'] = None
+        state['connection'] = None
+        state['_connection_pid'] = None
+        return state
+
+    def __del__(self):
+        try:
+            self.close_connection()
+        except Exception:
+            pass
 
     def open_connection(self):
+        """Open the per-process connection if it is not already open (no-op otherwise)."""
+        if self.connection is not None and self._connection_pid == os.getpid():
+            return
+        if self._connection_pid != os.getpid():
+            # Connections inherited through fork must not be used by the child.
+            self.cursor = None
+            self.connection = None
         self.connection = lite.connect(self.dbName)
         self.cursor = self.connection.cursor()
+        self._connection_pid = os.getpid()
 
     def close_connection(self):
-        if not self.cursor is None:
-            self.cursor.close()
-        if not self.connection is None:
-            self.connection.close()
+        if self._connection_pid == os.getpid():
+            if not self.cursor is None:
+                self.cursor.close()
+            if not self.connection is None:
+                self.connection.close()
+        self.cursor = None
+        self.connection = None
+        self._connection_pid = None
 
-    def _local_fillDB_AndClose(self, sqlCommandList):
+    def _local_fillDB_AndClose(self, rows):
         print("Filling SQLite database SessionDB.py")
-        for sqlCommand in sqlCommandList:
-            self.cursor.execute(sqlCommand)
-        self.connection.commit()
+        insertCommand = "INSERT INTO {_tablename} ({_col_names}) VALUES ({_values});".format(
+            _tablename=self.MasterTableName,
+            _col_names=",".join(self.MasterColumns + ('rowhash',)),
+            _values=",".join(["?"] * (len(self.MasterColumns) + 1)))
+        self.cursor.executemany(insertCommand, rows)
+        self._createIndexes()
         print("Finished filling SQLite database SessionDB.py")
 
-    def MakeNewDB(self, subject_data_file, mountPrefix):
+    def _createIndexes(self):
+        for indexName, columns in list(self.MasterIndexes.items()):
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS {_index} ON {_tablename} ({_columns});".format(
+                _index=indexName, _tablename=self.MasterTableName, _columns=",".join(columns)))
+
+    def _createTables(self):
+        """Create the database tables, discarding databases written with an older layout."""
+        tables = [str(i[0]) for i in self.getInfoFromDB("SELECT name FROM sqlite_master WHERE type='table';")]
+        if self.MasterTableName in tables:
+            columns = [str(i[1]) for i in self.getInfoFromDB(
+                "PRAGMA table_info({_tablename});".format(_tablename=self.MasterTableName))]
+            if 'rowhash' in columns and self.RowTableName in tables and self.StatTableName in tables:
+                return
+            print("Rebuilding SQLite database {0} written with an older layout".format(self.dbName))
+            for table in tables:
+                self.cursor.execute("DROP TABLE IF EXISTS {0};".format(table))
+        dbColTypes = "project TEXT, subj TEXT, session TEXT, type TEXT, Qpos INT, filename TEXT, rowhash TEXT"
+        self.cursor.execute(
+            "CREATE TABLE {tablename}({coltypes});".format(tablename=self.MasterTableName, coltypes=dbColTypes))
+        self.cursor.execute("CREATE TABLE {tablename}(rowhash TEXT PRIMARY KEY, line INT);".format(
+            tablename=self.RowTableName))
+        self.cursor.execute("CREATE TABLE {tablename}(filename TEXT PRIMARY KEY, size INT, mtime REAL);".format(
+            tablename=self.StatTableName))
+        self.connection.commit()
+
+    @staticmethod
+    def _statFile(imagePath):
+        try:
+            fileStat = os.stat(imagePath)
+        except OSError:
+            return None
+        return fileStat.st_size, fileStat.st_mtime
+
+    @staticmethod
+    def _statFiles(imagePaths, workers=None):
+        """
+        stat() every path on a thread pool; stat latency on network mounts dominates, not CPU.
+
+        :return: {imagePath: (size, mtime)} with None for files that do not exist
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        imagePaths = list(OrderedDict.fromkeys(imagePaths))
+        if workers is None:
+            workers = SessionDB.DefaultStatWorkers
+        if len(imagePaths) == 0:
+            return dict()
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(imagePaths)))) as executor:
+            return dict(list(zip(imagePaths, executor.map(SessionDB._statFile, imagePaths))))
+
+    @staticmethod
+    def _rowHash(row, mountPrefix):
+        import hashlib
+        return hashlib.sha1("\x1f".join(list(row) + [mountPrefix]).encode('utf-8')).hexdigest()
+
+    def MakeNewDB(self, subject_data_file, mountPrefix, workers=None):
         ## First close so that we can delete.
         self.close_connection()
         if os.path.exists(self.dbName):
             os.remove(self.dbName)
+        self.UpdateDB(subject_data_file, mountPrefix, workers)
+
+    def UpdateDB(self, subject_data_file, mountPrefix, workers=None):
+        """
+        Incrementally synchronize the database with subject_data_file.
+
+        Each csv row is keyed by a content hash.  Rows whose hash is already in the database are
+        left untouched (their files are not stat'ed again), rows that disappeared from the csv are
+        removed, and only new or edited rows are validated on disk and inserted.
+        """
+        self._manifest = None
         self.open_connection()
-        dbColTypes = "project TEXT, subj TEXT, session TEXT, type TEXT, Qpos INT, filename TEXT"
-        self.cursor.execute(
-            "CREATE TABLE {tablename}({coltypes});".format(tablename=self.MasterTableName, coltypes=dbColTypes))
-        self.connection.commit()
-        sqlCommandList = list()
+        self._createTables()
         missingFilesLog = self.dbName + "_MissingFiles.log"
         missingCount = 0
         print("MISSING FILES RECORED IN {0}".format(missingFilesLog))
         missingFiles = open(missingFilesLog, 'w')
         print("Building Subject returnList: " + subject_data_file)
-        subjData = csv.reader(open(subject_data_file, 'rt'), delimiter=',', quotechar='"')
+        csvRows = OrderedDict()
+        csvErrors = list()
+        for record in readSubjectList(subject_data_file, errors=csvErrors):
+            csvRows[self._rowHash(record.row, mountPrefix)] = record
+        for err in csvErrors:
+            print("ERROR:  Invalid row skipped: {0}".format(err))
+        knownHashes = set([str(i[0]) for i in self.getInfoFromDB(
+            "SELECT rowhash FROM {0};".format(self.RowTableName))])
+        staleHashes = knownHashes - set(csvRows.keys())
+        newRows = [(rowHash, record) for rowHash, record in list(csvRows.items()) if rowHash not in knownHashes]
+        print("Updating SQLite database: {0} new or changed rows, {1} removed rows, {2} unchanged rows".format(
+            len(newRows), len(staleHashes), len(csvRows) - len(newRows)))
+
         allEntriesOK = True
-        for row in subjData:
-            if len(row) < 1:
-                # contine of it is an empty row
-                continue
-            if row[0][0] == '#':
-                # if the first character is a #, then it is commented out
-                continue
-            if row[0] == 'project':
-                # continue if header line
-                continue
-            currDict = OrderedDict()
+        sessionImages = list()
+        for rowHash, record in newRows:
+            currDict = {'project': record.project,
+                        'subj': record.subject,
+                        'session': record.session}
+            rawDict = record.imagefiles
+            dictionary_keys = list(rawDict.keys())
+            if not (('T1-15' in dictionary_keys) or ('T1-30' in dictionary_keys)):
+                print("ERROR: Skipping session {0} due to missing T1's: {1}".format(currDict, dictionary_keys))
+                print("REMOVE OR FIX BEFORE CONTINUING")
+                allEntriesOK = False
+            sessionImages.append((rowHash, record.line, currDict,
+                                  [(imageType, [mountPrefix + i for i in rawDict[imageType]])
+                                   for imageType in dictionary_keys]))
+        fileStats = self._statFiles([imagePath for _, _, _, images in sessionImages
+                                     for _, fullPaths in images for imagePath in fullPaths], workers)
+
+        dbRows = list()
+        for rowHash, line, currDict, images in sessionImages:
             validEntry = True
-            if len(row) == 4:
-                currDict = {'project': row[0],
-                            'subj': row[1],
-                            'session': row[2]}
-                rawDict = OrderedDict(eval(row[3]))
-                dictionary_keys = list(rawDict.keys())
-                if not (('T1-15' in dictionary_keys) or ('T1-30' in dictionary_keys)):
-                    print("ERROR: Skipping session {0} due to missing T1's: {1}".format(currDict, dictionary_keys))
-                    print("REMOVE OR FIX BEFORE CONTINUING")
-                    allEntriesOK = False
-                for imageType in dictionary_keys:
-                    currDict['type'] = imageType
-                    fullPaths = [mountPrefix + i for i in rawDict[imageType]]
-                    if len(fullPaths) < 1:
-                        print("Invalid Entry!  {0}".format(currDict))
+            for imageType, fullPaths in images:
+                if len(fullPaths) < 1:
+                    print("Invalid Entry!  {0}".format(currDict))
+                    validEntry = False
+                for i in range(len(fullPaths)):
+                    imagePath = fullPaths[i]
+                    if fileStats[imagePath] is None:
+                        print("XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX  Missing File: {0}\n".format(imagePath))
+                        missingFiles.write("Missing File: {0}\n".format(imagePath))
                         validEntry = False
-                    for i in range(len(fullPaths)):
-                        imagePath = fullPaths[i]
-                        if not os.path.exists(imagePath):
-                            print("XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX  Missing File: {0}\n".format(imagePath))
-                            missingFiles.write("Missing File: {0}\n".format(imagePath))
-                            validEntry = False
-                            missingCount += 1
-                        else:
-                            print("Found file {0}".format(imagePath))
-                        if validEntry == True:
-                            currDict['Qpos'] = str(i)
-                            currDict['filename'] = imagePath
-                            sqlCommand = self.makeSQLiteCommand(currDict)
-                            sqlCommandList.append(sqlCommand)
-            else:
-                print("ERROR:  Invalid number of elements in row")
-                print(row)
-        sqlCommandList
-        self._local_fillDB_AndClose(sqlCommandList)
+                        missingCount += 1
+                    if validEntry == True:
+                        dbRows.append((currDict['project'], currDict['subj'], currDict['session'],
+                                       imageType, i, imagePath, rowHash))
+        print("Found {0} files".format(len([i for i in list(fileStats.values()) if i is not None])))
+
         if (missingCount > 0) or (allEntriesOK == False):
+            self.close_connection()
             if os.path.exists(self.dbName):
                 os.remove(self.dbName)
             missingFiles.close()
             print("ABORTING: At least 1 missing file\n" * 20)
             sys.exit(-1)
-        else:
-            missingFiles.write("NO_MISSING_FILES")
+        with self.connection:
+            staleHashes = [(rowHash,) for rowHash in staleHashes]
+            self.cursor.executemany("DELETE FROM {0} WHERE rowhash=?;".format(self.MasterTableName), staleHashes)
+            self.cursor.executemany("DELETE FROM {0} WHERE rowhash=?;".format(self.RowTableName), staleHashes)
+            self._local_fillDB_AndClose(dbRows)
+            self.cursor.executemany("INSERT INTO {0} (rowhash, line) VALUES (?, ?);".format(self.RowTableName),
+                                    [(rowHash, line) for rowHash, line, _, _ in sessionImages])
+            self.cursor.executemany(
+                "INSERT OR REPLACE INTO {0} (filename, size, mtime) VALUES (?, ?, ?);".format(self.StatTableName),
+                [(imagePath, fileStat[0], fileStat[1]) for imagePath, fileStat in list(fileStats.items())])
+            self.cursor.execute("DELETE FROM {0} WHERE filename NOT IN (SELECT filename FROM {1});".format(
+                self.StatTableName, self.MasterTableName))
+        missingFiles.write("NO_MISSING_FILES")
         missingFiles.close()
         self.close_connection()
 
+    def getFileStats(self):
+        """Return {filename: (size, mtime)} recorded when the files were last validated."""
+        return dict([(str(i[0]), (i[1], i[2])) for i in self.getInfoFromDB(
+            "SELECT filename, size, mtime FROM {0};".format(self.StatTableName))])
+
     def getSubjectFilter(self):
         return self.MasterQueryFilter
 
     def makeSQLiteCommand(self, imageDict):
+        """Return a parameterized (sqlCommand, values) INSERT pair for imageDict."""
         keys = list(imageDict.keys())
-        vals = list(imageDict.values())
+        vals = tuple(imageDict.values())
         col_names = ",".join(keys)
-        values = ', '.join(["'" + x + "'" for x in vals])
+        values = ",".join(["?"] * len(vals))
         sqlCommand = "INSERT INTO {_tablename} ({_col_names}) VALUES ({_values});".format(
             _tablename=self.MasterTableName,
             _col_names=col_names, _values=values)
-        return sqlCommand
+        return sqlCommand, vals
 
-    def getInfoFromDB(self, sqlCommand):
+    def _makeQuery(self, columns, where=None, orderby=None, distinct=False):
+        """
+        Build a parameterized query against the master table restricted to the subject filter.
+
+        :param columns: comma separated column names to select
+        :param where: list of (column, value) equality constraints
+        :param orderby: ORDER BY clause contents
+        :param distinct: select DISTINCT rows
+        :return: (sqlCommand, params)
+        """
+        clauses = list()
+        params = list()
+        if self._subjectFilterSQL:
+            clauses.append(self._subjectFilterSQL)
+            params.extend(self._subjectFilterParams)
+        for column, value in (where or []):
+            clauses.append("{0}=?".format(column))
+            params.append(value)
+        sqlCommand = "SELECT {_distinct}{_columns} FROM {_tablename}".format(
+            _distinct="DISTINCT " if distinct else "", _columns=columns, _tablename=self.MasterTableName)
+        if clauses:
+            sqlCommand += " WHERE " + " AND ".join(clauses)
+        if orderby:
+            sqlCommand += " ORDER BY " + orderby
+        return sqlCommand + ";", tuple(params)
+
+    def getInfoFromDB(self, sqlCommand, params=()):
         # print("getInfoFromDB({0})".format(sqlCommand))
         self.open_connection()
-        self.cursor.execute(sqlCommand)
+        self.cursor.execute(sqlCommand, params)
         dbInfo = self.cursor.fetchall()
-        self.close_connection()
         return dbInfo
 
+    def _getColumnList(self, column, where=None, orderby=None, distinct=False):
+        sqlCommand, params = self._makeQuery(column, where, orderby, distinct)
+        return [str(i[0]) for i in self.getInfoFromDB(sqlCommand, params)]
+
     def getFirstScan(self, sessionid, scantype):
-        sqlCommand = "SELECT filename FROM ({_master_query}) WHERE session='{_sessionid}' AND type='{_scantype}' AND Qpos='0';".format(
-            _master_query=self.MasterQueryFilter,
-            _sessionid=sessionid, _scantype=scantype)
-        val = self.getInfoFromDB(sqlCommand)
-        filename = str(val[0][0])
+        val = self._getColumnList('filename', [('session', sessionid), ('type', scantype), ('Qpos', 0)])
+        filename = val[0]
         return filename
 
     def getFirstT1(self, sessionid):
-        scantype = 'T1-30'
-        sqlCommand = "SELECT filename FROM ({_master_query}) WHERE session='{_sessionid}' AND type='{_scantype}' AND Qpos='0';".format(
-            _master_query=self.MasterQueryFilter,
-            _sessionid=sessionid, _scantype=scantype)
-        val = self.getInfoFromDB(sqlCommand)
-        # print "HACK: ",sqlCommand
-        # print "HACK: ", val
-        filename = str(val[0][0])
-        return filename
+        return self.getFirstScan(sessionid, 'T1-30')
 
     def getFilenamesByScantype(self, sessionid, scantypelist):
         returnList = list()
         for currScanType in scantypelist:
-            sqlCommand = "SELECT filename FROM ({_master_query}) WHERE session='{_sessionid}' AND type='{_scantype}' ORDER BY Qpos ASC;".format(
-                _master_query=self.MasterQueryFilter,
-                _sessionid=sessionid, _scantype=currScanType)
-            val = self.getInfoFromDB(sqlCommand)
-            for i in val:
-                returnList.append(str(i[0]))
+            returnList.extend(self._getColumnList('filename', [('session', sessionid), ('type', currScanType)],
+                                                  orderby='Qpos ASC'))
         return returnList
 
     def findScanTypeLength(self, sessionid, scantypelist):
         countList = self.getFilenamesByScantype(sessionid, scantypelist)
-        return len(countlist)
+        return len(countList)
 
     def getT1sT2s(self, sessionid):
-        sqlCommand = "SELECT filename FROM ({_master_query}) WHERE session='{_sessionid}' ORDER BY type ASC, Qpos ASC;".format(
-            _master_query=self.MasterQueryFilter,
-            _sessionid=sessionid)
-        val = self.getInfoFromDB(sqlCommand)
-        returnList = list()
-        for i in val:
-            returnList.append(str(i[0]))
-        return returnList
+        return self._getColumnList('filename', [('session', sessionid)], orderby='type ASC, Qpos ASC')
 
     def getAllProjects(self):
-        sqlCommand = "SELECT DISTINCT project FROM ({_master_query});".format(_master_query=self.MasterQueryFilter)
-        val = self.getInfoFromDB(sqlCommand)
-        returnList = list()
-        for i in val:
-            returnList.append(str(i[0]))
-        return returnList
+        return self._getColumnList('project', distinct=True)
 
     def getAllSubjects(self):
-        sqlCommand = "SELECT DISTINCT subj FROM ({_master_query});".format(_master_query=self.MasterQueryFilter)
-        val = self.getInfoFromDB(sqlCommand)
-        returnList = list()
-        for i in val:
-            returnList.append(str(i[0]))
-        return returnList
+        return self._getColumnList('subj', distinct=True)
 
     def getAllSessions(self):
-        # print("HACK:  This is a temporary until complete re-write")
-        sqlCommand = "SELECT DISTINCT session FROM ({_master_query});".format(_master_query=self.MasterQueryFilter)
-        val = self.getInfoFromDB(sqlCommand)
-        returnList = list()
-        for i in val:
-            returnList.append(str(i[0]))
-        return returnList
+        return self._getColumnList('session', distinct=True)
 
     def getSessionsFromSubject(self, subj):
-        sqlCommand = "SELECT DISTINCT session FROM ({_master_query}) WHERE subj='{_subjid}';".format(
-            _master_query=self.MasterQueryFilter,
-            _subjid=subj)
-        val = self.getInfoFromDB(sqlCommand)
-        returnList = list()
-        for i in val:
-            returnList.append(str(i[0]))
-        return returnList
+        return self._getColumnList('session', [('subj', subj)], distinct=True)
 
     def getEverything(self):
-        sqlCommand = "SELECT * FROM ({_master_query});".format(_master_query=self.MasterQueryFilter)
-        val = self.getInfoFromDB(sqlCommand)
-        returnList = list()
-        for i in val:
-            returnList.append(i)
-        return returnList
+        sqlCommand, params = self._makeQuery(",".join(self.MasterColumns))
+        return list(self.getInfoFromDB(sqlCommand, params))
 
     def getSubjectsFromProject(self, project):
-        sqlCommand = "SELECT DISTINCT subj FROM ({_master_query}) WHERE project='{_projectid}';".format(
-            _master_query=self.MasterQueryFilter,
-            _projectid=project)
-        val = self.getInfoFromDB(sqlCommand)
+        return self._getColumnList('subj', [('project', project)], distinct=True)
+
+    def getExperimentManifest(self):
+        """
+        Return the whole (subject filtered) experiment as nested ordered dictionaries
+
+            manifest[project][subject][session][scantype] = [filenames ordered by Qpos]
+
+        The tree is built from a single query the first time it is requested and kept in
+        memory, so workflow generators can look up every session without further round trips.
+        """
+        if self._manifest is None:
+            sqlCommand, params = self._makeQuery('project, subj, session, type, filename',
+                                                 orderby='project ASC, subj ASC, session ASC, type ASC, Qpos ASC')
+            manifest = OrderedDict()
+            for project, subj, session, scantype, filename in self.getInfoFromDB(sqlCommand, params):
+                scans = manifest.setdefault(str(project), OrderedDict()).setdefault(str(subj), OrderedDict())
+                scans.setdefault(str(session), OrderedDict()).setdefault(str(scantype), list()).append(str(filename))
+            self._manifest = manifest
+        return self._manifest
+
+    def getSessionManifest(self, sessions=None):
+        """
+        Flatten getExperimentManifest() to one entry per session
+
+            sessions[session] = {'project': project, 'subject': subject, 'scans': {scantype: [filenames]}}
+
+        :param sessions: the sessions to be processed, None or ['all'] for every session.  A ValueError is
+                         raised if one of them is found in more than one subject or project; other duplicated
+                         sessions keep their first entry, so that an unrelated row does not stop the pipeline.
+        """
+        check_all = sessions is None or 'all' in sessions
+        requested = set() if check_all else set(sessions)
+        manifest = OrderedDict()
+        for project, subjects in list(self.getExperimentManifest().items()):
+            for subj, subject_sessions in list(subjects.items()):
+                for session, scans in list(subject_sessions.items()):
+                    if session in manifest:
+                        if check_all or session in requested:
+                            raise ValueError("Session {0} found in more than one subject or project".format(session))
+                        continue
+                    manifest[session] = {'project': project, 'subject': subj, 'scans': scans}
+        return manifest
+
+    def getSubjectSessionsDictionary(self):
+        """Return {subject: [sessions]} for every subject in the manifest, each session once (SELECT DISTINCT
+        session), also when the subject is in more than one project."""
+        subject_sessions = OrderedDict()
+        for subjects in list(self.getExperimentManifest().values()):
+            for subj, subject_sessions_dict in list(subjects.items()):
+                sessions = subject_sessions.setdefault(subj, OrderedDict())
+                sessions.update((session, None) for session in subject_sessions_dict)
+        return OrderedDict((subj, list(sessions.keys())) for subj, sessions in list(subject_sessions.items()))
+
+    @staticmethod
+    def getFilenamesFromScans(scans, scantypelist):
+        """Manifest equivalent of getFilenamesByScantype for one session's 'scans' dictionary."""
         returnList = list()
-        for i in val:
-            returnList.append(str(i[0]))
+        for currScanType in scantypelist:
+            returnList.extend(scans.get(currScanType, []))
         return returnList
 
     def getSubjFromSession(self, session):
-        sqlCommand = "SELECT DISTINCT subj FROM ({_master_query}) WHERE session='{_sessionid}';".format(
-            _master_query=self.MasterQueryFilter,
-            _sessionid=session)
-        val = self.getInfoFromDB(sqlCommand)
-        returnList = list()
-        for i in val:
-            returnList.append(str(i[0]))
+        returnList = self._getColumnList('subj', [('session', session)], distinct=True)
         if len(returnList) != 1:
             print("ERROR: More than one subject found")
             sys.exit(-1)
         return returnList[0]
 
     def getProjFromSession(self, session):
-        sqlCommand = "SELECT DISTINCT project FROM ({_master_query}) WHERE session='{_sessionid}';".format(
-            _master_query=self.MasterQueryFilter,
-            _sessionid=session)
-        val = self.getInfoFromDB(sqlCommand)
-        returnList = list()
-        for i in val:
-            returnList.append(str(i[0]))
+        returnList = self._getColumnList('project', [('session', session)], distinct=True)
         if len(returnList) != 1:
             print("ERROR: More than one project found")
             sys.exit(-1)
@@ -272,5 +421,5 @@ class SessionDB(object):
 # a=SessionDB.SessionDB()
 # a=SessionDB.SessionDB('predict_autoworkup.csv',''))
 # a.getFirstScan('42245','T1-30')
-# a.getInfoFromDB("SELECT filename FROM SessionDB WHERE session=42245 ORDER BY type ASC, Qpos ASC;")
+# a.getInfoFromDB("SELECT filename FROM SessionDB WHERE session=? ORDER BY type ASC, Qpos ASC;", ('42245',))
 # a.getInfoFromDB("SELECT DISTINCT subj FROM SessionDB;")
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+benchmark_image_autounwrap.py
+=============================
+
+Time the adjacent slice difference metric of image_autounwrap: the per-slice loop of the first
+implementation against utilities.image_processing.AdjacentSliceDifferences, and the complete
+AutoUnwrapImage, on the given volumes (e.g. the TestData volumes fetched by the build, such as
+ExternalData/TestData/BRAINSABCSmall_T1.nii.gz), or on a synthetic 256x256x176 head.
+
+    PYTHONPATH=AutoWorkup python AutoWorkup/TestSuite/benchmark_image_autounwrap.py [volume ...]
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import SimpleITK as sitk
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utilities.image_processing import AdjacentSliceDifferences, AutoUnwrapImage
+
+
+def loopAutoUnwrap(wrapped_image):
+    """ The three calls of the first one_axis_unwrap, each masking the image and looping over the slices """
+    for axis in range(3):
+        mask = 1.0 - sitk.OtsuThreshold(wrapped_image)
+        mask = sitk.BinaryClosingByReconstruction(mask, [6, 6, 6])
+        image_as_np = sitk.GetArrayFromImage(wrapped_image * sitk.Cast(mask, wrapped_image.GetPixelIDValue()))
+        slice_values = loopSliceDifferences(image_as_np, axis)
+        derivative = (np.roll(slice_values, -1) - np.roll(slice_values, 1)) / 2.0
+        unwrapped_image = sitk.GetImageFromArray(np.roll(sitk.GetArrayFromImage(wrapped_image),
+                                                         -int(np.argmax(derivative)), axis))
+        unwrapped_image.CopyInformation(wrapped_image)
+        wrapped_image = unwrapped_image
+    return wrapped_image
+
+
+def loopSliceDifferences(image_as_np, axis):
+    """ The slice loop of the first one_axis_unwrap, without the clipping """
+    slice_values = list()
+    last_slice = image_as_np.shape[axis]
+    for ii in range(0, last_slice):
+        next_index = (ii + 1) % last_slice
+        curr_slice = np.take(image_as_np, ii, axis).flatten()
+        next_slice = np.take(image_as_np, next_index, axis).flatten()
+        diff = curr_slice - next_slice
+        diff = diff * diff
+        slice_values.append(np.sum(diff))
+    return slice_values
+
+
+def syntheticHead():
+    z, y, x = np.mgrid[0:176, 0:256, 0:256]
+    head = ((z - 88) / 70.0) ** 2 + ((y - 128) / 100.0) ** 2 + ((x - 128) / 80.0) ** 2 < 1
+    rng = np.random.RandomState(0)
+    return sitk.GetImageFromArray((head * (800 + rng.rand(*head.shape) * 50)).astype(np.float32))
+
+
+def timeIt(function, *args):
+    start = time.time()
+    result = function(*args)
+    return result, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('volumes', nargs='*', help='volumes to unwrap')
+    args = parser.parse_args()
+
+    images = [(volume, sitk.ReadImage(volume)) for volume in args.volumes]
+    if len(images) == 0:
+        head = syntheticHead()
+        wrapped = sitk.GetImageFromArray(np.roll(sitk.GetArrayFromImage(head), 60, axis=0))
+        images = [('synthetic', head), ('synthetic_wrapped', wrapped)]
+    print("{0:30s} {1:>12s} {2:>10s} {3:>10s} {4:>12s} {5:>12s}".format(
+        'volume', 'size', 'loop (s)', 'numpy (s)', 'loop unwrap', 'unwrap (s)'))
+    for name, image in images:
+        image_as_np = sitk.GetArrayFromImage(sitk.Cast(image, sitk.sitkFloat64))
+        loop_values, loop_time = timeIt(lambda: [loopSliceDifferences(image_as_np, axis) for axis in range(3)])
+        numpy_values, numpy_time = timeIt(AdjacentSliceDifferences, image_as_np)
+        for axis in range(3):
+            np.testing.assert_allclose(numpy_values[axis], loop_values[axis], rtol=1e-10)
+        _, loop_unwrap_time = timeIt(loopAutoUnwrap, image)
+        (_, rolls), unwrap_time = timeIt(AutoUnwrapImage, image)
+        print("{0:30s} {1:>12s} {2:10.3f} {3:10.3f} {4:12.3f} {5:12.3f}  rolls {6}".format(
+            os.path.basename(name), 'x'.join(str(size) for size in image.GetSize()), loop_time, numpy_time,
+            loop_unwrap_time, unwrap_time, rolls))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import numpy as np
+import SimpleITK as sitk
+
+from workflows.FixLabelMapsTools import FixLabelMapFromNeuromorphemetrics2012
+
+FREESURFER_DICT = {'BRAINSTEM': 16, 'RH_CSF': 24, 'LH_CSF': 24, 'BLOOD': 15000, 'UNKNOWN': 999,
+                   'CONNECTED': [11, 12, 13, 9, 17, 26, 50, 51, 52, 48, 53, 58]}
+
+
+def _fix_with_image_arithmetic(fusionFN, FixedHeadFN, posterior_dict, LeftHemisphereFN, OUT_DICT):
+    """ The SimpleITK image expression version of FixLabelMapFromNeuromorphemetrics2012 """
+    from utilities.labelMaps import MinimizeSizeOfImage
+    from utilities.labelTopology import RecodeNonLargest
+
+    def ForceMaskInsert(inlabels, newmask, newmaskvalue):
+        inlabels = sitk.Cast(inlabels, sitk.sitkUInt32)
+        newmask = sitk.Cast((newmask > 0), sitk.sitkUInt32)
+        outlabels = inlabels * sitk.Cast((1 - newmask), sitk.sitkUInt32)
+        outlabels = outlabels + newmask * newmaskvalue
+        return sitk.Cast(outlabels, sitk.sitkUInt32)
+
+    outlabels = sitk.Cast(sitk.ReadImage(fusionFN), sitk.sitkUInt32)
+    FixedHead = sitk.Cast(sitk.ReadImage(FixedHeadFN), sitk.sitkUInt32)
+    lbl_orig_mask = (outlabels > 0)
+    lbl_outter_ring = sitk.BinaryDilate(lbl_orig_mask, [2, 2, 2]) - lbl_orig_mask
+    vb_post = sitk.ReadImage(posterior_dict["VB"])
+    ring_vb = lbl_outter_ring * sitk.BinaryThreshold(vb_post, 0.5, 1.01, 1, 0)
+    inner_vb = lbl_orig_mask * sitk.BinaryThreshold(vb_post, 0.85, 1.01, 1, 0)
+    blood_labels = (FixedHead == 5) * (outlabels == 0 | outlabels == 999) | ring_vb | inner_vb
+    outlabels = ForceMaskInsert(outlabels, blood_labels, OUT_DICT['BLOOD'])
+    csf_post = sitk.ReadImage(posterior_dict["CSF"])
+    ring_csf = lbl_outter_ring * sitk.BinaryThreshold(csf_post, 0.5, 1.01, 1, 0)
+    inner_csf = lbl_orig_mask * sitk.BinaryThreshold(csf_post, 0.85, 1.01, 1, 0)
+    csf_labels = (FixedHead == 4) * (outlabels == 0 | outlabels == 999) | ring_csf | inner_csf
+    outlabels = ForceMaskInsert(outlabels, csf_labels, OUT_DICT['RH_CSF'])
+    LeftHemisphereIm = sitk.Cast(sitk.ReadImage(LeftHemisphereFN), sitk.sitkUInt32)
+    outlabels = ForceMaskInsert(outlabels, (outlabels == OUT_DICT['LH_CSF']), OUT_DICT['RH_CSF'])
+    left_hemi_post = (LeftHemisphereIm * sitk.Cast((outlabels == OUT_DICT['RH_CSF']), sitk.sitkUInt32) > 0)
+    outlabels = ForceMaskInsert(outlabels, left_hemi_post, OUT_DICT['LH_CSF'])
+    for misLabel in [0, 7, 46]:
+        brain_stem = (FixedHead == 30) * (outlabels == misLabel)
+        outlabels = ForceMaskInsert(outlabels, brain_stem, OUT_DICT['BRAINSTEM'])
+    VALID_REGION = sitk.Cast((FixedHead > 0) | ring_csf | inner_csf | ring_vb | inner_vb, sitk.sitkUInt32)
+    outlabels = outlabels * VALID_REGION
+    outlabels = RecodeNonLargest(outlabels, OUT_DICT['CONNECTED'], OUT_DICT['UNKNOWN'])
+    outlabels = ForceMaskInsert(outlabels, (VALID_REGION > 0) * (outlabels == 0), OUT_DICT['UNKNOWN'])
+    return MinimizeSizeOfImage(outlabels)
+
+
+def test_fix_label_map_matches_image_arithmetic(tmpdir):
+    rng = np.random.RandomState(0)
+    shape = (18, 20, 22)
+    fusion = np.zeros(shape, dtype=np.int16)
+    fusion[3:15, 4:16, 4:18] = rng.choice([7, 11, 12, 24, 46, 999, 48, 0], size=(12, 12, 14))
+    fixedHead = rng.choice([0, 1, 4, 5, 30], size=shape).astype(np.uint8)
+    leftHemisphere = np.zeros(shape, dtype=np.uint8)
+    leftHemisphere[:, :, :11] = 1
+    images = {'fusion': fusion, 'fixedHead': fixedHead, 'left': leftHemisphere,
+              'VB': rng.rand(*shape).astype(np.float32), 'CSF': rng.rand(*shape).astype(np.float32)}
+    paths = dict()
+    for name, array in images.items():
+        image = sitk.GetImageFromArray(array)
+        image.SetSpacing((1.0, 1.1, 1.2))
+        paths[name] = str(tmpdir.join(name + '.nii.gz'))
+        sitk.WriteImage(image, paths[name])
+    posterior_dict = {'VB': paths['VB'], 'CSF': paths['CSF']}
+
+    expected = _fix_with_image_arithmetic(paths['fusion'], paths['fixedHead'], posterior_dict, paths['left'],
+                                          FREESURFER_DICT)
+    fixedFN = FixLabelMapFromNeuromorphemetrics2012(paths['fusion'], paths['fixedHead'], posterior_dict,
+                                                    paths['left'], str(tmpdir.join('fixed.nii.gz')), FREESURFER_DICT)
+    fixed = sitk.ReadImage(fixedFN)
+    assert fixed.GetPixelID() == expected.GetPixelID()
+    assert fixed.GetSpacing() == expected.GetSpacing()
+    np.testing.assert_array_equal(sitk.GetArrayFromImage(fixed), sitk.GetArrayFromImage(expected))
@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+import SimpleITK as sitk
+
+from PipeLineFunctionHelpers import AccumulateLikeTissuePosteriors, FixWMPartitioning, \
+    MakeInclusionMaskForGMStructures, PostProcessPosteriors, POSTERIORS
+
+
+def _write_posteriors(tmpdir):
+    rng = np.random.RandomState(0)
+    posteriorImages = list()
+    for name in POSTERIORS:
+        posterior = rng.rand(7, 8, 9).astype(np.float32)
+        posterior[rng.rand(*posterior.shape) < 0.1] = 1.0  # reach the WM inclusion threshold
+        image = sitk.GetImageFromArray(posterior)
+        image.SetSpacing((1.0, 1.5, 2.0))
+        posteriorImages.append(str(tmpdir.join('POSTERIOR_{0}.nii.gz'.format(name))))
+        sitk.WriteImage(image, posteriorImages[-1])
+    return posteriorImages
+
+
+def test_streaming_accumulation_matches_image_sums(tmpdir, monkeypatch):
+    posteriorImages = _write_posteriors(tmpdir)
+    groups = {'POSTERIOR_GM_TOTAL.nii.gz': ['SURFGM', 'BASAL', 'THALAMUS', 'HIPPOCAMPUS', 'CRBLGM'],
+              'POSTERIOR_WM_TOTAL.nii.gz': ['CRBLWM', 'WM'],
+              'POSTERIOR_BACKGROUND_TOTAL.nii.gz': ['AIR', 'NOTCSF', 'NOTGM', 'NOTVB', 'NOTWM']}
+    for backgroundWriter in [False, True]:
+        outputDir = tmpdir.mkdir('background' if backgroundWriter else 'foreground')
+        monkeypatch.chdir(outputDir)
+        AccumulatePriorsList, AccumulatePriorsNames = AccumulateLikeTissuePosteriors(posteriorImages,
+                                                                                     backgroundWriter)
+        assert [os.path.basename(fileName) for fileName in AccumulatePriorsList] == AccumulatePriorsNames
+        for outname, members in groups.items():
+            expected = sitk.ReadImage(str(tmpdir.join('POSTERIOR_{0}.nii.gz'.format(members[0]))))
+            for member in members[1:]:
+                expected = expected + sitk.ReadImage(str(tmpdir.join('POSTERIOR_{0}.nii.gz'.format(member))))
+            accumulated = sitk.ReadImage(str(outputDir.join(outname)))
+            assert accumulated.GetPixelID() == sitk.sitkFloat32
+            assert accumulated.GetSpacing() == expected.GetSpacing()
+            np.testing.assert_array_equal(sitk.GetArrayFromImage(accumulated), sitk.GetArrayFromImage(expected))
+
+
+def test_fused_post_processing_matches_separate_nodes(tmpdir, monkeypatch):
+    posteriorImages = _write_posteriors(tmpdir)
+    brainLabels = np.zeros((7, 8, 9), dtype=np.uint8)
+    brainLabels[1:6, 1:7, 2:8] = 3
+    brainLabels[3, 4, 5] = 0  # hole to fill
+    brainMaskImage = sitk.GetImageFromArray(brainLabels)
+    brainMaskImage.SetSpacing((1.0, 1.5, 2.0))
+    brainMask = str(tmpdir.join('brainLabels.nii.gz'))
+    sitk.WriteImage(brainMaskImage, brainMask)
+
+    monkeypatch.chdir(tmpdir.mkdir('separate'))
+    expected = FixWMPartitioning(brainMask, posteriorImages)
+    expected += AccumulateLikeTissuePosteriors(expected[0])
+    expected += (MakeInclusionMaskForGMStructures(
+        dict((name, str(tmpdir.join('POSTERIOR_{0}.nii.gz'.format(name)))) for name in POSTERIORS),
+        'RF12_CandidateRegionMask.nii.gz'),)
+
+    for backgroundWriter in [False, True]:
+        monkeypatch.chdir(tmpdir.mkdir('fused{0}'.format(int(backgroundWriter))))
+        fused = PostProcessPosteriors(brainMask, posteriorImages, backgroundWriter=backgroundWriter)
+        assert fused[1:3] == expected[1:3]
+        assert fused[5] == expected[5]
+        fusedFiles = list(fused[0]) + [fused[3]] + list(fused[4]) + [fused[6]]
+        expectedFiles = list(expected[0]) + [expected[3]] + list(expected[4]) + [expected[6]]
+        assert [os.path.basename(fileName) for fileName in fusedFiles] == \
+            [os.path.basename(fileName) for fileName in expectedFiles]
+        for fusedFile, expectedFile in zip(fusedFiles, expectedFiles):
+            fusedImage = sitk.ReadImage(fusedFile)
+            expectedImage = sitk.ReadImage(expectedFile)
+            assert fusedImage.GetPixelID() == expectedImage.GetPixelID()
+            assert fusedImage.GetSpacing() == expectedImage.GetSpacing()
+            np.testing.assert_array_equal(sitk.GetArrayFromImage(fusedImage), sitk.GetArrayFromImage(expectedImage))
@@ -0,0 +1,163 @@
+import os
+
+from SessionDB import SessionDB
+
+
+def _make_subject_csv(tmpdir):
+    for image in ['a.nii.gz', 'b.nii.gz', 'c.nii.gz', 'd.nii.gz']:
+        tmpdir.join(image).write('')
+    subject_csv = tmpdir.join('subjects.csv')
+    subject_csv.write('\n'.join([
+        'project,subj,session,imagefiles',
+        '#P0,S0,ses0,"{\'T1-30\':[\'/a.nii.gz\']}"',
+        'P1,S1,ses1,"{\'T1-30\':[\'/a.nii.gz\',\'/b.nii.gz\'],\'T2-30\':[\'/c.nii.gz\']}"',
+        'P2,S2,ses2,"{\'T1-15\':[\'/d.nii.gz\']}"',
+        '']))
+    return str(subject_csv)
+
+
+def test_make_new_db_and_query(tmpdir):
+    subject_csv = _make_subject_csv(tmpdir)
+    db_file = str(tmpdir.join('subjects.db'))
+    prefix = str(tmpdir)
+    SessionDB(db_file, ['all']).MakeNewDB(subject_csv, prefix)
+
+    database = SessionDB(db_file, ['all'])
+    assert sorted(database.getAllSessions()) == ['ses1', 'ses2']
+    assert sorted(database.getAllProjects()) == ['P1', 'P2']
+    assert database.getFilenamesByScantype('ses1', ['T1-30', 'T2-30']) == [
+        os.path.join(prefix, 'a.nii.gz'), os.path.join(prefix, 'b.nii.gz'), os.path.join(prefix, 'c.nii.gz')]
+    assert database.getFirstT1('ses1') == os.path.join(prefix, 'a.nii.gz')
+    assert database.findScanTypeLength('ses1', ['T1-30']) == 2
+    assert database.getSubjFromSession('ses2') == 'S2'
+    assert database.getProjFromSession('ses1') == 'P1'
+
+    indexes = [row[0] for row in database.getInfoFromDB("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='MasterDB';")]
+    assert sorted(indexes) == sorted(SessionDB.MasterIndexes.keys())
+
+
+def test_subject_filter_is_parameterized(tmpdir):
+    subject_csv = _make_subject_csv(tmpdir)
+    db_file = str(tmpdir.join('subjects.db'))
+    SessionDB(db_file, ['all']).MakeNewDB(subject_csv, str(tmpdir))
+
+    database = SessionDB(db_file, ['S2'])
+    assert database.getAllSessions() == ['ses2']
+    assert database.getSessionsFromSubject('S1') == []
+    assert SessionDB(db_file, ["S1' OR '1'='1"]).getAllSessions() == []
+
+
+def test_experiment_manifest(tmpdir):
+    subject_csv = _make_subject_csv(tmpdir)
+    db_file = str(tmpdir.join('subjects.db'))
+    prefix = str(tmpdir)
+    SessionDB(db_file, ['all']).MakeNewDB(subject_csv, prefix)
+
+    database = SessionDB(db_file, ['all'])
+    manifest = database.getExperimentManifest()
+    assert list(manifest.keys()) == ['P1', 'P2']
+    assert manifest['P1']['S1']['ses1']['T1-30'] == [os.path.join(prefix, 'a.nii.gz'), os.path.join(prefix, 'b.nii.gz')]
+
+    sessions = database.getSessionManifest()
+    assert sessions['ses2']['subject'] == 'S2'
+    for session in ['ses1', 'ses2']:
+        for scantypes in [['T1-15', 'T1-30'], ['T2-30'], ['FL-30']]:
+            assert SessionDB.getFilenamesFromScans(sessions[session]['scans'], scantypes) == \
+                database.getFilenamesByScantype(session, scantypes)
+    assert database.getSubjectSessionsDictionary() == {'S1': ['ses1'], 'S2': ['ses2']}
+
+
+def test_subject_sessions_of_a_subject_in_two_projects(tmpdir):
+    subject_csv = _make_subject_csv(tmpdir)
+    with open(subject_csv, 'a') as fid:
+        fid.write('P4,S1,ses1,"{\'T1-15\':[\'/d.nii.gz\']}"\n')
+        fid.write('P4,S1,ses3,"{\'T1-30\':[\'/c.nii.gz\']}"\n')
+    db_file = str(tmpdir.join('subjects.db'))
+    SessionDB(db_file, ['all']).MakeNewDB(subject_csv, str(tmpdir))
+
+    database = SessionDB(db_file, ['all'])
+    subject_sessions = database.getSubjectSessionsDictionary()
+    assert subject_sessions == {'S1': ['ses1', 'ses3'], 'S2': ['ses2']}
+    for subj, sessions in list(subject_sessions.items()):
+        assert sorted(sessions) == sorted(database.getSessionsFromSubject(subj))
+
+
+def test_update_db_is_incremental(tmpdir, monkeypatch):
+    subject_csv = _make_subject_csv(tmpdir)
+    db_file = str(tmpdir.join('subjects.db'))
+    prefix = str(tmpdir)
+    SessionDB(db_file, ['all']).UpdateDB(subject_csv, prefix)
+    assert sorted(SessionDB(db_file, ['all']).getFileStats().keys()) == [
+        os.path.join(prefix, image) for image in ['a.nii.gz', 'b.nii.gz', 'c.nii.gz', 'd.nii.gz']]
+
+    tmpdir.join('e.nii.gz').write('')
+    lines = open(subject_csv).read().splitlines()
+    lines[3] = 'P2,S2,ses2,"{\'T1-15\':[\'/d.nii.gz\'],\'T2-15\':[\'/e.nii.gz\']}"'
+    lines.append('P3,S3,ses3,"{\'T1-30\':[\'/e.nii.gz\']}"')
+    open(subject_csv, 'w').write('\n'.join(lines))
+
+    stat_calls = list()
+    original_stat = SessionDB._statFile
+
+    def recording_stat(image_path):
+        stat_calls.append(image_path)
+        return original_stat(image_path)
+
+    monkeypatch.setattr(SessionDB, '_statFile', staticmethod(recording_stat))
+    SessionDB(db_file, ['all']).UpdateDB(subject_csv, prefix)
+    assert sorted(stat_calls) == [os.path.join(prefix, image) for image in ['d.nii.gz', 'e.nii.gz']]
+
+    database = SessionDB(db_file, ['all'])
+    assert sorted(database.getAllSessions()) == ['ses1', 'ses2', 'ses3']
+    assert database.getFilenamesByScantype('ses2', ['T1-15', 'T2-15']) == [
+        os.path.join(prefix, 'd.nii.gz'), os.path.join(prefix, 'e.nii.gz')]
+    assert len(database.getEverything()) == 6
+
+
+def test_malformed_rows_are_reported_with_line_numbers(tmpdir):
+    from utilities.subjectListReader import readSubjectList
+
+    subject_csv = _make_subject_csv(tmpdir)
+    with open(subject_csv, 'a') as fid:
+        fid.write('P4,S4,ses4,"{\'T1-30\': __import__(\'os\').getcwd()}"\n')
+        fid.write('P5,S5\n')
+    errors = list()
+    records = list(readSubjectList(subject_csv, errors=errors))
+    assert [record.session for record in records] == ['ses1', 'ses2']
+    assert records[0].imagefiles == {'T1-30': ['/a.nii.gz', '/b.nii.gz'], 'T2-30': ['/c.nii.gz']}
+    assert [str(err).split(': ')[0] for err in errors] == [subject_csv + ':5', subject_csv + ':6']
+
+
+def test_session_manifest_duplicates(tmpdir):
+    import pytest
+
+    subject_csv = _make_subject_csv(tmpdir)
+    with open(subject_csv, 'a') as fid:
+        fid.write('P3,S3,ses2,"{\'T1-30\':[\'/c.nii.gz\']}"\n')
+    db_file = str(tmpdir.join('subjects.db'))
+    SessionDB(db_file, ['all']).MakeNewDB(subject_csv, str(tmpdir))
+
+    database = SessionDB(db_file, ['all'])
+    assert database.getSessionManifest(['ses1'])['ses2']['subject'] == 'S2'
+    with pytest.raises(ValueError):
+        database.getSessionManifest(['ses2'])
+    with pytest.raises(ValueError):
+        database.getSessionManifest(['all'])
+
+
+def test_session_literal_lines(tmpdir):
+    from utilities.subjectListReader import isSessionLiteralList, readSessionLiteralList
+
+    literal_list = tmpdir.join('screenshots.list')
+    literal_list.write('\n'.join([
+        "['project', 'subject', 'session', 'imagefiles']",
+        "('P1', 'S1', 'ses1', \"{'T1-30': ['/a.nii.gz', '/b.nii.gz']}\")",
+        "('P2', 'S2', 'ses2', \"{'T1-30': __import__('os').getcwd()}\")",
+        '']))
+    assert isSessionLiteralList(str(literal_list))
+    assert not isSessionLiteralList(_make_subject_csv(tmpdir))
+    errors = list()
+    records = list(readSessionLiteralList(str(literal_list), errors=errors))
+    assert [(record.session, record.imagefiles) for record in records] == [
+        ('ses1', {'T1-30': ['/a.nii.gz', '/b.nii.gz']})]
+    assert [str(err).split(': ')[0] for err in errors] == [str(literal_list) + ':3']
@@ -0,0 +1,159 @@
+import json
+
+import numpy as np
+import SimpleITK as sitk
+
+from atlasSmallIslandCleanup import DustCleanup, VectorizedDustCleanup, runDustCleanupStages
+
+
+def _make_images(tmpdir, tiled=False):
+    rng = np.random.RandomState(0)
+    if tiled:
+        # separate tiles, each framed by its own label thicker than the cleaning regions extend beyond
+        # the tile labels, so the labels of different tiles share no neighbor and are cleaned concurrently
+        labels = np.zeros((20, 42, 46), dtype=np.int16)
+        for tile, (y, x) in enumerate([(0, 0), (21, 0), (0, 23), (21, 23)]):
+            tileLabels = [10 + tile, 20 + tile, 30 + tile]
+            labels[:, y:y + 20, x:x + 22] = 40 + tile
+            labels[:, y + 3:y + 17, x + 3:x + 11] = tileLabels[0]
+            labels[:, y + 3:y + 17, x + 11:x + 19] = tileLabels[1]
+            tileView = labels[:, y + 3:y + 17, x + 3:x + 19]
+            dust = rng.rand(*tileView.shape) < 0.06
+            tileView[dust] = rng.choice(tileLabels, size=dust.sum())
+    else:
+        labels = np.zeros((24, 26, 28), dtype=np.int16)
+        labels[2:22, 2:13, 2:26] = 4
+        labels[2:22, 13:24, 2:14] = 21
+        labels[2:22, 13:24, 14:26] = 999
+        labels[6:18, 6:20, 6:22] = 15000
+        dust = rng.rand(*labels.shape) < 0.04
+        labels[dust] = rng.choice([0, 4, 21, 999, 15000], size=dust.sum())
+    t1 = (labels.astype(np.float32) % 97) * 3 + rng.randint(0, 40, size=labels.shape)
+    t2 = (labels.astype(np.float32) % 89) * 5 + rng.randint(0, 40, size=labels.shape)
+    return _write_images(tmpdir, labels, t1, t2)
+
+
+def _write_images(tmpdir, labels, t1, t2):
+    paths = dict()
+    for name, array in [('atlas', labels), ('t1', t1), ('t2', t2)]:
+        image = sitk.GetImageFromArray(array)
+        image.SetSpacing((1.0, 1.2, 0.9))
+        paths[name] = str(tmpdir.join(name + '.nii.gz'))
+        sitk.WriteImage(image, paths[name])
+    return paths
+
+
+def _run(cleanupClass, paths, outputName, **options):
+    arguments = {'--inputAtlasPath': paths['atlas'],
+                 '--outputAtlasPath': paths['atlas'].replace('atlas', outputName),
+                 '--inputT1Path': paths['t1'],
+                 '--inputT2Path': paths['t2'],
+                 '--includeLabelsList': None,
+                 '--excludeLabelsList': None,
+                 '--useFullyConnectedInConnectedComponentFilter': False,
+                 '--forceSuspiciousLabelChange': False,
+                 '--noDilation': False}
+    arguments.update(options)
+    cleanup = cleanupClass(arguments)
+    cleanup.main()
+    with open(arguments['--outputAtlasPath'].replace('.nii.gz', '_islandStatistics.json')) as reportFile:
+        report = json.load(reportFile)
+    assert sorted(report['labels'].keys()) == sorted(key for key in cleanup.islandStatistics if key != 'Total')
+    assert report['numberOfIslands'] == cleanup.islandStatistics['Total']['numberOfIslands']
+    assert report['peakMemoryMB'] > 0
+    statistics = dict(cleanup.islandStatistics, histograms=cleanup.islandSizeHistograms)
+    return sitk.GetArrayFromImage(sitk.ReadImage(arguments['--outputAtlasPath'])), statistics
+
+
+def test_vectorized_cleanup_matches_reference(tmpdir):
+    paths = _make_images(tmpdir)
+    stages = [{'--maximumIslandVoxelCount': '6', '--forceSuspiciousLabelChange': True,
+               '--noDilation': True, '--includeLabelsList': '999'},
+              {'--maximumIslandVoxelCount': '5', '--useFullyConnectedInConnectedComponentFilter': True,
+               '--forceSuspiciousLabelChange': True, '--excludeLabelsList': '4,5,15000'},
+              {'--maximumIslandVoxelCount': '3'}]
+    for index, options in enumerate(stages):
+        expected, expectedStatistics = _run(DustCleanup, paths, 'reference{0}'.format(index), **options)
+        result, statistics = _run(VectorizedDustCleanup, paths, 'vectorized{0}'.format(index), **options)
+        assert statistics['Total']['numberOfIslandsCleaned'] > 0
+        assert statistics == expectedStatistics
+        np.testing.assert_array_equal(result, expected)
+
+
+def test_parallel_cleanup_matches_serial(tmpdir, monkeypatch):
+    groupSizes = list()
+    getIndependentLabelGroup = VectorizedDustCleanup.getIndependentLabelGroup
+
+    def recordingGetIndependentLabelGroup(self, labelsList, neighborhoods):
+        group = getIndependentLabelGroup(self, labelsList, neighborhoods)
+        groupSizes.append(len(group))
+        return group
+
+    monkeypatch.setattr(VectorizedDustCleanup, 'getIndependentLabelGroup', recordingGetIndependentLabelGroup)
+    for tiled in [True, False]:
+        paths = _make_images(tmpdir.mkdir('tiled' if tiled else 'shared'), tiled=tiled)
+        options = {'--maximumIslandVoxelCount': '5', '--useFullyConnectedInConnectedComponentFilter': True,
+                   '--forceSuspiciousLabelChange': True, '--excludeLabelsList': '0,40,41,42,43'}
+        serial, serialStatistics = _run(VectorizedDustCleanup, paths, 'serial', **options)
+        assert serialStatistics['Total']['numberOfIslandsCleaned'] > 0
+        for workers in ['1', '3']:
+            del groupSizes[:]
+            result, statistics = _run(VectorizedDustCleanup, paths, 'workers{0}'.format(workers),
+                                      **dict(options, **{'--workers': workers}))
+            np.testing.assert_array_equal(result, serial)
+            assert statistics == serialStatistics
+            if tiled:
+                assert max(groupSizes) == 4
+
+
+def test_parallel_cleanup_sees_the_means_of_earlier_labels(tmpdir):
+    # labels 1 and 2 are far apart, but the islands of both are between the target labels 7 and 8:
+    # moving the 20 islands of label 1 into 7 raises its mean enough that the island of label 2 moves
+    # to 7 instead of 8, which a concurrent cleaning of 2 against the means before 1 would miss
+    labels = np.full((2, 12, 40), 8, dtype=np.int16)
+    labels[:, :6] = 7
+    t1 = np.where(labels == 7, 100.0, 200.0).astype(np.float32)
+    labels[:, :, 0:4] = 1
+    labels[:, :, 36:40] = 2
+    for z in range(2):
+        for x in range(5 + z, 25, 2):
+            labels[z, 5, x] = 1
+            t1[z, 5, x] = 120
+    labels[0, 5, 33] = 2
+    t1[0, 5, 33] = 150.2
+    paths = _write_images(tmpdir, labels, t1, np.zeros_like(t1))
+    options = {'--maximumIslandVoxelCount': '1', '--forceSuspiciousLabelChange': True, '--noDilation': True,
+               '--excludeLabelsList': '7,8'}
+    serial, serialStatistics = _run(VectorizedDustCleanup, paths, 'serial', **options)
+    assert serial[0, 5, 33] == 7
+    result, statistics = _run(VectorizedDustCleanup, paths, 'workers', **dict(options, **{'--workers': '2'}))
+    np.testing.assert_array_equal(result, serial)
+    assert statistics == serialStatistics
+
+
+def test_fused_stages_match_chained_runs(tmpdir):
+    paths = _make_images(tmpdir)
+    suspicious, suspiciousStatistics = _run(VectorizedDustCleanup, paths, 'suspicious',
+                                            **{'--maximumIslandVoxelCount': '6', '--forceSuspiciousLabelChange': True,
+                                               '--noDilation': True, '--includeLabelsList': '999'})
+    chainedPaths = dict(paths, atlas=paths['atlas'].replace('atlas', 'suspicious'))
+    chained, chainedStatistics = _run(VectorizedDustCleanup, chainedPaths, 'chained',
+                                      **{'--maximumIslandVoxelCount': '5', '--forceSuspiciousLabelChange': True,
+                                         '--useFullyConnectedInConnectedComponentFilter': True,
+                                         '--excludeLabelsList': '4,15000'})
+
+    fusedPath = str(tmpdir.join('fused.nii.gz'))
+    stageStatistics = runDustCleanupStages(paths['atlas'], fusedPath, paths['t1'],
+                                           [{'maxIslandCount': 6, 'forceLabelChange': True, 'noDilation': True,
+                                             'includeList': '999'},
+                                            {'maxIslandCount': 5, 'forceLabelChange': True, 'useFullyConnected': True,
+                                             'excludeList': '4,15000'}],
+                                           inputT2Path=paths['t2'], stageStatisticsPrefix=str(tmpdir.join('fused')))
+    histograms = [suspiciousStatistics.pop('histograms'), chainedStatistics.pop('histograms')]
+    assert stageStatistics == [suspiciousStatistics, chainedStatistics]
+    with open(str(tmpdir.join('fused_islandStatistics.json'))) as reportFile:
+        report = json.load(reportFile)
+    assert [stage['labels']['999']['islandSizeHistogram'] for stage in report['stages']] == \
+        [histogram['999'] for histogram in histograms]
+    np.testing.assert_array_equal(sitk.GetArrayFromImage(sitk.ReadImage(fusedPath)), chained)
+    assert tmpdir.join('fused_stage2_islandStatistics.csv').readlines()[0].startswith('Label,')
@@ -0,0 +1,109 @@
+import csv
+import os
+import sys
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+                           'BRAINSRefacer', 'scripts')
+sys.path.insert(0, os.path.abspath(SCRIPTS_DIR))
+import BatchDefaceAfterBAW
+from DefaceAfterBAW import BRAIN_LABEL_RELATIVE_FN, LANDMARKS_RELATIVE_FN, getDefaceOutputFileNames
+
+
+def _touch(*parts):
+    fn = os.path.join(*parts)
+    if not os.path.isdir(os.path.dirname(fn)):
+        os.makedirs(os.path.dirname(fn))
+    open(fn, 'w').close()
+    return fn
+
+
+def _make_results_tree(root):
+    """
+    sessA: both images defaced already, sessB: no brain label, sessC: no images, sessD: unreadable inputs
+    """
+    sessions = dict((name, os.path.join(root, 'PROJ', subject, name))
+                    for subject, name in [('subj1', 'sessA'), ('subj1', 'sessB'), ('subj2', 'sessC'),
+                                          ('subj2', 'sessD')])
+    for session_dir in sessions.values():
+        _touch(session_dir, LANDMARKS_RELATIVE_FN)
+    images = dict()
+    for name in ['sessA', 'sessB', 'sessD']:
+        images[name] = [_touch(sessions[name], 'DEFACE', 'T2_acpc.nii.gz'),
+                        _touch(sessions[name], 'TissueClassify', 't1_average_BRAINSABC.nii.gz')]
+        _touch(sessions[name], 'DEFACE', 'T1_deface.nii.gz')
+    for name in ['sessA', 'sessC', 'sessD']:
+        _touch(sessions[name], BRAIN_LABEL_RELATIVE_FN)
+    for image_fn in images['sessA']:
+        for output_fn in getDefaceOutputFileNames(image_fn).values():
+            _touch(output_fn)
+    ## not a session of its own, it is inside of one
+    _touch(sessions['sessA'], 'nested', LANDMARKS_RELATIVE_FN)
+    _touch(root, 'PROJ', 'notASession', 'TissueClassify', 't1_average_BRAINSABC.nii.gz')
+    return sessions, images
+
+
+def _read_index(index_csv_fn):
+    with open(index_csv_fn) as index_file:
+        return list(csv.DictReader(index_file))
+
+
+def test_find_sessions_and_manifest(tmpdir):
+    sessions, images = _make_results_tree(str(tmpdir))
+    assert BatchDefaceAfterBAW.findSessionDirs(str(tmpdir)) == [sessions[name] for name in sorted(sessions)]
+    expected = [(sessions[name], [images[name][1], images[name][0]]) for name in ['sessA', 'sessB', 'sessD']]
+    assert BatchDefaceAfterBAW.findSessions(str(tmpdir), BatchDefaceAfterBAW.DEFAULT_IMAGE_PATTERNS) == expected
+
+    manifest_fn = str(tmpdir.join('manifest.list'))
+    with open(manifest_fn, 'w') as manifest:
+        manifest.write('# images to deface\n\n')
+        manifest.write('\n'.join([images['sessD'][0], images['sessA'][1] + ',T1', images['sessA'][0]]) + '\n')
+    assert BatchDefaceAfterBAW.readManifest(manifest_fn) == \
+        [(sessions['sessA'], [images['sessA'][1], images['sessA'][0]]), (sessions['sessD'], [images['sessD'][0]])]
+
+
+def test_deface_sessions_index(tmpdir):
+    sessions, images = _make_results_tree(str(tmpdir))
+    found = BatchDefaceAfterBAW.findSessions(str(tmpdir), BatchDefaceAfterBAW.DEFAULT_IMAGE_PATTERNS)
+    for workers in [1, 2]:
+        index_csv_fn = str(tmpdir.join('index{0}.csv'.format(workers)))
+        status_counts = BatchDefaceAfterBAW.defaceSessions(found, index_csv_fn, workers=workers)
+        assert status_counts == {'skipped': 2, 'missing_inputs': 2, 'failed': 2}
+        rows = dict((row['image'], row) for row in _read_index(index_csv_fn))
+        assert len(rows) == 6
+        for image_fn in images['sessA']:
+            assert rows[image_fn]['status'] == 'skipped'
+            assert rows[image_fn]['deface_image'] == getDefaceOutputFileNames(image_fn)['deface_image']
+        for image_fn in images['sessB']:
+            assert rows[image_fn]['status'] == 'missing_inputs'
+            assert rows[image_fn]['message'] == BRAIN_LABEL_RELATIVE_FN
+            assert rows[image_fn]['deface_image'] == ''
+        for image_fn in images['sessD']:
+            assert rows[image_fn]['status'] == 'failed'
+            assert rows[image_fn]['session_dir'] == sessions['sessD']
+
+    ## with --overwrite the defaced images of sessA are done again, and fail on the empty inputs
+    status_counts = BatchDefaceAfterBAW.defaceSessions(found[:1], str(tmpdir.join('overwrite.csv')),
+                                                       overwrite=True)
+    assert status_counts == {'failed': 2}
+
+
+def _crashing_deface_session(session_dir, images, overwrite=False):
+    if session_dir.endswith('sessB'):
+        os._exit(1)
+    return BatchDefaceAfterBAW.defaceSession(session_dir, images, overwrite)
+
+
+def test_crashed_worker_fails_its_session_only(tmpdir, monkeypatch):
+    sessions, images = _make_results_tree(str(tmpdir))
+    found = BatchDefaceAfterBAW.findSessions(str(tmpdir), BatchDefaceAfterBAW.DEFAULT_IMAGE_PATTERNS)
+    monkeypatch.setattr(BatchDefaceAfterBAW, 'defaceSession', _crashing_deface_session)
+    index_csv_fn = str(tmpdir.join('index.csv'))
+    status_counts = BatchDefaceAfterBAW.defaceSessions(found, index_csv_fn, workers=2)
+    rows = _read_index(index_csv_fn)
+    ## the sessions still pending in the broken pool fail too, but every image is in the index once
+    assert sorted(row['image'] for row in rows) == sorted(sum(images.values(), []))
+    assert sum(status_counts.values()) == 6
+    for row in rows:
+        if row['session_dir'] == sessions['sessB']:
+            assert row['status'] == 'failed'
+            assert 'BrokenProcessPool' in row['message'] or 'terminated abruptly' in row['message']
@@ -0,0 +1,114 @@
+import os
+import sys
+
+import numpy as np
+import SimpleITK as sitk
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+                           'BRAINSRefacer', 'scripts')
+sys.path.insert(0, os.path.abspath(SCRIPTS_DIR))
+import DefaceAfterBAW
+from utilities.landmarkIO import WriteLandmarks
+
+## RAS, as in the BCD_ACPC_Landmarks.fcsv files
+LANDMARKS = {'AC': (0.0, 0.0, 10.0), 'PC': (0.0, -25.0, 10.0), 'RE': (30.0, 50.0, -25.0),
+             'LE': (-30.0, 50.0, -25.0)}
+
+
+def _make_session(session_dir):
+    """
+    An ellipsoid head with an ellipsoid brain in anisotropic LPS images of a BAW session directory: the whole
+    head, and a field of view of the back of the head without the face
+    """
+    for sub_dir in ['TissueClassify', 'ACPCAlign', 'JointFusion']:
+        os.makedirs(os.path.join(session_dir, sub_dir))
+    z, y, x = np.mgrid[0:40, 0:48, 0:40]
+    head = ((x - 20) / 16.) ** 2 + ((y - 24) / 20.) ** 2 + ((z - 20) / 18.) ** 2 < 1
+    rng = np.random.RandomState(0)
+    t1 = sitk.GetImageFromArray((head * (500 + rng.rand(*head.shape) * 100)).astype(np.int16))
+    t1.SetSpacing((3.0, 2.5, 2.75))
+    ## no voxel centers half way between those of the identity grid, whose nearest neighbor depends on round off
+    t1.SetOrigin((-60.3, -60.2, -55.35))
+    t1_fn = os.path.join(session_dir, 'TissueClassify', 't1_average_BRAINSABC.nii.gz')
+    sitk.WriteImage(t1, t1_fn)
+    back_of_head = t1[:, 16:, 6:]
+    back_of_head_fov = sitk.Image(40, 32, 36, sitk.sitkInt16)
+    back_of_head_fov.SetSpacing(back_of_head.GetSpacing())
+    back_of_head_fov.SetOrigin(back_of_head.GetOrigin())
+    back_of_head_fov = sitk.Paste(back_of_head_fov, back_of_head, back_of_head.GetSize(), [0, 0, 0], [0, 0, 0])
+    t2_fn = os.path.join(session_dir, 'TissueClassify', 't2_average_BRAINSABC.nii.gz')
+    sitk.WriteImage(back_of_head_fov, t2_fn)
+    brain = ((x - 20) / 11.) ** 2 + ((y - 26) / 12.) ** 2 + ((z - 23) / 12.) ** 2 < 1
+    brain_label = sitk.GetImageFromArray(brain.astype(np.uint8) * 3)
+    brain_label.CopyInformation(t1)
+    sitk.WriteImage(brain_label, os.path.join(session_dir, DefaceAfterBAW.BRAIN_LABEL_RELATIVE_FN))
+    WriteLandmarks(os.path.join(session_dir, DefaceAfterBAW.LANDMARKS_RELATIVE_FN), LANDMARKS,
+                   coordinateSystem='RAS')
+    return t1_fn, t2_fn
+
+
+def _uncropped_head_mask(session_dir, idimg):
+    brain_label = sitk.ReadImage(os.path.join(session_dir, DefaceAfterBAW.BRAIN_LABEL_RELATIVE_FN))
+    return DefaceAfterBAW.quickDilate(sitk.Resample(brain_label, idimg, sitk.Transform(), sitk.sitkNearestNeighbor),
+                                      DefaceAfterBAW.HEAD_MASK_DILATIONS, DefaceAfterBAW.HEAD_MASK_DILATION_RADIUS)
+
+
+def _uncropped_defacing(image_fn, idimg, head_mask):
+    """ The defacing before it was cropped: masks in the whole identity grid, filters on the whole image """
+    session_dir = DefaceAfterBAW.getExperimentDir(image_fn)
+    lndmk_pts = DefaceAfterBAW.readFCSV(os.path.join(session_dir, DefaceAfterBAW.LANDMARKS_RELATIVE_FN))
+    IDTXFM = sitk.Transform()
+    reference_image = sitk.ReadImage(image_fn)
+    storage_type = reference_image.GetPixelID()
+
+    top_of_head_mask = DefaceAfterBAW.makeMaskFromBBCorners(
+        (DefaceAfterBAW.GLB_MAX_SIZE,) * 3,
+        (-DefaceAfterBAW.GLB_MAX_SIZE, lndmk_pts["RE"][1] + DefaceAfterBAW.GLB_EYE_DIAMETER,
+         lndmk_pts["RE"][2] + DefaceAfterBAW.GLB_ABOVE_EYE_MARGIN), idimg)
+    behind_acpnt = DefaceAfterBAW.makeMaskFromBBCorners(
+        (DefaceAfterBAW.GLB_MAX_SIZE, lndmk_pts["RE"][1] + DefaceAfterBAW.GLB_MAX_SIZE, DefaceAfterBAW.GLB_MAX_SIZE),
+        (-DefaceAfterBAW.GLB_MAX_SIZE, lndmk_pts["AC"][1], lndmk_pts["AC"][2] - DefaceAfterBAW.GLB_BELOW_AC_MARGIN),
+        idimg)
+    eyes_mask = DefaceAfterBAW.DrawEyes([lndmk_pts["LE"], lndmk_pts["RE"]], idimg)
+    force_keep = ((eyes_mask > 0) + (top_of_head_mask > 0) + (behind_acpnt > 0) + (head_mask > 0)) > 0
+    in_mask = sitk.Cast(sitk.Resample(force_keep, reference_image, IDTXFM), storage_type)
+
+    smoothed_img = sitk.Cast(sitk.SmoothingRecursiveGaussian(sitk.Cast(reference_image, sitk.sitkInt32),
+                                                             DefaceAfterBAW.SMOOTHING_SIGMA), storage_type)
+    mif = sitk.MedianImageFilter()
+    mif.SetRadius(DefaceAfterBAW.MEDIAN_RADIUS)
+    smoothed_img = mif.Execute(mif.Execute(smoothed_img))
+    out_img = sitk.Cast(in_mask * reference_image + sitk.Cast(1 - in_mask, storage_type) * smoothed_img,
+                        storage_type)
+    return sitk.GetArrayFromImage(in_mask), sitk.GetArrayFromImage(out_img)
+
+
+def test_cropped_defacing_matches_uncropped(tmpdir):
+    t1_fn, t2_fn = _make_session(str(tmpdir.join('sess1')))
+    session_dir = DefaceAfterBAW.getExperimentDir(t1_fn)
+    session_inputs = DefaceAfterBAW.DefaceSessionInputs(session_dir)
+    ## the part of the 320^3 grid covering the images
+    idimg = DefaceAfterBAW.makeIdentityImage(130)
+    head_mask = _uncropped_head_mask(session_dir, idimg)
+    for image_fn in [t1_fn, t2_fn]:
+        defacer = DefaceAfterBAW.DefaceAfterBAW(image_fn, session_inputs)
+        defacer.do_defacing()
+        in_mask = sitk.GetArrayFromImage(defacer.in_mask)
+        expected_in_mask, expected_out_img = _uncropped_defacing(image_fn, idimg, head_mask)
+        np.testing.assert_array_equal(in_mask, expected_in_mask)
+        ## the filters see the image filter_margin voxels beyond the ROI, so that the border where the
+        ## cropped Gaussian differs is outside of the ROI, and the smoothed voxels match too
+        np.testing.assert_array_equal(sitk.GetArrayFromImage(defacer.out_img), expected_out_img)
+
+        reference_image = defacer.reference_image
+        roi_lower_idx, roi_upper_idx = DefaceAfterBAW.getDefaceROI(defacer.in_mask)
+        if image_fn == t1_fn:
+            ## the forehead, in front of the top of head box, and the neck below the behind AC box are smoothed
+            lndmk_pts = defacer.lndmk_pts
+            for pnt in [(0.0, lndmk_pts['RE'][1] - 5.0, lndmk_pts['RE'][2] + 40.0),
+                        (0.0, lndmk_pts['AC'][1] + 20.0, lndmk_pts['AC'][2] - 60.0)]:
+                assert in_mask[reference_image.TransformPhysicalPointToIndex(pnt)[::-1]] == 0
+        else:
+            ## the back of the head above the neck is kept, so that only the front of the image is filtered
+            assert roi_upper_idx[1] < reference_image.GetSize()[1] // 2
+            assert roi_upper_idx[2] < reference_image.GetSize()[2] // 2
@@ -0,0 +1,87 @@
+import gzip
+import os
+import zlib
+
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+from utilities.imageIO import ImageWriter, WriteImage
+
+
+def _make_image():
+    image = sitk.GetImageFromArray(np.random.RandomState(0).rand(20, 30, 40).astype(np.float32))
+    image.SetSpacing((1.0, 1.5, 2.0))
+    image.SetOrigin((3.0, -4.0, 5.0))
+    return image
+
+
+def _gzip_members(fileName):
+    with open(fileName, 'rb') as compressedFile:
+        data = compressedFile.read()
+    members = 0
+    while data:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        decompressor.decompress(data)
+        data = decompressor.unused_data
+        members += 1
+    return members
+
+
+def test_block_compressed_images_read_back(tmpdir, monkeypatch):
+    image = _make_image()
+    monkeypatch.setattr('utilities.imageIO.COMPRESSION_BLOCK_SIZE', 16 * 1024)
+    monkeypatch.setenv('BAW_IMAGE_COMPRESSION_LEVEL', '1:')  # as exported by the cluster job script
+    fileName = WriteImage(image, str(tmpdir.join('blocks.nii.gz')), threads=4)
+    reference = str(tmpdir.join('reference.nii'))
+    sitk.WriteImage(image, reference)
+
+    with open(reference, 'rb') as referenceFile:
+        assert gzip.open(fileName).read() == referenceFile.read()
+    assert _gzip_members(fileName) > 1
+    readBack = sitk.ReadImage(fileName)
+    assert readBack.GetSpacing() == image.GetSpacing()
+    assert readBack.GetOrigin() == image.GetOrigin()
+    np.testing.assert_array_equal(sitk.GetArrayFromImage(readBack), sitk.GetArrayFromImage(image))
+    assert sorted(path.basename for path in tmpdir.listdir()) == ['blocks.nii.gz', 'reference.nii']
+
+
+def test_image_writer_waits_and_reports_errors(tmpdir):
+    image = _make_image()
+    with ImageWriter(maxPending=1) as imageWriter:
+        fileNames = [imageWriter.Write(image, str(tmpdir.join('image{0}.nii.gz'.format(index))))
+                     for index in range(3)]
+    for fileName in fileNames:
+        np.testing.assert_array_equal(sitk.GetArrayFromImage(sitk.ReadImage(fileName)),
+                                      sitk.GetArrayFromImage(image))
+
+    imageWriter = ImageWriter()
+    imageWriter.Write(image, str(tmpdir.join('missing', 'image.nii.gz')))
+    with pytest.raises(Exception):
+        imageWriter.Close()
+
+
+def test_uncompressed_images_are_memory_mapped(tmpdir):
+    from utilities.imageIO import ReadImageArray
+
+    array = np.random.RandomState(1).rand(5, 6, 7) * 100
+    for dtype in [np.uint8, np.int16, np.uint32, np.float32, np.float64]:
+        image = sitk.GetImageFromArray(array.astype(dtype))
+        for extension in ['.nii', '.nii.gz']:
+            fileName = str(tmpdir.join(np.dtype(dtype).name + extension))
+            sitk.WriteImage(image, fileName)
+            readBack = ReadImageArray(fileName)
+            assert isinstance(readBack, np.memmap) == (extension == '.nii')
+            assert readBack.dtype == array.astype(dtype).dtype
+            np.testing.assert_array_equal(readBack, sitk.GetArrayFromImage(image))
+
+
+def test_pass_through_links_same_file_types(tmpdir):
+    from utilities.imageIO import PassThroughImageFile
+
+    sourceFileName = str(tmpdir.join('input.nii.gz'))
+    sitk.WriteImage(_make_image(), sourceFileName)
+    linkedFileName = PassThroughImageFile(sourceFileName, str(tmpdir.join('input_unwrapped.nii.gz')))
+    assert os.path.samefile(linkedFileName, sourceFileName)
+    assert PassThroughImageFile(sourceFileName, linkedFileName) == linkedFileName  # rerun replaces the link
+    assert PassThroughImageFile(sourceFileName, str(tmpdir.join('input_unwrapped.nrrd'))) is None
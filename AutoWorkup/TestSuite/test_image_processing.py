@@ -0,0 +1,69 @@
+import itertools
+
+import numpy as np
+import SimpleITK as sitk
+
+from utilities.image_processing import AdjacentSliceDifferences, AutoUnwrapImage, FlipPermuteToIdentity, \
+    GetFlipPermuteToIdentity, IsWrappedAlongAxis
+
+
+def _make_head():
+    z, y, x = np.mgrid[0:60, 0:64, 0:56]
+    head = ((z - 30) / 22.0) ** 2 + ((y - 32) / 25.0) ** 2 + ((x - 28) / 20.0) ** 2 < 1
+    rng = np.random.RandomState(0)
+    return (head * (800 + 200 * np.sin(z / 3.0) + rng.rand(*head.shape) * 50) +
+            rng.rand(*head.shape) * 20).astype(np.int16)
+
+
+def test_adjacent_slice_differences_match_slice_loop():
+    image_as_np = _make_head()
+    slice_values = AdjacentSliceDifferences(image_as_np)
+    for axis in range(3):
+        expected = list()
+        for ii in range(image_as_np.shape[axis]):
+            curr_slice = np.take(image_as_np, ii, axis).astype(np.float64).flatten()
+            next_slice = np.take(image_as_np, (ii + 1) % image_as_np.shape[axis], axis).astype(np.float64).flatten()
+            expected.append(np.sum((curr_slice - next_slice) ** 2))
+        np.testing.assert_allclose(slice_values[axis], expected)
+
+
+def test_only_wrapped_axes_are_unwrapped():
+    head = _make_head()
+    image = sitk.GetImageFromArray(head)
+    image.SetSpacing((1.0, 1.2, 1.5))
+    image.SetOrigin((10.0, 20.0, 30.0))
+    unwrapped_image, rolls = AutoUnwrapImage(image)
+    assert rolls == [0, 0, 0]
+    assert unwrapped_image is image
+
+    for shift in [(20, 0, 0), (0, -25, 0), (15, 0, 10)]:
+        wrapped_image = sitk.GetImageFromArray(np.roll(head, shift, axis=(0, 1, 2)))
+        wrapped_image.CopyInformation(image)
+        unwrapped_image, rolls = AutoUnwrapImage(wrapped_image)
+        assert [roll != 0 for roll in rolls] == [offset != 0 for offset in shift]
+        unwrapped = sitk.GetArrayFromImage(unwrapped_image)
+        for axis in range(3):
+            assert not IsWrappedAlongAxis(unwrapped > 400, axis)
+        np.testing.assert_array_equal(unwrapped, np.roll(head, np.add(shift, rolls), axis=(0, 1, 2)))
+        expected_origin = np.array(image.GetOrigin()) - np.array(rolls[::-1]) * np.array(image.GetSpacing())
+        np.testing.assert_allclose(unwrapped_image.GetOrigin(), expected_origin)
+
+
+def test_flip_permute_matches_permute_axes_and_flip():
+    rng = np.random.RandomState(0)
+    for permutation in itertools.permutations(range(3)):
+        for signs in itertools.product([1, -1], repeat=3):
+            direction = np.zeros((3, 3))
+            direction[range(3), permutation] = signs
+            image = sitk.GetImageFromArray(rng.randint(0, 1000, size=(4, 5, 6)).astype(np.int16))
+            image.SetSpacing((1.0, 1.2, 1.5))
+            image.SetOrigin((10.0, -20.0, 30.0))
+            image.SetDirection(direction.flatten())
+            permute_values, flip_values = GetFlipPermuteToIdentity(image.GetDirection())
+            expected = sitk.Flip(sitk.PermuteAxes(image, permute_values), flip_values)
+            reoriented = FlipPermuteToIdentity(image)
+            np.testing.assert_array_equal(sitk.GetArrayFromImage(reoriented), sitk.GetArrayFromImage(expected))
+            np.testing.assert_allclose(reoriented.GetDirection(), np.eye(3).flatten())
+            np.testing.assert_allclose(reoriented.GetOrigin(), expected.GetOrigin())
+            np.testing.assert_allclose(reoriented.GetSpacing(), expected.GetSpacing())
+            assert (reoriented is image) == (permutation == (0, 1, 2) and signs == (1, 1, 1))
@@ -0,0 +1,34 @@
+import numpy as np
+import SimpleITK as sitk
+
+from utilities.labelMaps import MinimizeSizeOfImage, RecodeLabelImage, readRecodingList
+
+
+def _recode_with_image_arithmetic(LabelImage, RECODE_TABLE):
+    LabelImage = sitk.Cast(LabelImage, sitk.sitkUInt32)
+    for (old, new) in RECODE_TABLE:
+        LabelImage = sitk.Cast((LabelImage == old), sitk.sitkUInt32) * (new - old) + LabelImage
+    return MinimizeSizeOfImage(LabelImage)
+
+
+def test_lookup_table_recoding_matches_image_arithmetic(tmpdir):
+    rng = np.random.RandomState(0)
+    labelImage = sitk.GetImageFromArray(rng.choice([0, 2, 4, 7, 41, 46, 999, 15000], size=(9, 10, 11)).astype(np.uint16))
+    labelImage.SetSpacing((1.0, 0.5, 2.0))
+    recode_csv = tmpdir.join('recode.csv')
+    recode_csv.write('\n'.join(['#orig,origName,target,targetName',
+                                '7,a,2,b',
+                                '2,b,41,c',
+                                '15000,d,4,e',
+                                '',
+                                '999,f,300,g',
+                                '12,h,13,i']))
+    RECODE_TABLE = readRecodingList(str(recode_csv))
+    assert RECODE_TABLE == [(7, 2), (2, 41), (15000, 4), (999, 300), (12, 13)]
+
+    for table in [RECODE_TABLE, RECODE_TABLE[:3]]:
+        expected = _recode_with_image_arithmetic(labelImage, table)
+        recoded = RecodeLabelImage(labelImage, table)
+        assert recoded.GetPixelID() == expected.GetPixelID()
+        assert recoded.GetSpacing() == expected.GetSpacing()
+        np.testing.assert_array_equal(sitk.GetArrayFromImage(recoded), sitk.GetArrayFromImage(expected))
@@ -0,0 +1,44 @@
+import numpy as np
+import SimpleITK as sitk
+
+from utilities.labelTopology import GetLargestLabel, LabelTopology, RecodeNonLargest
+
+
+def _largest_with_relabel(inputMask):
+    return sitk.RelabelComponent(sitk.ConnectedComponent(inputMask)) == 1
+
+
+def _make_label_image():
+    rng = np.random.RandomState(0)
+    labelArray = rng.choice([0, 11, 12, 13, 48], size=(14, 15, 16), p=[0.4, 0.2, 0.2, 0.1, 0.1]).astype(np.uint32)
+    labelArray[2:5, 2:5, 2:5] = 17  # two equally large components: the first in raster order is the largest
+    labelArray[8:11, 8:11, 8:11] = 17
+    labelImage = sitk.GetImageFromArray(labelArray)
+    labelImage.SetOrigin((1.0, 2.0, 3.0))
+    return labelImage
+
+
+def test_largest_component_matches_relabel_component():
+    labelImage = _make_label_image()
+    topology = LabelTopology(labelImage, labels=[11, 12, 17, 50])
+    assert topology.GetLargestComponent(50) is None
+    for label in [11, 12, 17]:
+        expected = _largest_with_relabel(labelImage == label)
+        np.testing.assert_array_equal(sitk.GetArrayFromImage(topology.GetLargestComponentMask(label)),
+                                      sitk.GetArrayFromImage(expected))
+        np.testing.assert_array_equal(sitk.GetArrayFromImage(GetLargestLabel(labelImage == label)),
+                                      sitk.GetArrayFromImage(expected))
+    assert topology.GetComponentSize(topology.GetLargestComponent(17)) == 27
+
+
+def test_recode_non_largest_matches_per_label_recoding():
+    labelImage = _make_label_image()
+    keepCodes = [11, 12, 13, 17]
+    expected = labelImage
+    for keepCode in keepCodes:
+        orig_mask = sitk.Cast(expected == keepCode, sitk.sitkUInt32)
+        small_regions = orig_mask - sitk.Cast(_largest_with_relabel(expected == keepCode), sitk.sitkUInt32)
+        expected = expected * (1 - small_regions) + small_regions * 999
+    recoded = RecodeNonLargest(labelImage, keepCodes, 999)
+    assert recoded.GetOrigin() == labelImage.GetOrigin()
+    np.testing.assert_array_equal(sitk.GetArrayFromImage(recoded), sitk.GetArrayFromImage(expected))
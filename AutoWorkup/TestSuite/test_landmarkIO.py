@@ -0,0 +1,54 @@
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from utilities.landmarkIO import SLICER3_FCSV, SLICER4_FCSV, LandmarkDistances, ReadLandmarks, \
+    ReadLandmarksBatch, WriteLandmarks
+
+LANDMARKS = OrderedDict([('AC', (0.5, -1.25, 2.0)), ('PC', (0.25, 24.5, 1.0)), ('RE', (-31.0, -50.0, -20.0)),
+                         ('LE', (32.0, -49.0, -21.0))])
+
+
+def test_both_file_versions_and_coordinate_systems(tmpdir):
+    for fileVersion in [SLICER3_FCSV, SLICER4_FCSV]:
+        fcsvFileName = str(tmpdir.join(fileVersion + '.fcsv'))
+        WriteLandmarks(fcsvFileName, LANDMARKS, coordinateSystem='LPS', fileVersion=fileVersion)
+        assert ReadLandmarks(fcsvFileName) == LANDMARKS
+        rasLandmarks = ReadLandmarks(fcsvFileName, coordinateSystem='RAS')
+        assert rasLandmarks['RE'] == (31.0, 50.0, -20.0)
+        with open(fcsvFileName) as fcsvFile:
+            lines = fcsvFile.readlines()
+        ## the file is RAS, with the landmark name where the BRAINSConstellationDetector readers expect it
+        fields = [line.strip().split(',') for line in lines if not line.startswith('#')]
+        nameColumn = 0 if fileVersion == SLICER3_FCSV else 11
+        assert [row[nameColumn] for row in fields] == list(LANDMARKS.keys())
+        assert [float(value) for value in fields[2][1:4]] == [31.0, 50.0, -20.0]
+
+    repositoryFileName = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+                                      'BRAINSConstellationDetector', 'docs', 'newEMSP.fcsv')
+    if os.path.exists(repositoryFileName):
+        assert len(ReadLandmarks(repositoryFileName)) == 2
+
+
+def test_batch_reading_and_distances(tmpdir):
+    fcsvFileNames = list()
+    for session in range(6):
+        landmarks = OrderedDict((name, tuple(np.add(point, session))) for name, point in LANDMARKS.items())
+        if session == 3:
+            del landmarks['LE']
+        fcsvFileNames.append(str(tmpdir.join('session{0}.fcsv'.format(session))))
+        WriteLandmarks(fcsvFileNames[-1], landmarks)
+
+    names, points = ReadLandmarksBatch(fcsvFileNames)
+    assert names == list(LANDMARKS.keys())
+    assert points.shape == (6, 4, 3)
+    parallelNames, parallelPoints = ReadLandmarksBatch(fcsvFileNames, workers=2)
+    assert parallelNames == names
+    np.testing.assert_array_equal(parallelPoints, points)
+
+    distances = LandmarkDistances(points, names, [('RE', 'LE'), ('AC', 'PC')])
+    assert distances.shape == (6, 2)
+    assert np.isnan(distances[3, 0]) and not np.isnan(distances[3, 1])
+    expected = np.linalg.norm(np.subtract(LANDMARKS['RE'], LANDMARKS['LE']))
+    np.testing.assert_allclose(np.delete(distances[:, 0], 3), expected)
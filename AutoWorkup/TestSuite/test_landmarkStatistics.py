@@ -0,0 +1,113 @@
+import csv
+import importlib.util
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+from utilities.landmarkIO import WriteLandmarks
+
+STATISTICS_FILE_NAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+                                    'BRAINSConstellationDetector', 'landmarkStatistics', 'landmarkStatistics.py')
+_spec = importlib.util.spec_from_file_location('landmarkStatistics', STATISTICS_FILE_NAME)
+landmarkStatistics = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(landmarkStatistics)
+
+
+def _cohort(numberOfSessions=40):
+    """ sessions x [AC, RE, LE, VN4] x 3: AC is the origin of every session, VN4 is on the midsagittal plane """
+    rng = np.random.RandomState(3)
+    points = np.zeros((numberOfSessions, 4, 3))
+    points[:, 1] = (31.0, 50.0, -20.0) + rng.normal(scale=(2.0, 3.0, 1.5), size=(numberOfSessions, 3))
+    points[:, 2] = (-31.0, 50.0, -20.0) + rng.normal(scale=(2.0, 3.0, 1.5), size=(numberOfSessions, 3))
+    points[:, 3, 1:] = (-35.0, -30.0) + rng.normal(scale=(2.0, 2.5), size=(numberOfSessions, 2))
+    return ['AC', 'RE', 'LE', 'VN4'], points
+
+
+def test_mean_and_covariance_with_missing_landmarks():
+    names, points = _cohort()
+    points[5, 1] = np.nan
+    points[:, 2] = np.nan
+    points[7, 2] = (-30.0, 49.0, -21.0)
+    mean, covariance, counts = landmarkStatistics.landmark_mean_and_covariance(points)
+    np.testing.assert_array_equal(counts, [40, 39, 1, 40])
+    present = np.delete(points[:, 1], 5, axis=0)
+    np.testing.assert_allclose(mean[1], present.mean(axis=0))
+    np.testing.assert_allclose(covariance[1], np.cov(present, rowvar=False))
+    ## one session: a mean, but no covariance
+    np.testing.assert_array_equal(mean[2], points[7, 2])
+    assert np.isnan(covariance[2]).all()
+    ## constant landmark
+    np.testing.assert_array_equal(mean[0], [0.0, 0.0, 0.0])
+    np.testing.assert_array_equal(covariance[0], np.zeros((3, 3)))
+
+
+def test_mahalanobis_distances():
+    names, points = _cohort()
+    points[5, 1] = np.nan
+    points[11, 1] += (0.0, 25.0, 0.0)
+    mean, covariance, counts = landmarkStatistics.landmark_mean_and_covariance(points)
+    distances = landmarkStatistics.mahalanobis_distances(points, mean, covariance)
+    assert distances.shape == (40, 4)
+    ## the planted outlier stands out, the missing landmark has no distance
+    assert np.nanargmax(distances[:, 1]) == 11
+    assert distances[11, 1] > landmarkStatistics.DEFAULT_OUTLIER_THRESHOLD
+    assert np.isnan(distances[5, 1])
+    assert not np.isnan(np.delete(distances, 5, axis=0)).any()
+    centered = points[:, 2] - mean[2]
+    np.testing.assert_allclose(distances[:, 2],
+                               np.sqrt(np.einsum('si,ij,sj->s', centered, np.linalg.inv(covariance[2]), centered)))
+    ## a constant landmark is at distance 0, one constant in x is measured in y and z
+    np.testing.assert_array_equal(distances[:, 0], np.zeros(40))
+    centered = points[:, 3, 1:] - mean[3, 1:]
+    np.testing.assert_allclose(distances[:, 3], np.sqrt(
+        np.einsum('si,ij,sj->s', centered, np.linalg.inv(covariance[3, 1:, 1:]), centered)))
+
+
+def test_compute_landmark_statistics(tmpdir):
+    names, points = _cohort(30)
+    points[4, 2] += (0.0, 0.0, 20.0)
+    fcsvFiles = []
+    for session in range(len(points)):
+        landmarks = OrderedDict((name, tuple(points[session, index])) for index, name in enumerate(names)
+                                if not (session == 9 and name == 'LE'))
+        fcsvFile = str(tmpdir.join('session{0:02d}'.format(session), 'ACPCAlign', 'BCD_ACPC_Landmarks.fcsv'))
+        os.makedirs(os.path.dirname(fcsvFile))
+        WriteLandmarks(fcsvFile, landmarks, coordinateSystem='LPS')
+        fcsvFiles.append(fcsvFile)
+    pairs = landmarkStatistics.parse_pairs('RE:LE,AC:VN4')
+    statistics = landmarkStatistics.compute_landmark_statistics(fcsvFiles, pairs, coordinateSystem='LPS')
+
+    assert statistics['sessionIDs'][:2] == ['session00', 'session01']
+    assert statistics['names'] == names
+    np.testing.assert_allclose(statistics['points'][:, 1], points[:, 1], atol=1e-4)
+    np.testing.assert_allclose(statistics['distances'][:, 1], np.linalg.norm(points[:, 3], axis=1), atol=1e-4)
+    assert np.isnan(statistics['distances'][9, 0])
+    assert np.isnan(statistics['mahalanobis'][9, 2])
+    np.testing.assert_array_equal(statistics['counts'], [30, 30, 29, 30])
+    ## the planted outlier is the only one, the constant AC is never one
+    assert np.argwhere(statistics['outliers']).tolist() == [[4, 2]]
+
+    summaryFile = str(tmpdir.join('summary.csv'))
+    landmarkStatistics.write_summary(summaryFile, statistics)
+    with open(summaryFile) as lf:
+        rows = list(csv.reader(lf))
+    assert rows[0][:4] == ['#sessionID', 'fcsvFile', 'RE_LE', 'AC_VN4']
+    assert rows[5][-2:] == ['1', 'LE']
+    assert rows[10][2] == 'nan'
+
+    selected = landmarkStatistics.compute_landmark_statistics(fcsvFiles, pairs, landmarks=['LE', 'RE'],
+                                                              coordinateSystem='LPS')
+    assert selected['names'] == ['LE', 'RE']
+    np.testing.assert_allclose(selected['mahalanobis'][:, 1], statistics['mahalanobis'][:, 1])
+    with pytest.raises(ValueError):
+        landmarkStatistics.compute_landmark_statistics(fcsvFiles, [('RE', 'XX')])
+
+
+def test_parse_pairs():
+    assert landmarkStatistics.parse_pairs('RE:LE, AC : PC,') == [('RE', 'LE'), ('AC', 'PC')]
+    for pairs in ['RE:LE,AC', 'RE:LE:AC', 'RE:', 'RE-LE']:
+        with pytest.raises(ValueError) as error:
+            landmarkStatistics.parse_pairs(pairs)
+        assert 'first:second' in str(error.value)
@@ -0,0 +1,133 @@
+import numpy as np
+import SimpleITK as sitk
+
+from utilities.measureVolumes import ComputeLabelVolumes, CountLabelVoxels
+
+
+def _label_statistics_volumes(labelImg):
+    """ Volumes of the LabelStatisticsImageFilter implementation that CountLabelVoxels replaced """
+    intLabels = sitk.Cast(labelImg, sitk.sitkInt64)
+    statistics = sitk.LabelStatisticsImageFilter()
+    statistics.Execute(sitk.Cast(labelImg, sitk.sitkFloat64), intLabels)
+    spacing = labelImg.GetSpacing()
+    voxelVolume = spacing[0] * spacing[1] * spacing[2]
+    return dict([(int(value), voxelVolume * statistics.GetCount(value)) for value in statistics.GetLabels()])
+
+
+def test_count_label_voxels_matches_label_statistics(tmpdir):
+    rng = np.random.RandomState(0)
+    labels = rng.randint(-3, 40, size=(9, 11, 13))
+    for array in [labels.astype(np.int16), labels.astype(np.uint16) * (labels >= 0), labels + 0.7]:
+        labelImg = sitk.GetImageFromArray(array)
+        labelImg.SetSpacing([0.5, 1.2, 2.0])
+        expected = _label_statistics_volumes(labelImg)
+        counts = CountLabelVoxels(sitk.GetArrayViewFromImage(labelImg), chunkVoxels=100)
+        assert sorted(counts.keys()) == sorted(expected.keys())
+
+        labelFilename = str(tmpdir.join('label.nrrd'))
+        sitk.WriteImage(labelImg, labelFilename)
+        volumes = ComputeLabelVolumes(labelFilename, {0: 'background'})
+        assert [volume['LabelCode'] for volume in volumes] == sorted(expected.keys())
+        for volume in volumes:
+            assert np.isclose(volume['Volume_mm3'], expected[volume['LabelCode']])
+
+
+def test_reference_volume_supplies_the_spacing(tmpdir):
+    labelImg = sitk.GetImageFromArray(np.array([[[0, 1, 1, 2]]], dtype=np.uint8))
+    labelImg.SetSpacing([0.5, 0.5, 0.5])
+    labelFilename = str(tmpdir.join('label.nii.gz'))
+    referenceFilename = str(tmpdir.join('t1.nii.gz'))
+    sitk.WriteImage(labelImg, labelFilename)
+    referenceImg = sitk.Image(labelImg.GetSize(), sitk.sitkFloat32)
+    referenceImg.SetSpacing([1.0, 1.0, 2.0])
+    sitk.WriteImage(referenceImg, referenceFilename)
+    volumes = ComputeLabelVolumes(labelFilename, {}, referenceFilename)
+    assert [(volume['LabelCode'], volume['Volume_mm3']) for volume in volumes] == [(0, 2.0), (1, 4.0), (2, 2.0)]
+
+
+def test_batch_volume_measure_tables_and_cache(tmpdir, monkeypatch):
+    import csv
+    import os
+
+    import utilities.measureVolumes as measureVolumes
+
+    patterns = measureVolumes.BATCH_LABEL_MAP_PATTERNS[:2]
+    labelMaps = dict()
+    for session, codes in [('ses1', [0, 1, 2]), ('ses2', [0, 2, 2])]:
+        for pattern, offset in zip(patterns, [0, 1000]):
+            labelMapFilename = str(tmpdir.join('results', 'P1', 'S1', session, pattern))
+            os.makedirs(os.path.dirname(labelMapFilename), exist_ok=True)
+            sitk.WriteImage(sitk.GetImageFromArray(np.array([[codes]], dtype=np.uint16) + offset), labelMapFilename)
+            labelMaps[(session, pattern)] = labelMapFilename
+
+    measured = list()
+    measure = measureVolumes._MeasureLabelMapVolumes
+    monkeypatch.setattr(measureVolumes, '_MeasureLabelMapVolumes',
+                        lambda labelMapFilename, RefVolume=None:
+                        measured.append(labelMapFilename) or measure(labelMapFilename, RefVolume))
+    basename = str(tmpdir.join('batch_'))
+    labelDictionaries = {patterns[0]: {1: 'one', 2: 'two'}}
+    outputFilenames = measureVolumes.BatchVolumeMeasure(str(tmpdir.join('results')), labelDictionaries, basename,
+                                                        labelMapPatterns=patterns)
+    assert len(measured) == 4
+    assert len(outputFilenames) == 2
+    with open(outputFilenames[0]) as csvFile:
+        rows = list(csv.reader(csvFile))
+    assert rows[0][5:] == ['0_NA', '1_one', '2_two']
+    assert [row[2] for row in rows[1:]] == ['ses1', 'ses2']
+    assert [float(volume) for volume in rows[2][5:]] == [1.0, 0.0, 2.0]
+    with open(outputFilenames[1]) as csvFile:
+        assert next(csv.reader(csvFile))[5:] == ['1000_NA', '1001_NA', '1002_NA']
+
+    del measured[:]
+    measureVolumes.BatchVolumeMeasure(str(tmpdir.join('results')), labelDictionaries, basename,
+                                      labelMapPatterns=patterns)
+    assert measured == []
+
+    changed = labelMaps[('ses2', patterns[0])]
+    sitk.WriteImage(sitk.GetImageFromArray(np.array([[[0, 1, 1, 1]]], dtype=np.uint16)), changed)
+    measureVolumes.BatchVolumeMeasure(str(tmpdir.join('results')), labelDictionaries, basename,
+                                      labelMapPatterns=patterns)
+    assert measured == [changed]
+
+
+def test_batch_volumes_use_the_session_t1_spacing_like_the_node(tmpdir):
+    import csv
+    import os
+
+    import utilities.measureVolumes as measureVolumes
+
+    pattern = measureVolumes.BATCH_LABEL_MAP_PATTERNS[0]
+    labelImg = sitk.GetImageFromArray(np.array([[[0, 1, 1, 2]]], dtype=np.uint8))
+    labelImg.SetSpacing([0.5, 0.5, 0.5])
+    referenceImg = sitk.Image(labelImg.GetSize(), sitk.sitkFloat32)
+    referenceImg.SetSpacing([1.0, 1.0, 2.0])
+    labelFilenames = dict()
+    for session in ['ses1', 'ses2']:
+        labelFilenames[session] = str(tmpdir.join('results', 'P1', 'S1', session, pattern))
+        os.makedirs(os.path.dirname(labelFilenames[session]))
+        sitk.WriteImage(labelImg, labelFilenames[session])
+    ## ses2 has no T1 image: the label map spacing is used
+    referenceFilename = str(tmpdir.join('results', 'P1', 'S1', 'ses1', measureVolumes.BATCH_REFERENCE_PATTERN))
+    os.makedirs(os.path.dirname(referenceFilename))
+    sitk.WriteImage(referenceImg, referenceFilename)
+
+    basename = str(tmpdir.join('batch_'))
+    outputFilenames = measureVolumes.BatchVolumeMeasure(str(tmpdir.join('results')), {}, basename,
+                                                        labelMapPatterns=[pattern])
+    with open(outputFilenames[0]) as csvFile:
+        rows = list(csv.reader(csvFile))
+    nodeVolumes = ComputeLabelVolumes(labelFilenames['ses1'], {}, referenceFilename)
+    assert [float(volume) for volume in rows[1][5:]] == [volume['Volume_mm3'] for volume in nodeVolumes]
+    assert [float(volume) for volume in rows[1][5:]] == [2.0, 4.0, 2.0]
+    assert [float(volume) for volume in rows[2][5:]] == [0.125, 0.25, 0.125]
+
+    ## a T1 resampled to another spacing is measured again
+    referenceImg.SetSpacing([1.0, 1.0, 1.0])
+    sitk.WriteImage(referenceImg, referenceFilename)
+    os.utime(referenceFilename, (0, 0))
+    outputFilenames = measureVolumes.BatchVolumeMeasure(str(tmpdir.join('results')), {}, basename,
+                                                        labelMapPatterns=[pattern], workers=2)
+    with open(outputFilenames[0]) as csvFile:
+        rows = list(csv.reader(csvFile))
+    assert [float(volume) for volume in rows[1][5:]] == [1.0, 2.0, 1.0]
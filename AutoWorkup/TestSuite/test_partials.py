@@ -0,0 +1,63 @@
+import os
+import sys
+
+import numpy as np
+import SimpleITK as sitk
+
+import brains.metrics.partials  # noqa: F401
+
+partials = sys.modules['brains.metrics.partials']
+
+
+def _write_posteriors(tmpdir):
+    partials._config.remove_section('Results')
+    partials._config.add_section('Results')
+    partials._config.set('Results', 'accumulated', 'ACCUMULATED_POSTERIORS')
+    partials._config.set('Results', 'partials', 'POSTERIORS')
+    rng = np.random.RandomState(0)
+    for label, isAccumulated in [(label, True) for label in partials.accumulated] + [('caudate', False)]:
+        filename = partials._posteriorFilename(str(tmpdir), label, isAccumulated)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        image = sitk.GetImageFromArray(rng.rand(6, 7, 8).astype(np.float32) * 1.2)
+        image.SetSpacing([0.5, 1.0, 1.5])
+        sitk.WriteImage(image, filename)
+
+
+def _per_label_volume(dirname, label, binary):
+    """ The volume of the per-label reads that PosteriorCache replaced """
+    if label == 'ICV':
+        return sum(_per_label_volume(dirname, sublabel, binary)
+                   for sublabel in partials.accumulated if sublabel != 'background_total')
+    image = sitk.ReadImage(partials._posteriorFilename(dirname, label, label.lower() in partials.accumulated))
+    if binary:
+        image = sitk.BinaryThreshold(image, partials._tolerance[0], partials._tolerance[1], 1, 0)
+    size = image.GetSpacing()
+    return sitk.GetArrayFromImage(image).sum(dtype=np.float64) * size[0] * size[1] * size[2]
+
+
+def test_posterior_volumes_read_each_file_once(tmpdir, monkeypatch):
+    _write_posteriors(tmpdir)
+    dirname = str(tmpdir)
+    labels = ['ICV', 'WM_TOTAL', 'CAUDATE', 'GM_TOTAL']
+    expected = dict((binary, [_per_label_volume(dirname, label, binary) for label in labels])
+                    for binary in [True, False])
+
+    reads = list()
+    readImage = sitk.ReadImage
+    monkeypatch.setattr(partials.sitk, 'ReadImage', lambda filename, *args: reads.append(filename) or
+                        readImage(filename, *args))
+    cache = partials.PosteriorCache()
+    for binary in [True, False]:
+        volumes = partials.calculatePosteriorVolumes(dirname, labels, binary, cache=cache)
+        assert list(volumes.keys()) == labels
+        assert np.allclose(list(volumes.values()), expected[binary])
+    assert sorted(reads) == sorted(set(reads))
+    # the ICV components, which include WM_TOTAL and GM_TOTAL, and CAUDATE
+    assert len(reads) == len(partials.accumulated)
+
+    caudate = partials._posteriorFilename(dirname, 'caudate', False)
+    sitk.WriteImage(sitk.GetImageFromArray(np.ones((2, 2, 2), dtype=np.float32)), caudate)
+    os.utime(caudate, (0, 0))
+    assert partials.calculatePosteriorVolumes(dirname, ['CAUDATE'], cache=cache)['CAUDATE'] == 8.0
+    assert reads[-1] == caudate
@@ -0,0 +1,87 @@
+import importlib.util
+import itertools
+import math
+import os
+
+import numpy as np
+import SimpleITK as sitk
+
+SUPPORT_FILE_NAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+                                 'BRAINSRefacer', 'scripts', 'support.py')
+_spec = importlib.util.spec_from_file_location('refacer_support', SUPPORT_FILE_NAME)
+support = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(support)
+
+
+def _loop_draw_eye(pnt, img):
+    """ The voxel by voxel DrawEye of BRAINSRefacer before makeEllipsoidMask, writing into img """
+    index = img.TransformPhysicalPointToIndex(pnt)
+    spacing = img.GetSpacing()
+    EYE_MAX_RADIUS = 15
+    indexstart = [int(math.floor(-EYE_MAX_RADIUS * e)) for e in spacing]
+    indexstop = [int(math.ceil(+EYE_MAX_RADIUS * e)) for e in spacing]
+    for x in range(indexstart[0], indexstop[0]):
+        for y in range(indexstart[1], indexstop[1]):
+            for z in range(indexstart[2], indexstop[2]):
+                if x ** 2 + y ** 2 + z ** 2 < EYE_MAX_RADIUS ** 2:
+                    offset = (x, y, z)
+                    setidx = [index[i] + offset[i] for i in (0, 1, 2)]
+                    img[setidx] = 1
+    return img
+
+
+def _brute_force_ellipsoids(center_pnts, radii, img):
+    """ Test every voxel center of img against every ellipsoid """
+    expected = np.zeros(img.GetSize()[::-1], dtype=np.uint8)
+    for idx in itertools.product(*[range(size) for size in img.GetSize()]):
+        pnt = np.array(img.TransformIndexToPhysicalPoint(idx))
+        for center_pnt, center_radii in zip(center_pnts, radii):
+            if (((pnt - center_pnt) / center_radii) ** 2).sum() < 1.0:
+                expected[idx[::-1]] = 1
+    return expected
+
+
+def test_draw_eye_matches_the_voxel_loop_on_the_identity_grid():
+    for eye_pnt in [(0.5, -3.5, 7.5), (-10.5, 12.5, 0.5)]:
+        expected = _loop_draw_eye(eye_pnt, support.makeIdentityImage(64))
+        mask = support.DrawEye(eye_pnt, support.makeIdentityImage(64))
+        assert mask.GetPixelID() == sitk.sitkUInt8
+        assert mask.GetOrigin() == expected.GetOrigin()
+        np.testing.assert_array_equal(sitk.GetArrayFromImage(mask), sitk.GetArrayFromImage(expected))
+        assert sitk.GetArrayFromImage(mask).sum() > 0
+
+
+def test_ellipsoids_on_an_anisotropic_rotated_image():
+    img = sitk.Image(36, 28, 22, sitk.sitkInt16)
+    img.SetSpacing((0.9, 1.3, 2.1))
+    img.SetOrigin((-12.0, 5.0, -20.0))
+    angle = math.radians(25)
+    rotation = np.array([[math.cos(angle), -math.sin(angle), 0.0],
+                         [math.sin(angle) * 0.8, math.cos(angle) * 0.8, -0.6],
+                         [math.sin(angle) * 0.6, math.cos(angle) * 0.6, 0.8]])
+    img.SetDirection(rotation.flatten().tolist())
+    center_pnts = np.array([img.TransformContinuousIndexToPhysicalPoint((12.3, 10.1, 9.7)),
+                            img.TransformContinuousIndexToPhysicalPoint((25.0, 17.6, 12.2))])
+    radii = np.array([[7.0, 5.0, 9.0], [4.5, 8.0, 6.0]])
+    mask = support.makeEllipsoidMask(center_pnts, radii, img)
+    for attribute in ['GetSize', 'GetSpacing', 'GetOrigin', 'GetDirection']:
+        assert getattr(mask, attribute)() == getattr(img, attribute)()
+    expected = _brute_force_ellipsoids(center_pnts, radii, img)
+    assert expected.sum() > 0
+    np.testing.assert_array_equal(sitk.GetArrayFromImage(mask), expected)
+
+
+def test_ellipsoids_near_and_outside_the_border():
+    img = sitk.Image(20, 18, 16, sitk.sitkInt16)
+    img.SetSpacing((1.0, 1.5, 2.0))
+    img.SetOrigin((10.0, -4.0, 3.0))
+    ## partly outside of the image: clipped, where the voxel loop raised IndexError
+    center_pnts = np.array([img.TransformContinuousIndexToPhysicalPoint((1.2, 0.4, 14.8))])
+    radii = np.array([[support.EYE_MAX_RADIUS] * 3])
+    mask = support.DrawEyes(center_pnts, img)
+    expected = _brute_force_ellipsoids(center_pnts, radii, img)
+    assert 0 < expected.sum() < expected.size
+    np.testing.assert_array_equal(sitk.GetArrayFromImage(mask), expected)
+    ## completely outside of the image
+    outside_pnt = img.TransformContinuousIndexToPhysicalPoint((-30.0, 8.0, 8.0))
+    assert sitk.GetArrayFromImage(support.DrawEye(outside_pnt, img)).sum() == 0
@@ -0,0 +1,23 @@
+import os
+import sys
+
+import numpy as np
+import SimpleITK as sitk
+
+import brains.metrics.segmentations  # noqa: F401
+
+segmentations = sys.modules['brains.metrics.segmentations']
+
+
+def test_icv_is_the_volume_of_the_fixed_brain_labels(tmpdir):
+    segmentations._config.remove_section('Results')
+    segmentations._config.add_section('Results')
+    segmentations._config.set('Results', 'partials', 'POSTERIORS')
+    labels = np.zeros((6, 7, 8), dtype=np.uint8)
+    labels[1:5, 2:6, 1:7] = 1
+    labels[2:4, 3:5, 2:4] = 4
+    image = sitk.GetImageFromArray(labels)
+    image.SetSpacing([0.5, 1.0, 1.5])
+    os.makedirs(str(tmpdir.join('POSTERIORS')))
+    sitk.WriteImage(image, str(tmpdir.join('POSTERIORS', 'fixed_brainlabels_seg.nii.gz')))
+    assert segmentations.calculateICV(str(tmpdir)) == 4 * 4 * 6 * 0.5 * 1.0 * 1.5
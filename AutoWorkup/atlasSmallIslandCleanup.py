@@ -1,10 +1,26 @@
 """
-usage: atlasSmallIslandCleanup.py --inputAtlasPath=<argument> --outputAtlasPath=<argument> --inputT1Path=<argument> [--inputT2Path=<argument>] [--includeLabelsList=<argument> | --excludeLabelsList=<argument>] --maximumIslandVoxelCount=<argument> [--useFullyConnectedInConnectedComponentFilter] [--forceSuspiciousLabelChange] [--noDilation]
+usage: atlasSmallIslandCleanup.py --inputAtlasPath=<argument> --outputAtlasPath=<argument> --inputT1Path=<argument> [--inputT2Path=<argument>] [--includeLabelsList=<argument> | --excludeLabelsList=<argument>] --maximumIslandVoxelCount=<argument> [--useFullyConnectedInConnectedComponentFilter] [--forceSuspiciousLabelChange] [--noDilation] [--workers=<argument>]
 atlasSmallIslandCleanup.py -h | --help
+
+Island statistics and timings are written as json next to the output atlas
+(<outputAtlasPath without .nii.gz>_islandStatistics.json).
+
+--workers=<argument>  clean groups of labels with non-overlapping bounding boxes in a pool of this many
+                      processes (-1 uses all cpus).  The result does not depend on the number of workers.
 """
 
-import SimpleITK as sitk
+from __future__ import print_function
+
+import json
 import math
+import time
+from multiprocessing import Pool, cpu_count
+
+import SimpleITK as sitk
+
+import numpy as np
+
+from utilities.misc import getPeakMemoryMB
 
 
 class DustCleanup():
@@ -19,11 +35,14 @@ class DustCleanup():
         self.useFullyConnectedInConnectedComponentFilter = arguments['--useFullyConnectedInConnectedComponentFilter']
         self.forceSuspiciousLabelChange = arguments['--forceSuspiciousLabelChange']
         self.noDilation = arguments['--noDilation']
+        self.numberOfThreads = 8
         self.islandStatistics = {'Total': {'numberOfIslandsCleaned': 0, 'numberOfIslands': 0}}
+        self.islandSizeHistograms = dict()
+        self.labelWallTimes = dict()
 
     def evalInputListArg(self, inputArg):
         if inputArg:
-            return map(int, inputArg.split(','))
+            return [int(x) for x in inputArg.split(',')]
         else:
             return None
 
@@ -34,11 +53,13 @@ class DustCleanup():
             inputT2VolumeImage = sitk.ReadImage(self.inputT2Path)
         else:
             inputT2VolumeImage = None
+        startTime = time.time()
         labelsList = self.getLabelsList(inputT1VolumeImage, labelImage)
         for label in labelsList:
             labelImage = self.relabelCurrentLabel(labelImage, inputT1VolumeImage, inputT2VolumeImage, label)
         self.printIslandStatistics()
         sitk.WriteImage(labelImage, self.outputAtlasPath)
+        self.writeIslandReport(getIslandReportPath(self.outputAtlasPath), time.time() - startTime)
 
     def getLabelsList(self, volumeImage, labelImage):
         labelStatsObject = self.getLabelStatsObject(volumeImage, labelImage)
@@ -68,21 +89,70 @@ class DustCleanup():
                 pass
         return verifiedList
 
-    def printIslandStatistics(self):
-        print
-        "-" * 50
-        print
-        "Label, numberOfIslandsCleaned, numberOfIslands, IslandVoxelCount, numberOfIslandsCleanedForIslandVoxelCount"
+    def getIslandStatisticsRows(self):
+        rows = [["Label", "numberOfIslandsCleaned", "numberOfIslands", "IslandVoxelCount",
+                 "numberOfIslandsCleanedForIslandVoxelCount"]]
         for islandName in sorted(self.islandStatistics.keys()):
             labelStats = [str(islandName), str(self.islandStatistics[islandName]['numberOfIslandsCleaned']),
                           str(self.islandStatistics[islandName]['numberOfIslands'])]
             if islandName != 'Total':
                 for i in range(1, self.maximumIslandVoxelCount + 1):
                     labelStats.extend([str(i), str(self.islandStatistics[islandName][i])])
-            print
-            ','.join(labelStats)
+            rows.append(labelStats)
+        return rows
+
+    def writeIslandStatistics(self, outputFileName):
+        with open(outputFileName, 'w') as outputFile:
+            for row in self.getIslandStatisticsRows():
+                outputFile.write(','.join(row) + '\n')
+
+    def printIslandStatistics(self):
+        print("-" * 50)
+        for row in self.getIslandStatisticsRows():
+            print(','.join(row))
+
+    def getIslandReport(self, wallTime=None):
+        """
+        Island statistics and timings as a json serializable dictionary.  The island size histogram
+        counts the (undilated) islands of each label by voxel count; islands larger than
+        maximumIslandVoxelCount are counted together under 'larger'.
+        """
+        labels = dict()
+        for label_key in self.islandStatistics.keys():
+            if label_key == 'Total':
+                continue
+            labelStatistics = self.islandStatistics[label_key]
+            labels[label_key] = {'numberOfIslands': labelStatistics['numberOfIslands'],
+                                 'numberOfIslandsCleaned': labelStatistics['numberOfIslandsCleaned'],
+                                 'numberOfIslandsCleanedByVoxelCount': dict(
+                                     (str(i), labelStatistics[i]) for i in range(1, self.maximumIslandVoxelCount + 1)),
+                                 'islandSizeHistogram': self.islandSizeHistograms.get(label_key, {}),
+                                 'wallTime': self.labelWallTimes.get(label_key)}
+        return {'inputAtlasPath': self.inputAtlasPath,
+                'outputAtlasPath': self.outputAtlasPath,
+                'maximumIslandVoxelCount': self.maximumIslandVoxelCount,
+                'numberOfIslands': self.islandStatistics['Total']['numberOfIslands'],
+                'numberOfIslandsCleaned': self.islandStatistics['Total']['numberOfIslandsCleaned'],
+                'wallTime': wallTime,
+                'peakMemoryMB': getPeakMemoryMB(),
+                'labels': labels}
+
+    def writeIslandReport(self, outputFileName, wallTime=None):
+        with open(outputFileName, 'w') as outputFile:
+            json.dump(self.getIslandReport(wallTime), outputFile, indent=2, sort_keys=True)
+
+    def recordIslandSizeHistogram(self, label_key, islandVoxelCounts):
+        histogram = dict()
+        for islandVoxelCount in islandVoxelCounts:
+            if islandVoxelCount > self.maximumIslandVoxelCount:
+                key = 'larger'
+            else:
+                key = str(islandVoxelCount)
+            histogram[key] = histogram.get(key, 0) + 1
+        self.islandSizeHistograms[label_key] = histogram
 
     def relabelCurrentLabel(self, labelImage, inputT1VolumeImage, inputT2VolumeImage, label_key):
+        startTime = time.time()
         label_key = str(label_key)  # all keys must be strings in order to sort
         self.islandStatistics[label_key] = {'numberOfIslandsCleaned': 0}
         label_value = int(label_key)
@@ -101,6 +171,8 @@ class DustCleanup():
             if currentIslandSize == 1:  # use island size 1 to get # of islands since this label map is not dilated
                 self.islandStatistics[label_key]['numberOfIslands'] = len(labelList)
                 self.islandStatistics['Total']['numberOfIslands'] += len(labelList)
+                self.recordIslandSizeHistogram(label_key, [labelStatsT1WithRelabeledConnectedRegion.GetCount(x)
+                                                           for x in labelList])
 
             numberOfIslandsCleaned = 0
 
@@ -133,6 +205,7 @@ class DustCleanup():
             self.islandStatistics[label_key]['numberOfIslandsCleaned'] += numberOfIslandsCleaned
             self.islandStatistics['Total']['numberOfIslandsCleaned'] += numberOfIslandsCleaned
 
+        self.labelWallTimes[label_key] = time.time() - startTime
         return labelImage
 
     def getRelabeldConnectedRegion(self, maskForCurrentLabel, currentIslandSize):
@@ -150,9 +223,9 @@ class DustCleanup():
 
     def runConnectedComponentsAndRelabel(self, binaryImage):
         if not self.useFullyConnectedInConnectedComponentFilter:
-            connectedRegion = sitk.ConnectedComponent(binaryImage, fullyConnected=False)
+            connectedRegion = sitk.ConnectedComponent(binaryImage, False)
         else:
-            connectedRegion = sitk.ConnectedComponent(binaryImage, fullyConnected=True)
+            connectedRegion = sitk.ConnectedComponent(binaryImage, True)
         relabeledConnectedRegion = sitk.RelabelComponent(connectedRegion)
         return relabeledConnectedRegion
 
@@ -167,7 +240,8 @@ class DustCleanup():
             compontentLabels = labelStatsObject.GetLabels()
         else:  # if sitk version < 0.9 then use older function call GetValidLabels
             compontentLabels = labelStatsObject.GetValidLabels()
-        return list(compontentLabels)
+        # GetLabels() follows hash map iteration order; sort so labels and islands are visited deterministically
+        return sorted(compontentLabels)
 
     def getTargetLabels(self, labelImage, relabeledConnectedRegion, inputVolumeImage, currentLabel):
         currentLabelBinaryThresholdImage = sitk.BinaryThreshold(relabeledConnectedRegion, currentLabel, currentLabel)
@@ -195,7 +269,7 @@ class DustCleanup():
         myFilter.SetForegroundValue(1.0)
         myFilter.SetKernelRadius((kernelRadius, kernelRadius, kernelRadius))
         myFilter.SetKernelType(2)  # Kernel Type=Box
-        myFilter.SetNumberOfThreads(8)
+        myFilter.SetNumberOfThreads(self.numberOfThreads)
         output = myFilter.Execute(inputLabelImage)
         castedOutput = sitk.Cast(output, sitk.sitkInt16)
 
@@ -248,13 +322,439 @@ class DustCleanup():
         return sorted(val, key=val.get)
 
 
+class VectorizedDustCleanup(DustCleanup):
+    """
+    Same cleaning algorithm as DustCleanup, restructured to avoid full-volume work per island:
+
+    * the label map is relabeled in place in a NumPy array,
+    * each label is processed inside its (dilation padded) bounding box, and its connected
+      components are only recomputed when the dilation radius changes or an island was moved,
+    * neighbor labels of an island are found in a crop of the island bounding box,
+    * per-label T1/T2 intensity sums are computed once and updated incrementally as islands move.
+
+    With --workers the labels are cleaned in waves of labels that do not depend on each other or on
+    an earlier label still to be cleaned: their padded bounding boxes do not overlap, and the labels
+    found in them (the only labels whose voxels and intensity sums cleaning a label reads or changes)
+    are disjoint.  The labels of a wave are cleaned concurrently and merged back in label order,
+    which gives the same result as cleaning them one after the other.
+    """
+
+    def __init__(self, arguments):
+        DustCleanup.__init__(self, arguments)
+        workers = arguments.get('--workers')
+        if workers is None:
+            self.workers = None
+        else:
+            self.workers = int(workers)
+            if self.workers < 1:
+                self.workers = cpu_count()
+            self.numberOfThreads = max(1, cpu_count() // self.workers)
+        self.arguments = arguments
+        self.islandMoves = None
+
+    def main(self):
+        labelImage = sitk.Cast(sitk.ReadImage(self.inputAtlasPath), sitk.sitkInt16)
+        inputT1VolumeImage = sitk.ReadImage(self.inputT1Path)
+        if self.inputT2Path:
+            inputT2VolumeImage = sitk.ReadImage(self.inputT2Path)
+        else:
+            inputT2VolumeImage = None
+        startTime = time.time()
+        labelsList = self.getLabelsList(inputT1VolumeImage, labelImage)
+        labelImage = self.cleanLabelImage(labelImage, inputT1VolumeImage, inputT2VolumeImage, labelsList)
+        self.printIslandStatistics()
+        sitk.WriteImage(labelImage, self.outputAtlasPath)
+        self.writeIslandReport(getIslandReportPath(self.outputAtlasPath), time.time() - startTime)
+
+    def cleanLabelImage(self, labelImage, inputT1VolumeImage, inputT2VolumeImage, labelsList):
+        self.labelArray = sitk.GetArrayFromImage(labelImage)
+        self.intensityArrays = [sitk.GetArrayViewFromImage(inputT1VolumeImage)]
+        if inputT2VolumeImage:
+            self.intensityArrays.append(sitk.GetArrayViewFromImage(inputT2VolumeImage))
+        self.labelBoundingBoxes = self.getLabelBoundingBoxes(labelImage)
+        self.labelIntensitySums = self.getLabelIntensitySums()
+        if self.workers is None:
+            for label in labelsList:
+                self.relabelCurrentLabelInPlace(label)
+        else:
+            self.cleanLabelsInParallel(labelsList)
+        outputImage = sitk.GetImageFromArray(self.labelArray)
+        outputImage.CopyInformation(labelImage)
+        return outputImage
+
+    def getLabelBoundingBoxes(self, labelImage):
+        """
+        Returns {label: [lower corner, upper corner (exclusive)]} in NumPy (z, y, x) index order
+        """
+        backgroundValue = int(self.labelArray.min()) - 1
+        if backgroundValue < -2 ** 15:
+            backgroundValue = int(self.labelArray.max()) + 1
+        shapeFilter = sitk.LabelShapeStatisticsImageFilter()
+        shapeFilter.SetBackgroundValue(backgroundValue)
+        shapeFilter.ComputePerimeterOff()
+        shapeFilter.ComputeFeretDiameterOff()
+        shapeFilter.Execute(labelImage)
+        boundingBoxes = dict()
+        for label in shapeFilter.GetLabels():
+            box = shapeFilter.GetBoundingBox(label)
+            dimension = len(box) // 2
+            lower = np.array(box[:dimension][::-1])
+            boundingBoxes[int(label)] = [lower, lower + np.array(box[dimension:][::-1])]
+        return boundingBoxes
+
+    def getLabelIntensitySums(self):
+        """
+        Returns {label: [voxel count, sum of T1 intensities(, sum of T2 intensities)]}
+        """
+        flatLabels = self.labelArray.reshape(-1)
+        minLabel = int(flatLabels.min())
+        indices = flatLabels.astype(np.intp) - minLabel
+        columns = [np.bincount(indices)]
+        for intensityArray in self.intensityArrays:
+            columns.append(np.bincount(indices, weights=intensityArray.reshape(-1).astype(np.float64)))
+        del indices
+        labelSums = dict()
+        for index in np.flatnonzero(columns[0]):
+            labelSums[int(index) + minLabel] = [int(columns[0][index])] + [float(c[index]) for c in columns[1:]]
+        return labelSums
+
+    def getLabelMean(self, label, modality):
+        labelSums = self.labelIntensitySums[label]
+        return labelSums[modality + 1] / labelSums[0]
+
+    def getCropPadding(self):
+        if self.noDilation:
+            return 0
+        return self.calcDilationKernelRadius(self.maximumIslandVoxelCount)
+
+    def getCropForLabel(self, label, padding):
+        lower, upper = self.labelBoundingBoxes[label]
+        lower = np.maximum(lower - padding, 0)
+        upper = np.minimum(upper + padding, self.labelArray.shape)
+        return tuple(slice(int(l), int(u)) for l, u in zip(lower, upper))
+
+    def getCroppedIslands(self, labelCrop, label_value, dilationKernelRadius):
+        """
+        Connected components of label_value inside labelCrop, as DustCleanup.getRelabeldConnectedRegion
+        computes them on the full image.  Returns (componentIds ascending, voxel counts, flat voxel indices
+        grouped by component, group offsets).
+        """
+        maskForCurrentLabel = (labelCrop == label_value).astype(np.uint8)
+        maskImage = sitk.GetImageFromArray(maskForCurrentLabel)
+        if dilationKernelRadius > 0:
+            dilatedMask = self.dilateLabelMap(maskImage, dilationKernelRadius)
+            components = sitk.GetArrayFromImage(self.runConnectedComponentsAndRelabel(dilatedMask))
+            components[maskForCurrentLabel == 0] = 0
+        else:
+            components = sitk.GetArrayFromImage(self.runConnectedComponentsAndRelabel(maskImage))
+        flatComponents = components.reshape(-1)
+        voxelIndices = np.flatnonzero(flatComponents)
+        voxelComponents = flatComponents[voxelIndices]
+        order = np.argsort(voxelComponents, kind='stable')
+        counts = np.bincount(voxelComponents)
+        componentIds = np.flatnonzero(counts)
+        componentIds = componentIds[componentIds != 0]
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        return componentIds, counts, voxelIndices[order], offsets
+
+    def getTargetLabelsForIsland(self, islandCoordinates):
+        """
+        Labels within a radius 1 box dilation of the island, from a crop around the island
+        """
+        shape = self.labelArray.shape
+        lower = np.maximum(islandCoordinates.min(axis=1) - 1, 0)
+        upper = np.minimum(islandCoordinates.max(axis=1) + 2, shape)
+        crop = tuple(slice(int(l), int(u)) for l, u in zip(lower, upper))
+        islandMask = np.zeros(upper - lower, dtype=bool)
+        islandMask[tuple(islandCoordinates - lower[:, np.newaxis])] = True
+        paddedMask = np.pad(islandMask, 1, mode='constant')
+        dilatedMask = np.zeros_like(islandMask)
+        cropShape = islandMask.shape
+        for dz in range(3):
+            for dy in range(3):
+                for dx in range(3):
+                    dilatedMask |= paddedMask[dz:dz + cropShape[0], dy:dy + cropShape[1], dx:dx + cropShape[2]]
+        targetLabels = sorted(int(x) for x in np.unique(self.labelArray[crop][dilatedMask]))
+        return self.removeOutsideValueFromTargetLabels(targetLabels, -1)
+
+    def calculateIslandIntensityDifferenceValue(self, islandMeans, targetLabels):
+        """
+        Same measurement as DustCleanup.calculateLabelIntensityDifferenceValue, using the cached label sums
+        """
+        squareRootDiffLabelDict = dict()
+        for targetLabel in targetLabels:
+            squareDiffAverageT1 = math.pow(islandMeans[0] - self.getLabelMean(targetLabel, 0), 2)
+            if len(islandMeans) > 1:
+                squareDiffAverageT2 = math.pow(islandMeans[1] - self.getLabelMean(targetLabel, 1), 2)
+            else:
+                squareDiffAverageT2 = 0
+            squareRootDiff = math.sqrt(squareDiffAverageT1 + squareDiffAverageT2)
+
+            squareRootDiffLabelDict[str(targetLabel)] = squareRootDiff
+        return squareRootDiffLabelDict
+
+    def moveIsland(self, islandCoordinates, islandSums, oldLabel, newLabel):
+        if self.islandMoves is not None:
+            self.islandMoves.append((islandCoordinates, islandSums, oldLabel, newLabel))
+        self.labelArray[tuple(islandCoordinates)] = newLabel
+        oldSums = self.labelIntensitySums[oldLabel]
+        newSums = self.labelIntensitySums.setdefault(newLabel, [0] + [0.0] * len(self.intensityArrays))
+        for index, value in enumerate(islandSums):
+            oldSums[index] -= value
+            newSums[index] += value
+        lower = islandCoordinates.min(axis=1)
+        upper = islandCoordinates.max(axis=1) + 1
+        if newLabel in self.labelBoundingBoxes:
+            boundingBox = self.labelBoundingBoxes[newLabel]
+            self.labelBoundingBoxes[newLabel] = [np.minimum(boundingBox[0], lower), np.maximum(boundingBox[1], upper)]
+        else:
+            self.labelBoundingBoxes[newLabel] = [lower, upper]
+
+    def getLabelRegion(self, label):
+        """
+        Everything cleaning this label reads or writes: the crop used for its connected components
+        plus one voxel for the neighbors of its islands
+        """
+        return self.getCropForLabel(label, max(self.getCropPadding(), 1))
+
+    def getLabelNeighborhood(self, label):
+        """
+        Returns (region, set of the labels in the region) of getLabelRegion; the set contains every
+        label whose intensity sums cleaning label reads or changes
+        """
+        region = self.getLabelRegion(label)
+        return region, set(int(x) for x in np.unique(self.labelArray[region])) | {int(label)}
+
+    @staticmethod
+    def _neighborhoodsOverlap(neighborhood, other):
+        region, labels = neighborhood
+        otherRegion, otherLabels = other
+        if not labels.isdisjoint(otherLabels):
+            return True
+        return all(a.start < b.stop and b.start < a.stop for a, b in zip(region, otherRegion))
+
+    def getIndependentLabelGroup(self, labelsList, neighborhoods):
+        """
+        The labels, in label order, whose neighborhoods do not overlap the neighborhood of an earlier
+        label of labelsList, so that cleaning them concurrently is the same as cleaning them in order
+
+        :param neighborhoods: {label: getLabelNeighborhood(label)} cache, completed as needed
+        """
+        group = list()
+        earlierNeighborhoods = list()
+        for label in labelsList:
+            if label not in neighborhoods:
+                neighborhoods[label] = self.getLabelNeighborhood(label)
+            neighborhood = neighborhoods[label]
+            if not any(self._neighborhoodsOverlap(neighborhood, other) for other in earlierNeighborhoods):
+                group.append(label)
+            earlierNeighborhoods.append(neighborhood)
+        return group
+
+    def makeLabelTask(self, label, neighborLabels):
+        region = self.getLabelRegion(label)
+        regionOrigin = np.array([r.start for r in region])
+        lower, upper = self.labelBoundingBoxes[label]
+        labelIntensitySums = dict((key, list(self.labelIntensitySums[key])) for key in neighborLabels)
+        return (self.arguments, label, self.labelArray[region].copy(),
+                [intensityArray[region].copy() for intensityArray in self.intensityArrays],
+                [lower - regionOrigin, upper - regionOrigin], labelIntensitySums), regionOrigin
+
+    def cleanLabelsInParallel(self, labelsList):
+        if self.workers > 1:
+            pool = Pool(self.workers)
+            mapFunction = pool.imap
+        else:
+            pool = None
+            mapFunction = map
+        try:
+            remainingLabels = [int(label) for label in labelsList]
+            neighborhoods = dict()
+            while remainingLabels:
+                group = self.getIndependentLabelGroup(remainingLabels, neighborhoods)
+                remainingLabels = [label for label in remainingLabels if label not in group]
+                tasks = [self.makeLabelTask(label, neighborhoods[label][1]) for label in group]
+                results = mapFunction(cleanLabelRegion, [task for task, _ in tasks])
+                for (task, regionOrigin), (islandStatistics, islandSizeHistograms, labelWallTimes, islandMoves) in \
+                        zip(tasks, results):
+                    label_key = str(task[1])
+                    self.islandStatistics[label_key] = islandStatistics[label_key]
+                    self.islandSizeHistograms.update(islandSizeHistograms)
+                    self.labelWallTimes.update(labelWallTimes)
+                    for key in ['numberOfIslandsCleaned', 'numberOfIslands']:
+                        self.islandStatistics['Total'][key] += islandStatistics['Total'][key]
+                    for islandCoordinates, islandSums, oldLabel, newLabel in islandMoves:
+                        self.moveIsland(islandCoordinates + regionOrigin[:, np.newaxis], islandSums,
+                                        oldLabel, newLabel)
+                # islands only moved inside the regions of the wave, and the labels they moved to grew
+                # into them: the other neighborhoods are unchanged unless they overlap one of these regions
+                cleanedRegions = [neighborhoods.pop(label)[0] for label in group]
+                for label in remainingLabels:
+                    if label in neighborhoods:
+                        region = self.getLabelRegion(label)
+                        if any(all(a.start < b.stop and b.start < a.stop for a, b in zip(region, cleanedRegion))
+                               for cleanedRegion in cleanedRegions):
+                            del neighborhoods[label]
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def relabelCurrentLabelInPlace(self, label_key):
+        startTime = time.time()
+        label_key = str(label_key)  # all keys must be strings in order to sort
+        self.islandStatistics[label_key] = {'numberOfIslandsCleaned': 0}
+        label_value = int(label_key)
+        crop = self.getCropForLabel(label_value, self.getCropPadding())
+        cropOrigin = np.array([c.start for c in crop])[:, np.newaxis]
+        labelCrop = self.labelArray[crop]
+        intensityCrops = [intensityArray[crop] for intensityArray in self.intensityArrays]
+        islands = None
+        islandsRadius = None
+        for currentIslandSize in range(1, self.maximumIslandVoxelCount + 1):
+            if (currentIslandSize > 1) and (not self.noDilation):
+                dilationKernelRadius = self.calcDilationKernelRadius(currentIslandSize)
+            else:
+                dilationKernelRadius = 0
+            if islands is None or islandsRadius != dilationKernelRadius:
+                islands = self.getCroppedIslands(labelCrop, label_value, dilationKernelRadius)
+                islandsRadius = dilationKernelRadius
+            componentIds, counts, groupedVoxels, offsets = islands
+            labelList = componentIds[::-1]
+
+            if currentIslandSize == 1:  # use island size 1 to get # of islands since this label map is not dilated
+                self.islandStatistics[label_key]['numberOfIslands'] = len(labelList)
+                self.islandStatistics['Total']['numberOfIslands'] += len(labelList)
+                self.recordIslandSizeHistogram(label_key, counts[labelList])
+
+            numberOfIslandsCleaned = 0
+            labelMapChanged = False
+
+            for currentLabel in labelList:
+                islandVoxelCount = counts[currentLabel]
+                if islandVoxelCount < currentIslandSize:
+                    continue
+                elif islandVoxelCount == currentIslandSize and currentLabel != 1:  # stop if you reach largest island
+                    islandVoxels = groupedVoxels[offsets[currentLabel]:offsets[currentLabel + 1]]
+                    cropCoordinates = np.array(np.unravel_index(islandVoxels, labelCrop.shape))
+                    islandSums = [int(islandVoxelCount)] + \
+                                 [float(np.sum(intensityCrop[tuple(cropCoordinates)], dtype=np.float64))
+                                  for intensityCrop in intensityCrops]
+                    islandMeans = [value / islandVoxelCount for value in islandSums[1:]]
+                    islandCoordinates = cropCoordinates + cropOrigin
+                    targetLabels = self.getTargetLabelsForIsland(islandCoordinates)
+                    diffDict = self.calculateIslandIntensityDifferenceValue(islandMeans, targetLabels)
+                    if self.forceSuspiciousLabelChange:
+                        diffDict.pop(label_key)
+                    sortedLabelList = [int(x) for x in self.getDictKeysListSortedByValue(diffDict)]
+                    if sortedLabelList[0] != label_value:
+                        self.moveIsland(islandCoordinates, islandSums, label_value, sortedLabelList[0])
+                        labelMapChanged = True
+                    numberOfIslandsCleaned += 1
+                else:
+                    break
+            if labelMapChanged:
+                islands = None
+
+            self.islandStatistics[label_key][currentIslandSize] = numberOfIslandsCleaned
+            self.islandStatistics[label_key]['numberOfIslandsCleaned'] += numberOfIslandsCleaned
+            self.islandStatistics['Total']['numberOfIslandsCleaned'] += numberOfIslandsCleaned
+
+        self.labelWallTimes[label_key] = time.time() - startTime
+
+
+def getIslandReportPath(outputAtlasPath):
+    if outputAtlasPath.endswith('.nii.gz'):
+        outputAtlasPath = outputAtlasPath[:-len('.nii.gz')]
+    return outputAtlasPath + '_islandStatistics.json'
+
+
+def makeStageArguments(maxIslandCount, useFullyConnected=False, forceLabelChange=False, noDilation=False,
+                       includeList=None, excludeList=None, workers=None):
+    """
+    Command line style arguments of one cleanup stage, see runDustCleanupStages
+    """
+    return {'--maximumIslandVoxelCount': maxIslandCount,
+            '--useFullyConnectedInConnectedComponentFilter': useFullyConnected,
+            '--forceSuspiciousLabelChange': forceLabelChange,
+            '--noDilation': noDilation,
+            '--includeLabelsList': includeList,
+            '--excludeLabelsList': excludeList,
+            '--workers': workers}
+
+
+def runDustCleanupStages(inputAtlasPath, outputAtlasPath, inputT1Path, stages, inputT2Path=None,
+                         stageStatisticsPrefix=None):
+    """
+    Run several cleanup stages in a row, keeping the label and intensity images in memory, and
+    write only the final atlas.
+
+    :param stages: list of dictionaries of makeStageArguments keyword arguments, applied in order
+    :param stageStatisticsPrefix: if given, the island statistics of stage N are written to
+                                  <stageStatisticsPrefix>_stageN_islandStatistics.csv
+    :return: list of the island statistics dictionaries of the stages
+
+    The island reports of all stages are written as json next to the output atlas.
+    """
+    startTime = time.time()
+    labelImage = sitk.Cast(sitk.ReadImage(inputAtlasPath), sitk.sitkInt16)
+    inputT1VolumeImage = sitk.ReadImage(inputT1Path)
+    if inputT2Path:
+        inputT2VolumeImage = sitk.ReadImage(inputT2Path)
+    else:
+        inputT2VolumeImage = None
+
+    stageStatistics = list()
+    stageReports = list()
+    for stageNumber, stage in enumerate(stages, 1):
+        arguments = makeStageArguments(**stage)
+        arguments.update({'--inputAtlasPath': inputAtlasPath,
+                          '--outputAtlasPath': outputAtlasPath,
+                          '--inputT1Path': inputT1Path,
+                          '--inputT2Path': inputT2Path})
+        cleanup = VectorizedDustCleanup(arguments)
+        stageStartTime = time.time()
+        labelsList = cleanup.getLabelsList(inputT1VolumeImage, labelImage)
+        labelImage = cleanup.cleanLabelImage(labelImage, inputT1VolumeImage, inputT2VolumeImage, labelsList)
+        cleanup.printIslandStatistics()
+        stageReport = cleanup.getIslandReport(time.time() - stageStartTime)
+        stageReport['stage'] = dict(stage)
+        stageReports.append(stageReport)
+        if stageStatisticsPrefix:
+            cleanup.writeIslandStatistics('{0}_stage{1}_islandStatistics.csv'.format(stageStatisticsPrefix,
+                                                                                     stageNumber))
+        stageStatistics.append(cleanup.islandStatistics)
+    sitk.WriteImage(labelImage, outputAtlasPath)
+    with open(getIslandReportPath(outputAtlasPath), 'w') as reportFile:
+        json.dump({'inputAtlasPath': inputAtlasPath,
+                   'outputAtlasPath': outputAtlasPath,
+                   'wallTime': time.time() - startTime,
+                   'peakMemoryMB': getPeakMemoryMB(),
+                   'stages': stageReports}, reportFile, indent=2, sort_keys=True)
+    return stageStatistics
+
+
+def cleanLabelRegion(task):
+    """
+    Process pool entry point of VectorizedDustCleanup.cleanLabelsInParallel: cleans one label in a
+    copy of its region and returns the island statistics, the timings and the island moves to replay
+    """
+    arguments, label, labelRegion, intensityRegions, boundingBox, labelIntensitySums = task
+    cleanup = VectorizedDustCleanup(arguments)
+    cleanup.labelArray = labelRegion
+    cleanup.intensityArrays = intensityRegions
+    cleanup.labelBoundingBoxes = {label: boundingBox}
+    cleanup.labelIntensitySums = labelIntensitySums
+    cleanup.islandMoves = list()
+    cleanup.relabelCurrentLabelInPlace(label)
+    return cleanup.islandStatistics, cleanup.islandSizeHistograms, cleanup.labelWallTimes, cleanup.islandMoves
+
+
 if __name__ == '__main__':
     from docopt import docopt
 
     arguments = docopt(__doc__)
-    print
-    arguments
-    print
-    "-" * 50
-    Object = DustCleanup(arguments)
+    print(arguments)
+    print("-" * 50)
+    Object = VectorizedDustCleanup(arguments)
     Object.main()
@@ -1,4 +1,5 @@
 import os.path
+from collections import OrderedDict
 from warnings import warn
 
 import SimpleITK as sitk
@@ -11,7 +12,6 @@ partials = ['accumben', 'air', 'caudate', 'crblgm', 'crblwm', 'csf', 'globus', '
             'notvb', 'notwm', 'putamen', 'surfgm', 'thalamus', 'vb', 'wm']
 accumulated = ['background_total', 'gm_total', 'csf_total', 'vb_total', 'globus_total', 'wm_total']
 
-_isAccumulated = False
 _tolerance = [0.51, 1.01]
 
 
@@ -37,87 +37,128 @@ def _checkLabel(label):
         assert label.lower() in partials + accumulated, errorString % label
 
 
-def _setIfAccumulated(label):
+class PosteriorCache(object):
     """
-    Sets _isAccumulated to True if label is in accumulated list
-    """
-    global _isAccumulated
-    if label.lower() in accumulated + ['icv']:
-        _isAccumulated = True
-    else:
-        _isAccumulated = False
-        # if label == "ICV":
-        #     print "_isAccumulated: ", _isAccumulated
-
+    Cache of posterior images, so every POSTERIOR_*.nii.gz of a session is decompressed at most
+    once.  Images are held as float32 NumPy arrays and the least recently used ones are evicted
+    once the cached arrays exceed maxBytes.  Entries are keyed by filename, size and modification
+    time, so a posterior rewritten after it was cached is read again.
 
-def calculateBinaryVolume(dirname, label, _isAccumulated=True, tolerance=_tolerance):
-    label = label.upper()
+    calculatePosteriorVolumes uses a new cache per call unless one is passed in, e.g. to share
+    the reads of one session between several calls.
+    """
 
-    maskSum = 0.0
+    def __init__(self, maxBytes=2 * 1024 ** 3):
+        self.maxBytes = maxBytes
+        self._images = OrderedDict()
+        self._bytes = 0
+
+    def get(self, filename):
+        """
+        Returns (array, spacing) for filename, reading the file if it is not cached or has changed
+        """
+        assert os.path.exists(filename), "File not found: %s" % filename
+        fileStat = os.stat(filename)
+        key = (os.path.abspath(filename), fileStat.st_size, fileStat.st_mtime)
+        if key in self._images:
+            self._images[key] = self._images.pop(key)
+            return self._images[key]
+        for stale in [cached for cached in self._images if cached[0] == key[0]]:
+            self._bytes -= self._images.pop(stale)[0].nbytes
+        image = sitk.ReadImage(filename, sitk.sitkFloat32)
+        entry = (sitk.GetArrayFromImage(image), image.GetSpacing())
+        del image
+        self._images[key] = entry
+        self._bytes += entry[0].nbytes
+        while self._bytes > self.maxBytes and len(self._images) > 1:
+            _, (evicted, _) = self._images.popitem(last=False)
+            self._bytes -= evicted.nbytes
+        return entry
+
+    def clear(self):
+        self._images.clear()
+        self._bytes = 0
+
+
+def _posteriorFilename(dirname, label, _isAccumulated):
     if _isAccumulated:
         fileDir = _config.get('Results', 'accumulated')
     else:
-        # print "Not accumulated: ", label
         fileDir = _config.get('Results', 'partials')
+    return os.path.join(dirname, fileDir, 'POSTERIOR_' + label.upper() + '.nii.gz')
 
-    if label == 'ICV':
-        for sublabel in accumulated:
-            if sublabel == 'background_total':
-                continue
-            else:
-                # print "sublabel: ", sublabel, calculateBinaryVolume(dirname, sublabel, True)
-                maskSum += calculateBinaryVolume(dirname, sublabel, True)
-        return maskSum
-
-    labelFile = os.path.join(dirname, fileDir, 'POSTERIOR_' + label + '.nii.gz')
-    assert os.path.exists(labelFile), "File not found: %s" % labelFile
-    image = sitk.ReadImage(labelFile)
-    lowerTol, upperTol = tolerance
-    binary = sitk.BinaryThreshold(image, lowerTol, upperTol, 1, 0)
-    nda = sitk.GetArrayFromImage(binary)
-    maskSum += nda.sum()
-    ## print maskSum
-    size = image.GetSpacing()
-    ## print size
-    return maskSum * size[0] * size[1] * size[2]
 
-
-def calculatePartialVolume(dirname, label, _isAccumulated=True):
+def _expandLabel(label):
     """
+    Returns the (label, _isAccumulated) posteriors that make up label; ICV is the sum of the
+    accumulated posteriors except the background
     """
-    label = label.upper()
+    label = label.lower()
+    if label == 'icv':
+        return [(sublabel, True) for sublabel in accumulated if sublabel != 'background_total']
+    return [(label, label in accumulated)]
 
-    maskSum = 0.0
-    if _isAccumulated:
-        fileDir = _config.get('Results', 'accumulated')
-    else:
-        fileDir = _config.get('Results', 'partials')
 
-    if label == 'ICV':
-        for sublabel in accumulated:
-            if sublabel == 'background_total':
-                continue
-            else:
-                # print "sublabel: ", sublabel, calculatePartialVolume(dirname, sublabel, True)
-                maskSum += calculatePartialVolume(dirname, sublabel, True)
-        return maskSum
-
-    labelFile = os.path.join(dirname, fileDir, 'POSTERIOR_' + label + '.nii.gz')
-    assert os.path.exists(labelFile), "File not found: %s" % labelFile
-    image = sitk.ReadImage(labelFile)
-    nda = sitk.GetArrayFromImage(image)
-    maskSum = nda.sum()
-    ## print maskSum
-    size = image.GetSpacing()
-    ## print size
-    return maskSum * size[0] * size[1] * size[2]
+def calculatePosteriorVolumes(dirname, labels, binary=True, tolerance=_tolerance, cache=None):
+    """
+    Returns an OrderedDict {label: volume} for every label in labels.
+
+    Each posterior needed by any label (including the components of ICV) is loaded once through
+    the cache (a new one unless given) and reduced once; the per-label volumes are then sums of
+    those reductions.
+    """
+    if cache is None:
+        cache = PosteriorCache()
+    lowerTol, upperTol = tolerance
+    posteriorVolumes = dict()
+    volumes = OrderedDict()
+    for label in labels:
+        volume = 0.0
+        for sublabel, subIsAccumulated in _expandLabel(label):
+            filename = _posteriorFilename(dirname, sublabel, subIsAccumulated)
+            if filename not in posteriorVolumes:
+                nda, size = cache.get(filename)
+                if binary:
+                    maskSum = np.count_nonzero((nda >= lowerTol) & (nda <= upperTol))
+                else:
+                    maskSum = nda.sum(dtype=np.float64)
+                posteriorVolumes[filename] = maskSum * size[0] * size[1] * size[2]
+            volume += posteriorVolumes[filename]
+        volumes[label] = volume
+    return volumes
+
+
+def calculateBinaryVolume(dirname, label, _isAccumulated=True, tolerance=_tolerance, cache=None):
+    label = label.upper()
+    if label != 'ICV':
+        filename = _posteriorFilename(dirname, label, _isAccumulated)
+        if cache is None:
+            cache = PosteriorCache()
+        nda, size = cache.get(filename)
+        lowerTol, upperTol = tolerance
+        maskSum = np.count_nonzero((nda >= lowerTol) & (nda <= upperTol))
+        return maskSum * size[0] * size[1] * size[2]
+    return calculatePosteriorVolumes(dirname, [label], True, tolerance, cache)[label]
+
+
+def calculatePartialVolume(dirname, label, _isAccumulated=True, cache=None):
+    """
+    """
+    label = label.upper()
+    if label != 'ICV':
+        filename = _posteriorFilename(dirname, label, _isAccumulated)
+        if cache is None:
+            cache = PosteriorCache()
+        nda, size = cache.get(filename)
+        return nda.sum(dtype=np.float64) * size[0] * size[1] * size[2]
+    return calculatePosteriorVolumes(dirname, [label], False, cache=cache)[label]
 
 
 def getPosteriorVolume(*args, **kwds):
     """
 
     """
-    dirname = labels = project = subject = session = experimentDir = None
+    dirname = labels = project = subject = session = experimentDir = binary = cache = None
     experimentDir = _config.get('Results', 'directory')
     # parse keywords
     for key, value in list(kwds.items()):
@@ -133,6 +174,8 @@ def getPosteriorVolume(*args, **kwds):
             session = value
         elif key == 'binary':
             binary = value
+        elif key == 'cache':
+            cache = value
     # Set keyword-only defaults
     if binary is None:
         binary = True
@@ -153,16 +196,9 @@ def getPosteriorVolume(*args, **kwds):
             except Exception as err:
                 raise err
     assert dirname is not None
-    volume = 0.0
     if isinstance(labels, str):
         labels = [labels]
 
     for label in labels:
-        label = label.upper()
-        _checkLabel(label)
-        _setIfAccumulated(label)
-        if binary:
-            volume += calculateBinaryVolume(dirname, label, _isAccumulated)
-        else:
-            volume += calculatePartialVolume(dirname, label, _isAccumulated)
-    return volume
+        _checkLabel(label.upper())
+    return sum(calculatePosteriorVolumes(dirname, [label.upper() for label in labels], binary, cache=cache).values())
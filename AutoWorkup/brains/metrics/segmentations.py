@@ -1,13 +1,11 @@
 from __future__ import print_function
 
 import os.path
-from builtins import map
 from builtins import range
 
 import SimpleITK as sitk
 import numpy as np
 
-from .partials import calcutateBinaryVolume
 from ..common import check_file
 from ..config import _config
 
@@ -26,7 +24,7 @@ def constructLabels(labels):
 
 def _moduleCreateLabels(labels):
     full_labels, numbers = constructLabels(labels)
-    labelMap = map(None, full_labels, numbers)
+    labelMap = zip(full_labels, numbers)
     return dict(labelMap)  # Use this variable
 
 
@@ -59,16 +57,23 @@ def calculateLabelVolume(dirname, label):
 
 
 def calculateICV(dirname):
+    """
+    Returns the volume of the brain labels, i.e. the nonzero voxels of the fixed_brainlabels_seg.nii.gz
+    label map in the partials directory of dirname
+    """
     filename = os.path.join(dirname, _config.get('Results', 'partials'),
                             'fixed_brainlabels_seg.nii.gz')
     filename = check_file(filename)
-    calculateBinaryVolume(filename)
+    assert filename is not None, "File not found: fixed_brainlabels_seg.nii.gz in %s" % dirname
+    image = sitk.ReadImage(filename)
+    size = image.GetSpacing()
+    return np.count_nonzero(sitk.GetArrayViewFromImage(image)) * size[0] * size[1] * size[2]
 
 
 def getVolume(args=[], kwds={}):
     dirname = labels = project = subject = session = experimentDir = None
     experimentDir = _config.get('Results', 'directory')  # HACK
-    for key, value in kwds:
+    for key, value in list(kwds.items()):
         if key == 'dirname':
             dirname = check_file(value)
         elif key == 'labels':
@@ -121,7 +121,8 @@ def createAndRun(sessions, environment, experiment, pipeline, cluster, useSentin
     database = OpenSubjectDatabase(experiment['cachedir'], ['all'], environment['prefix'], experiment['dbfile'])
     database.open_connection()
     try:
-        all_sessions = database.getAllSessions()
+        session_manifest = database.getSessionManifest(sessions)
+        all_sessions = list(session_manifest.keys())
         if not set(sessions) <= set(all_sessions) and 'all' not in sessions:
             missing = set(sessions) - set(all_sessions)
             assert len(missing) == 0, "Requested sessions are missing from the database: {0}\n\n{1}".format(missing,
@@ -135,29 +136,31 @@ def createAndRun(sessions, environment, experiment, pipeline, cluster, useSentin
         print("!=" * 40)
         for session in sessions:
             _dict = OrderedDict()
-            t1_list = database.getFilenamesByScantype(session, ['T1-15', 'T1-30'])
+            session_info = session_manifest[session]
+            scans = session_info['scans']
+            subject = session_info['subject']
+            t1_list = database.getFilenamesFromScans(scans, ['T1-15', 'T1-30'])
             if len(t1_list) == 0:
                 print("ERROR: Skipping session {0} for subject {1} due to missing T1's".format(session, subject))
                 print("REMOVE OR FIX BEFORE CONTINUING")
                 continue
-            subject = database.getSubjFromSession(session)
             _dict['session'] = session
-            _dict['project'] = database.getProjFromSession(session)
+            _dict['project'] = session_info['project']
             _dict['subject'] = subject
             _dict['T1s'] = t1_list
-            _dict['T2s'] = database.getFilenamesByScantype(session, ['T2-15', 'T2-30'])
+            _dict['T2s'] = database.getFilenamesFromScans(scans, ['T2-15', 'T2-30'])
             _dict['BadT2'] = False
-            if _dict['T2s'] == database.getFilenamesByScantype(session, ['T2-15']):
+            if _dict['T2s'] == database.getFilenamesFromScans(scans, ['T2-15']):
                 print("This T2 is not going to be used for JointFusion")
                 print("This T2 is not going to be used for JointFusion")
                 print("This T2 is not going to be used for JointFusion")
                 print("This T2 is not going to be used for JointFusion")
                 print(_dict['T2s'])
                 _dict['BadT2'] = True
-            _dict['PDs'] = database.getFilenamesByScantype(session, ['PD-15', 'PD-30'])
-            _dict['FLs'] = database.getFilenamesByScantype(session, ['FL-15', 'FL-30'])
-            _dict['EMSP'] = database.getFilenamesByScantype(session, ['EMSP'])
-            _dict['OTHERs'] = database.getFilenamesByScantype(session, ['OTHER-15', 'OTHER-30'])
+            _dict['PDs'] = database.getFilenamesFromScans(scans, ['PD-15', 'PD-30'])
+            _dict['FLs'] = database.getFilenamesFromScans(scans, ['FL-15', 'FL-30'])
+            _dict['EMSP'] = database.getFilenamesFromScans(scans, ['EMSP'])
+            _dict['OTHERs'] = database.getFilenamesFromScans(scans, ['OTHER-15', 'OTHER-30'])
             sentinal_file_basedir = os.path.join(
                 master_config['resultdir'],
                 _dict['project'],
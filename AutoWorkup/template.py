@@ -114,8 +114,9 @@ def get_processed_subjects(resultdir, input_subjects_list):
 def get_subjects_sessions_dictionary(input_subjects, cache, resultdir, prefix, dbfile, useSentinal, shuffle=False):
     import random
     _temp = OpenSubjectDatabase(cache, ['all'], prefix, dbfile)
+    all_subject_sessions = _temp.getSubjectSessionsDictionary()
     if "all" in input_subjects:
-        input_subjects = _temp.getAllSubjects();
+        input_subjects = list(all_subject_sessions.keys())
     if useSentinal:
         print("=" * 80)
         print("Using Sentinal Files to Limit Jobs Run")
@@ -129,7 +130,7 @@ def get_subjects_sessions_dictionary(input_subjects, cache, resultdir, prefix, d
         random.shuffle(subjects)  # randomly shuffle to get max cluster efficiency
     subject_sessions_dictionary = dict()
     for subject in subjects:
-        subject_sessions_dictionary[subject] = _temp.getSessionsFromSubject(subject)
+        subject_sessions_dictionary[subject] = all_subject_sessions.get(subject, [])
     return subjects, subject_sessions_dictionary
 
 
@@ -145,6 +145,16 @@ def parseExperiment(parser, workflow_phase):
         pass
     retval['use_registration_masking'] = useRegistrationMasking
 
+    ## Images that stay in the cache directory are re-read within minutes by the next node; writing them
+    ## uncompressed trades disk space for faster hand-off (DataSink'd results are always .nii.gz)
+    uncompressedIntermediates = False
+    if parser.has_option('EXPERIMENT', 'UNCOMPRESSED_INTERMEDIATE_IMAGES'):
+        uncompressedIntermediates = str2bool(getASCIIFromParser(parser, 'EXPERIMENT', 'UNCOMPRESSED_INTERMEDIATE_IMAGES'))
+    if uncompressedIntermediates:
+        retval['intermediate_image_extension'] = '.nii'
+    else:
+        retval['intermediate_image_extension'] = '.nii.gz'
+
     atlas = validatePath(getASCIIFromParser(parser, 'EXPERIMENT', 'ATLAS_PATH'), False, True)
     retval['atlascache'] = clone_atlas_dir(retval['cachedir'], atlas)
 
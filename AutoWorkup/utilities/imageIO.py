@@ -0,0 +1,253 @@
+"""
+imageIO.py
+==========
+
+Image writing for the pipeline Function nodes; use WriteImage or ImageWriter instead of sitk.WriteImage.
+
+'.nii.gz' files are compressed in independent blocks by a pool of threads (zlib releases the GIL),
+each block stored as a complete gzip member.  Like bgzip output, the concatenated members are a
+valid gzip stream, read by gzip, zlib and ITK as usual.  Other file types are written by SimpleITK.
+
+The compression is configured for the whole pipeline by environment variables, which can be set
+in the ENVAR_DICT of the configuration file so that they reach the cluster nodes:
+
+* BAW_IMAGE_COMPRESSION_LEVEL    zlib level 0-9 (default 6, the zlib default)
+* BAW_IMAGE_COMPRESSION_THREADS  compression threads (default NSLOTS, or the number of cpus)
+
+ImageWriter is a write-behind queue: images are written by a background thread while the node
+computes its next output.
+
+ReadImageArray memory-maps uncompressed '.nii' inputs (see UNCOMPRESSED_INTERMEDIATE_IMAGES in
+the configuration file) instead of reading them through SimpleITK.
+
+PassThroughImageFile hard-links (or copies) an input file to an output of the same file type, for
+nodes whose output would be a re-encoded copy of their input.
+"""
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+
+import numpy as np
+import SimpleITK as sitk
+
+DEFAULT_COMPRESSION_LEVEL = 6
+COMPRESSION_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def _GetIntegerFromEnvironment(name):
+    """ Integer value of an environment variable, None if unset; the cluster job script exports
+    the ENVAR_DICT values as 'value:$NAME' (see utilities/distributed.py), so only the first field is used """
+    value = os.environ.get(name, '').split(os.pathsep)[0].strip()
+    if value == '':
+        return None
+    return int(value)
+
+
+def GetCompressionLevel():
+    compressionLevel = _GetIntegerFromEnvironment('BAW_IMAGE_COMPRESSION_LEVEL')
+    if compressionLevel is None:
+        return DEFAULT_COMPRESSION_LEVEL
+    return compressionLevel
+
+
+def GetCompressionThreads():
+    threads = _GetIntegerFromEnvironment('BAW_IMAGE_COMPRESSION_THREADS')
+    if threads is None:
+        threads = _GetIntegerFromEnvironment('NSLOTS')
+    if threads is None:
+        return cpu_count()
+    return max(1, threads)
+
+
+def _GzipBlock(block, compressionLevel):
+    compressor = zlib.compressobj(compressionLevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip header and trailer
+    return compressor.compress(block) + compressor.flush()
+
+
+def GzipBlocks(data, compressionLevel=None, threads=None, blockSize=None):
+    """ Compress data as a sequence of gzip members of blockSize uncompressed bytes, in parallel
+
+    >>> import gzip
+    >>> data = b'BRAINSTools' * 1000
+    >>> gzip.decompress(GzipBlocks(data, threads=3, blockSize=1000)) == data
+    True
+    """
+    if compressionLevel is None:
+        compressionLevel = GetCompressionLevel()
+    if threads is None:
+        threads = GetCompressionThreads()
+    if blockSize is None:
+        blockSize = COMPRESSION_BLOCK_SIZE
+    data = memoryview(data)
+    blocks = [data[start:start + blockSize] for start in range(0, max(len(data), 1), blockSize)]
+    if threads == 1 or len(blocks) == 1:
+        return b''.join(_GzipBlock(block, compressionLevel) for block in blocks)
+    with ThreadPoolExecutor(max_workers=min(threads, len(blocks))) as pool:
+        return b''.join(pool.map(lambda block: _GzipBlock(block, compressionLevel), blocks))
+
+
+def WriteImage(image, fileName, compressionLevel=None, threads=None):
+    """ Write image to fileName, compressing '.gz' files in parallel blocks; returns the real path of fileName """
+    fileName = os.path.realpath(fileName)
+    if not fileName.endswith('.gz'):
+        sitk.WriteImage(image, fileName)
+        return fileName
+
+    outputDir, baseName = os.path.split(fileName)
+    uncompressedFd, uncompressedFileName = tempfile.mkstemp(suffix='_' + baseName[:-len('.gz')], dir=outputDir)
+    os.close(uncompressedFd)
+    partialFileName = fileName + '.partial'
+    try:
+        sitk.WriteImage(image, uncompressedFileName, False)
+        with open(uncompressedFileName, 'rb') as uncompressedFile:
+            data = uncompressedFile.read()
+        os.remove(uncompressedFileName)
+        with open(partialFileName, 'wb') as compressedFile:
+            compressedFile.write(GzipBlocks(data, compressionLevel, threads))
+        del data
+        os.rename(partialFileName, fileName)  # readers never see a partially written file
+    finally:
+        for leftover in [uncompressedFileName, partialFileName]:
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    return fileName
+
+
+## File types holding the header and the voxels in one file, which can be passed through as a single file
+SINGLE_FILE_IMAGE_TYPES = ('.nii', '.nii.gz', '.nrrd', '.mha')
+
+
+def ImageFileType(fileName):
+    """ Lower case extension of an image file name, including a compression suffix
+
+    >>> ImageFileType('/data/T1_unwrapped.NII.GZ')
+    '.nii.gz'
+    """
+    root, extension = os.path.splitext(fileName.lower())
+    if extension == '.gz':
+        extension = os.path.splitext(root)[1] + extension
+    return extension
+
+
+def PassThroughImageFile(sourceFileName, fileName):
+    """ Hard-link sourceFileName to fileName, or copy it when they are on different file systems, without
+    decoding it; returns the real path of fileName, or None when the file types differ and the image has
+    to be written """
+    fileType = ImageFileType(fileName)
+    if fileType not in SINGLE_FILE_IMAGE_TYPES or ImageFileType(sourceFileName) != fileType:
+        return None
+    sourceFileName = os.path.realpath(sourceFileName)
+    fileName = os.path.realpath(fileName)
+    if sourceFileName == fileName:
+        return fileName
+    if os.path.lexists(fileName):
+        os.remove(fileName)  # a rerun must not write through an existing link into the source
+    try:
+        os.link(sourceFileName, fileName)
+    except OSError:
+        shutil.copyfile(sourceFileName, fileName)
+    return fileName
+
+
+## NIfTI-1 datatype codes of the pixel types ReadImageArray memory-maps
+NIFTI_DTYPES = {2: 'u1', 4: 'i2', 8: 'i4', 16: 'f4', 64: 'f8', 256: 'i1', 512: 'u2', 768: 'u4', 1024: 'i8', 1280: 'u8'}
+
+
+def _MapNiftiArray(fileName):
+    """ Read-only np.memmap of the voxels of an uncompressed single-file NIfTI-1 scalar image, None if
+    the file can not be mapped as is (other format, vector pixels or intensity scaling) """
+    header = np.fromfile(fileName, dtype=np.uint8, count=348)
+    if len(header) < 348:
+        return None
+    for byteOrder in '<>':
+        if header[:4].view(byteOrder + 'i4')[0] == 348 and header[344:348].tobytes() == b'n+1\0':
+            break
+    else:
+        return None
+    dim = header[40:56].view(byteOrder + 'i2')
+    datatype = int(header[70:72].view(byteOrder + 'i2')[0])
+    voxOffset = int(header[108:112].view(byteOrder + 'f4')[0])
+    sclSlope, sclInter = header[112:120].view(byteOrder + 'f4')
+    numberOfDimensions = int(dim[0])
+    if datatype not in NIFTI_DTYPES or not 1 <= numberOfDimensions <= 3 or \
+            sclSlope not in (0.0, 1.0) or sclInter != 0.0:
+        return None
+    shape = tuple(int(size) for size in dim[numberOfDimensions:0:-1])  # z, y, x as sitk.GetArrayFromImage
+    return np.memmap(fileName, dtype=byteOrder + NIFTI_DTYPES[datatype], mode='r', offset=voxOffset, shape=shape)
+
+
+def ReadImageArray(fileName):
+    """ Voxels of an image as a NumPy array in sitk.GetArrayFromImage order; uncompressed '.nii' files are
+    memory-mapped read-only instead of being read """
+    if fileName.endswith('.nii'):
+        array = _MapNiftiArray(fileName)
+        if array is not None:
+            return array
+    return sitk.GetArrayFromImage(sitk.ReadImage(fileName))
+
+
+class ImageWriter(object):
+    """ Write-behind queue of image writes
+
+    Write() returns the real path of the output as soon as the image is queued; at most maxPending
+    images wait in the queue, so a node producing outputs faster than they are written blocks
+    instead of holding all of them in memory.  Wait() (or leaving the with block) waits for all
+    writes and re-raises the first write error.
+
+    With background=False the writes happen in Write(), which is convenient for debugging.
+    """
+
+    def __init__(self, background=True, maxPending=2, compressionLevel=None, threads=None):
+        self.compressionLevel = compressionLevel
+        self.threads = threads
+        self._pendingWrites = list()
+        if background:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+            self._slots = threading.BoundedSemaphore(maxPending)
+        else:
+            self._executor = None
+
+    def _Write(self, image, fileName):
+        try:
+            return WriteImage(image, fileName, self.compressionLevel, self.threads)
+        finally:
+            self._slots.release()
+
+    def Write(self, image, fileName):
+        if self._executor is None:
+            return WriteImage(image, fileName, self.compressionLevel, self.threads)
+        self._slots.acquire()
+        self._pendingWrites.append(self._executor.submit(self._Write, image, fileName))
+        return os.path.realpath(fileName)
+
+    def Wait(self):
+        if self._executor is None:
+            return
+        pendingWrites, self._pendingWrites = self._pendingWrites, list()
+        for pendingWrite in pendingWrites:
+            pendingWrite.result()  # re-raise write errors from the background thread
+
+    def Close(self):
+        try:
+            self.Wait()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.Close()
+        elif self._executor is not None:
+            self._executor.shutdown(wait=True)  # keep the original exception
+            self._executor = None
+        return False
@@ -3,6 +3,9 @@ Image processing functions for pipelines
 """
 from builtins import range
 
+import numpy as np
+import SimpleITK as sitk
+
 
 def FixWMPartitioning(brainMask, PosteriorsList):
     """"There were some errors in mis-classifications for WM/NON_WM"""
@@ -109,3 +112,131 @@ def FixWMPartitioning(brainMask, PosteriorsList):
         MatchingLabelList.append(POSTERIOR_LABELS[post_key][1])
 
     return UpdatedPosteriorsList, MatchingFGCodeList, MatchingLabelList, nonAirRegionMask
+
+
+def AdjacentSliceDifferences(image_as_np):
+    """ Sum of squared differences between every slice and the next one, circularly, along each of the
+    three NumPy axes; one wrapped np.diff and one einsum reduction per axis instead of a loop over slice pairs
+
+    >>> [values.tolist() for values in AdjacentSliceDifferences(np.arange(8).reshape(2, 2, 2))]
+    [[64.0, 64.0], [16.0, 16.0], [4.0, 4.0]]
+    """
+    image_as_np = np.asarray(image_as_np, dtype=np.float64)  # no integer overflow of the squares
+    slice_values = list()
+    for axis in range(3):
+        diff = np.diff(image_as_np, axis=axis, append=np.take(image_as_np, [0], axis))
+        slice_values.append(np.einsum('ijk,ijk->' + 'ijk'[axis], diff, diff))
+        del diff
+    return slice_values
+
+
+def FindUnwrapRoll(slice_values):
+    """ np.roll shift that moves the slice with the largest increase of the (clipped) adjacent slice
+    differences to the first slice, as the shift of smallest magnitude
+
+    The derivative is the wrapped central difference, i.e. savgol_filter(window_length=3, polyorder=1,
+    deriv=1, mode='wrap'), which is what the first implementation used.
+
+    >>> FindUnwrapRoll(np.array([1., 1., 1., 1., 1., 1., 5., 5.]))
+    3
+    >>> FindUnwrapRoll(np.array([1., 5., 5., 5., 5., 5., 5., 5.]))
+    -1
+    """
+    slice_values = np.minimum(slice_values, 5 * slice_values[0])
+    derivative = (np.roll(slice_values, -1) - np.roll(slice_values, 1)) / 2.0
+    cut_slice = int(np.argmax(derivative))
+    number_of_slices = len(slice_values)
+    if cut_slice > number_of_slices / 2:
+        return number_of_slices - cut_slice
+    return -cut_slice
+
+
+def IsWrappedAlongAxis(mask_as_np, axis, emptySliceFraction=0.01):
+    """ True when the foreground touches both ends of axis and some slice in between is empty, i.e. when
+    the head was split across the image boundary; slices with less than emptySliceFraction of the
+    largest slice foreground count are considered empty """
+    counts = mask_as_np.sum(axis=tuple(other for other in range(mask_as_np.ndim) if other != axis))
+    occupied = counts > emptySliceFraction * counts.max()
+    return bool(occupied[0] and occupied[-1] and not occupied.all())
+
+
+def AutoUnwrapImage(wrapped_image):
+    """ Roll the image with circular boundaries such that the head is not split across the image boundaries
+
+    Only the axes along which the head is wrapped (see IsWrappedAlongAxis) are rolled, by the roll of
+    FindUnwrapRoll, and the origin is moved so that the unwrapped voxels keep their physical location.
+    Returns the unwrapped image and the rolls in NumPy (z, y, x) order.
+    """
+    mask = 1.0 - sitk.OtsuThreshold(wrapped_image)
+    mask = sitk.BinaryClosingByReconstruction(mask, [6, 6, 6])  ## Fill some small holes
+    mask_as_np = sitk.GetArrayFromImage(mask)
+    image_as_np = sitk.GetArrayFromImage(wrapped_image)
+
+    rolls = [0, 0, 0]
+    wrapped_axes = [axis for axis in range(3) if IsWrappedAlongAxis(mask_as_np, axis)]
+    if len(wrapped_axes) == 0:
+        return wrapped_image, rolls
+    slice_values = AdjacentSliceDifferences(image_as_np * mask_as_np)
+    for axis in wrapped_axes:
+        rolls[axis] = FindUnwrapRoll(slice_values[axis])
+    del mask_as_np, slice_values
+
+    unwrapped_image = sitk.GetImageFromArray(np.roll(image_as_np, rolls, axis=(0, 1, 2)))
+    unwrapped_image.CopyInformation(wrapped_image)
+    unwrapped_image.SetOrigin(wrapped_image.TransformContinuousIndexToPhysicalPoint(
+        [float(-roll) for roll in rolls[::-1]]))
+    return unwrapped_image, rolls
+
+
+def GetFlipPermuteToIdentity(direction):
+    """ Axis permutation and flips that bring a 3D direction cosine matrix closest to identity
+
+    Returns the sitk.PermuteAxes order and the sitk.Flip axes of the permuted image.  An oblique
+    (near-identity) direction needs neither, so its voxels are used as they are.
+
+    >>> GetFlipPermuteToIdentity([0, 0, -1, 1, 0, 0, 0, -1, 0])
+    ([2, 0, 1], [True, False, True])
+    >>> GetFlipPermuteToIdentity([0.999, 0.04, 0, -0.04, 0.999, 0, 0, 0, 1])
+    ([0, 1, 2], [False, False, False])
+    """
+    dc = np.array(direction, dtype=np.float64).reshape(3, 3)
+    permute_values = [int(np.argmax(np.abs(dc[i, :]))) for i in range(3)]
+    permuted_dc = dc[:, permute_values]
+    flip_values = [bool(permuted_dc[i, i] < 0) for i in range(3)]
+    return permute_values, flip_values
+
+
+def IsIdentityFlipPermute(permute_values, flip_values):
+    return list(permute_values) == [0, 1, 2] and not any(flip_values)
+
+
+def FlipPermuteToIdentity(sitkImageIn):
+    """ sitk.Flip(sitk.PermuteAxes(sitkImageIn, permute_values), flip_values) of GetFlipPermuteToIdentity,
+    as one strided NumPy view of the voxels that is copied once into the output image
+
+    The input image itself is returned when no permutation or flip is needed.
+    """
+    permute_values, flip_values = GetFlipPermuteToIdentity(sitkImageIn.GetDirection())
+    if IsIdentityFlipPermute(permute_values, flip_values):
+        return sitkImageIn
+
+    ## NumPy axes are the reversed image axes, vector components stay last
+    image_as_np = sitk.GetArrayViewFromImage(sitkImageIn)
+    np_axes = [2 - permute_values[2 - np_axis] for np_axis in range(3)] + list(range(3, image_as_np.ndim))
+    flip_slices = [slice(None, None, -1) if flip_values[2 - np_axis] else slice(None) for np_axis in range(3)]
+    ## a contiguous buffer is handed to SimpleITK as is, a strided one goes through a much slower element copy
+    reoriented_image = sitk.GetImageFromArray(np.ascontiguousarray(image_as_np.transpose(np_axes)[tuple(flip_slices)]),
+                                              isVector=sitkImageIn.GetNumberOfComponentsPerPixel() > 1)
+
+    dc = np.array(sitkImageIn.GetDirection()).reshape(3, 3)[:, permute_values]
+    spacing = np.array(sitkImageIn.GetSpacing())[permute_values]
+    size = np.array(sitkImageIn.GetSize())[permute_values]
+    origin = np.array(sitkImageIn.GetOrigin())
+    for i in range(3):
+        if flip_values[i]:  ## the last voxel along a flipped axis becomes the first
+            origin = origin + dc[:, i] * spacing[i] * (size[i] - 1)
+            dc[:, i] = -dc[:, i]
+    reoriented_image.SetOrigin([float(value) for value in origin])
+    reoriented_image.SetSpacing([float(value) for value in spacing])
+    reoriented_image.SetDirection([float(value) for value in dc.flatten()])
+    return reoriented_image
@@ -0,0 +1,91 @@
+"""
+labelMaps.py
+============
+
+Helpers shared by the nodes that rewrite label maps (see workflows/FixLabelMapsTools.py).
+
+Label recoding is done with a lookup table: the (old, new) pairs of a recode table are composed,
+in order, into one dense array indexed by label value, which is then applied with a single
+gather over the label buffer.
+"""
+from __future__ import absolute_import
+
+import csv
+
+import numpy as np
+import SimpleITK as sitk
+
+
+def readRecodingList(recodeLabelFilename):
+    """ Read the (original label, target label) pairs of a recode csv file
+
+    Each row is ``origLbl,origName,targetLbl,targetName``; empty rows and rows starting with '#' are skipped.
+    """
+    recodeLabelPairList = []
+    with open(recodeLabelFilename, 'r') as f:
+        reader = csv.reader(f, delimiter=',')
+        for line in reader:
+            if len(line) == 0 or line[0].startswith("#"):
+                continue
+            origLbl, origName, targetLbl, targetName = line
+            recodeLabelPairList.append((int(origLbl), int(targetLbl)))
+    return recodeLabelPairList
+
+
+def MinimumUnsignedPixelType(maxValue):
+    """ The smallest unsigned (SimpleITK pixel type, NumPy dtype) holding maxValue, as MinimizeSizeOfImage chooses
+
+    >>> MinimumUnsignedPixelType(254)[1]
+    <class 'numpy.uint8'>
+    >>> MinimumUnsignedPixelType(255)[1]
+    <class 'numpy.uint16'>
+    """
+    if maxValue < (2 ** 8) - 1:
+        return sitk.sitkUInt8, np.uint8
+    elif maxValue < (2 ** 16) - 1:
+        return sitk.sitkUInt16, np.uint16
+    elif maxValue < (2 ** 32) - 1:
+        return sitk.sitkUInt32, np.uint32
+    elif maxValue < (2 ** 64) - 1:
+        return sitk.sitkUInt64, np.uint64
+    return None, None
+
+
+def MinimizeSizeOfImage(outlabels):
+    """This function will find the largest integer value in the labelmap, and
+    cast the image to the smallest possible integer size so that no loss of data
+    results."""
+    measureFilt = sitk.StatisticsImageFilter()
+    measureFilt.Execute(outlabels)
+    pixelType, _ = MinimumUnsignedPixelType(measureFilt.GetMaximum())
+    if pixelType is not None:
+        outlabels = sitk.Cast(outlabels, pixelType)
+    return outlabels
+
+
+def MakeRecodeLookupTable(RECODE_TABLE, maxLabel):
+    """ Compose the (old, new) pairs, applied in order, into a lookup table for the labels 0..maxLabel
+
+    >>> MakeRecodeLookupTable([(1, 5), (5, 2), (3, 9)], 5).tolist()
+    [0, 2, 2, 9, 4, 2]
+    """
+    lookupTable = np.arange(maxLabel + 1, dtype=np.uint32)
+    for (old, new) in RECODE_TABLE:
+        lookupTable[lookupTable == old] = new
+    return lookupTable
+
+
+def RecodeLabelArray(labelArray, RECODE_TABLE):
+    """ Recode a non-negative integer label array, returning a new array of the smallest unsigned dtype """
+    lookupTable = MakeRecodeLookupTable(RECODE_TABLE, int(labelArray.max()) if labelArray.size else 0)
+    recoded = lookupTable.take(labelArray)
+    _, dtype = MinimumUnsignedPixelType(int(recoded.max()) if recoded.size else 0)
+    return recoded.astype(dtype, copy=False)
+
+
+def RecodeLabelImage(labelImage, RECODE_TABLE):
+    """ Recode a label image in one pass; the output has the pixel type MinimizeSizeOfImage would choose """
+    labelImage = sitk.Cast(labelImage, sitk.sitkUInt32)
+    recodedImage = sitk.GetImageFromArray(RecodeLabelArray(sitk.GetArrayViewFromImage(labelImage), RECODE_TABLE))
+    recodedImage.CopyInformation(labelImage)
+    return recodedImage
@@ -0,0 +1,129 @@
+"""
+labelTopology.py
+================
+
+Connected components of label maps, shared by the nodes that clean label maps
+(workflows/FixLabelMapsTools.py and workflows/baseline.py).
+
+LabelTopology computes the connected components of all requested labels in one labeled pass
+(ScalarConnectedComponent with a zero distance threshold, so neighboring voxels are connected
+only when they have the same label).  Component sizes, owning labels and bounding boxes are
+cached, and components are ordered within each label the way RelabelComponent orders them
+(by decreasing size, ties broken by raster order), so "largest component of label k" gives the
+same answer as ConnectedComponent + RelabelComponent on the mask of label k.
+"""
+from __future__ import absolute_import
+
+import numpy as np
+import SimpleITK as sitk
+
+
+class LabelTopology(object):
+    def __init__(self, labelImage, labels=None, fullyConnected=False):
+        """
+        :param labelImage: integer label image
+        :param labels: labels whose components are needed, None for all labels of the image
+        :param fullyConnected: passed to the connected component filter
+        """
+        self.referenceImage = labelImage
+        labelArray = sitk.GetArrayViewFromImage(labelImage)
+        if labels is not None:
+            labelArray = np.where(np.isin(labelArray, list(labels)), labelArray, 0).astype(labelArray.dtype)
+            labelImage = sitk.GetImageFromArray(labelArray)
+            labelImage.CopyInformation(self.referenceImage)
+
+        componentFilter = sitk.ScalarConnectedComponentImageFilter()
+        componentFilter.SetDistanceThreshold(0)
+        componentFilter.SetFullyConnected(fullyConnected)
+        self.componentImage = componentFilter.Execute(labelImage)
+        self.componentArray = sitk.GetArrayViewFromImage(self.componentImage)
+
+        flatComponents = self.componentArray.reshape(-1)
+        self.componentSizes = np.bincount(flatComponents)
+        self.componentLabels = np.zeros(len(self.componentSizes), dtype=np.int64)
+        self.componentLabels[flatComponents] = labelArray.reshape(-1)
+        self._componentBoundingBoxes = None
+        self._labelComponents = dict()
+
+    def GetComponents(self, label):
+        """ Component ids of label, largest first (RelabelComponent order) """
+        if label not in self._labelComponents:
+            componentIds = np.flatnonzero(self.componentLabels == label)
+            componentIds = componentIds[self.componentSizes[componentIds] > 0]
+            order = np.lexsort((componentIds, -self.componentSizes[componentIds]))
+            self._labelComponents[label] = componentIds[order]
+        return self._labelComponents[label]
+
+    def GetLargestComponent(self, label):
+        """ Id of the largest component of label, None if the label is absent """
+        componentIds = self.GetComponents(label)
+        if len(componentIds) == 0:
+            return None
+        return int(componentIds[0])
+
+    def GetComponentSize(self, componentId):
+        return int(self.componentSizes[componentId])
+
+    def GetComponentBoundingBox(self, componentId):
+        """ Bounding box of a component as a tuple of NumPy (z, y, x) slices """
+        if self._componentBoundingBoxes is None:
+            shapeFilter = sitk.LabelShapeStatisticsImageFilter()
+            shapeFilter.ComputePerimeterOff()
+            shapeFilter.ComputeFeretDiameterOff()
+            shapeFilter.Execute(self.componentImage)
+            self._componentBoundingBoxes = dict()
+            for component in shapeFilter.GetLabels():
+                box = shapeFilter.GetBoundingBox(component)
+                dimension = len(box) // 2
+                self._componentBoundingBoxes[int(component)] = tuple(
+                    slice(start, start + size) for start, size in zip(box[:dimension][::-1], box[dimension:][::-1]))
+        return self._componentBoundingBoxes[componentId]
+
+    def GetLargestComponentMask(self, label):
+        """ UInt8 mask image of the largest component of label, filled from the component bounding box """
+        maskArray = np.zeros(self.componentArray.shape, dtype=np.uint8)
+        largestComponent = self.GetLargestComponent(label)
+        if largestComponent is not None:
+            crop = self.GetComponentBoundingBox(largestComponent)
+            maskArray[crop] = (self.componentArray[crop] == largestComponent)
+        maskImage = sitk.GetImageFromArray(maskArray)
+        maskImage.CopyInformation(self.referenceImage)
+        return maskImage
+
+    def GetNonLargestComponentsLookupTable(self, labels):
+        """ Boolean array indexed by component id, True for every component of labels but the largest one """
+        lookupTable = np.zeros(len(self.componentSizes), dtype=bool)
+        for label in labels:
+            lookupTable[self.GetComponents(label)[1:]] = True
+        return lookupTable
+
+
+def GetLargestLabel(inputMask, UseErosionCleaning=False):
+    """ Mask of the largest connected component of a binary mask, optionally cleaned by a radius 1 erosion """
+    if UseErosionCleaning:
+        erosionMask = sitk.ErodeObjectMorphology(inputMask, 1)
+    else:
+        erosionMask = inputMask
+    largestMask = LabelTopology(erosionMask > 0).GetLargestComponentMask(1)
+    if UseErosionCleaning:
+        dilateMask = sitk.DilateObjectMorphology(largestMask, 1)
+    else:
+        dilateMask = largestMask
+
+    return (largestMask * dilateMask > 0)
+
+
+def RecodeNonLargest(outlabels, keepCodes, UNKNOWN_LABEL_CODE):
+    """ Recode every component but the largest of each label in keepCodes to UNKNOWN_LABEL_CODE,
+    computing the components of all keepCodes in one pass """
+    keepCodes = list(keepCodes)
+    if UNKNOWN_LABEL_CODE in keepCodes:
+        raise ValueError("UNKNOWN_LABEL_CODE {0} can not be one of the labels to keep connected".format(
+            UNKNOWN_LABEL_CODE))
+    topology = LabelTopology(outlabels, labels=keepCodes)
+    recodeComponent = topology.GetNonLargestComponentsLookupTable(keepCodes)
+    labelArray = sitk.GetArrayFromImage(outlabels)
+    labelArray[recodeComponent[topology.componentArray]] = UNKNOWN_LABEL_CODE
+    recodedImage = sitk.GetImageFromArray(labelArray)
+    recodedImage.CopyInformation(outlabels)
+    return recodedImage
@@ -0,0 +1,185 @@
+"""
+landmarkIO.py
+=============
+
+Reading and writing of Slicer fiducial (.fcsv) landmark files, shared by the AutoWorkup nodes and by
+the landmark scripts of BRAINSConstellationDetector and BRAINSRefacer.
+
+Both file versions read by ReadSlicer3toITKLmk (BRAINSCommonLib/Slicer3LandmarkIO.cxx) are recognized
+from their header:
+
+* Slicer 3, '#Fiducial List file ...':                 label,x,y,z,sel,vis
+* Slicer 4, '# Markups fiducial file version = 4.x':   id,x,y,z,ow,ox,oy,oz,vis,sel,lock,label,desc,associatedNodeID
+
+Files without one of these headers are read as Slicer 3 files.  The columns of a Slicer 4 file are
+taken from its '# columns =' line when it has one.
+
+The points of the files are RAS, unless a Slicer 4 header says '# CoordinateSystem = 1' (or LPS),
+while ITK and SimpleITK physical points are LPS.  Every function takes the coordinate system of the
+points it returns or is given explicitly: coordinateSystem='LPS' (the default, for use with images)
+or 'RAS' (as stored by BRAINSConstellationDetector).
+
+ReadLandmarksBatch reads many files, in parallel, into one (sessions x landmarks x 3) NumPy array, on
+which LandmarkDistances computes distances between landmarks for all sessions at once.
+"""
+from __future__ import absolute_import
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+SLICER3_FCSV = 'Slicer3'
+SLICER4_FCSV = 'Slicer4'
+COORDINATE_SYSTEMS = ('LPS', 'RAS')
+
+## Converts RAS points to LPS points and back
+RAS_LPS_FLIP = np.array([-1.0, -1.0, 1.0])
+
+SLICER4_COLUMNS = ['id', 'x', 'y', 'z', 'ow', 'ox', 'oy', 'oz', 'vis', 'sel', 'lock', 'label', 'desc',
+                   'associatedNodeID']
+
+
+def _CheckCoordinateSystem(coordinateSystem):
+    if coordinateSystem not in COORDINATE_SYSTEMS:
+        raise ValueError("coordinateSystem must be one of {0}, not {1}".format(COORDINATE_SYSTEMS, coordinateSystem))
+
+
+def _ConvertPoints(points, fromCoordinateSystem, toCoordinateSystem):
+    points = np.asarray(points, dtype=np.float64)
+    if fromCoordinateSystem == toCoordinateSystem:
+        return points
+    return points * RAS_LPS_FLIP
+
+
+def ReadLandmarks(fcsvFileName, coordinateSystem='LPS'):
+    """ Landmarks of a Slicer 3 or Slicer 4 fcsv file as an OrderedDict of name: (x, y, z), in file order
+
+    >>> import os, tempfile
+    >>> with tempfile.NamedTemporaryFile('w', suffix='.fcsv', delete=False) as fcsvFile:
+    ...     _ = fcsvFile.write('# Markups fiducial file version = 4.6\\n# CoordinateSystem = 0\\n'
+    ...                        'vtkMRMLMarkupsFiducialNode_0,1.5,-2,3,0,0,0,1,1,1,0,AC,,\\n')
+    >>> dict(ReadLandmarks(fcsvFile.name))
+    {'AC': (-1.5, 2.0, 3.0)}
+    >>> dict(ReadLandmarks(fcsvFile.name, coordinateSystem='RAS'))
+    {'AC': (1.5, -2.0, 3.0)}
+    >>> os.remove(fcsvFile.name)
+    """
+    _CheckCoordinateSystem(coordinateSystem)
+    fileCoordinateSystem = 'RAS'
+    nameColumn, pointColumns = 0, [1, 2, 3]
+    landmarks = OrderedDict()
+    with open(fcsvFileName, 'r') as fcsvFile:
+        for lineNumber, line in enumerate(fcsvFile):
+            line = line.strip()
+            if line.startswith('#'):
+                header = line.lstrip('#').strip()
+                if lineNumber == 0 and header.startswith('Markups fiducial file'):
+                    nameColumn, pointColumns = SLICER4_COLUMNS.index('label'), [1, 2, 3]
+                elif header.replace(' ', '').startswith('CoordinateSystem='):
+                    fileCoordinateSystem = 'LPS' if header.split('=')[1].strip() in ('1', 'LPS') else 'RAS'
+                elif header.replace(' ', '').startswith('columns='):
+                    columns = [column.strip() for column in header.split('=')[1].split(',')]
+                    nameColumn, pointColumns = columns.index('label'), [columns.index(axis) for axis in 'xyz']
+                continue
+            if line == '':
+                continue
+            fields = line.split(',')
+            landmarks[fields[nameColumn]] = tuple(float(fields[column]) for column in pointColumns)
+    if fileCoordinateSystem != coordinateSystem:
+        for name, point in landmarks.items():
+            landmarks[name] = tuple(float(value) for value in _ConvertPoints(point, fileCoordinateSystem,
+                                                                             coordinateSystem))
+    return landmarks
+
+
+def LandmarksToArray(landmarks, names=None):
+    """ (names, N x 3 array) of a landmarks mapping; landmarks missing from the mapping are NaN
+
+    >>> LandmarksToArray(OrderedDict([('AC', (0, 0, 0)), ('PC', (0, 25, 0))]), ['PC', 'RE'])
+    (['PC', 'RE'], array([[ 0., 25.,  0.],
+           [nan, nan, nan]]))
+    """
+    if names is None:
+        names = list(landmarks.keys())
+    points = np.full((len(names), 3), np.nan)
+    for index, name in enumerate(names):
+        if name in landmarks:
+            points[index] = landmarks[name]
+    return list(names), points
+
+
+def ReadLandmarksArray(fcsvFileName, names=None, coordinateSystem='LPS'):
+    """ (names, N x 3 array) of the landmarks of a file, all of them in file order when names is None """
+    return LandmarksToArray(ReadLandmarks(fcsvFileName, coordinateSystem), names)
+
+
+def ReadLandmarksBatch(fcsvFileNames, names=None, coordinateSystem='LPS', workers=1):
+    """ Landmarks of many fcsv files as (names, sessions x len(names) x 3 array)
+
+    :param names: landmarks to read; None for all landmarks of all files, in order of first appearance
+    :param workers: number of processes reading the files
+    Landmarks missing from a file are NaN, so that they propagate to the distances computed from them.
+    """
+    _CheckCoordinateSystem(coordinateSystem)
+    fcsvFileNames = list(fcsvFileNames)
+    if workers > 1 and len(fcsvFileNames) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            allLandmarks = list(pool.map(ReadLandmarks, fcsvFileNames, [coordinateSystem] * len(fcsvFileNames),
+                                         chunksize=max(1, len(fcsvFileNames) // (4 * workers))))
+    else:
+        allLandmarks = [ReadLandmarks(fcsvFileName, coordinateSystem) for fcsvFileName in fcsvFileNames]
+    if names is None:
+        names = list(OrderedDict((name, None) for landmarks in allLandmarks for name in landmarks))
+    points = np.full((len(allLandmarks), len(names), 3), np.nan)
+    for session, landmarks in enumerate(allLandmarks):
+        points[session] = LandmarksToArray(landmarks, names)[1]
+    return list(names), points
+
+
+def LandmarkDistances(points, names, pairs):
+    """ Euclidean distances between pairs of landmarks, for all sessions at once
+
+    :param points: (..., len(names), 3) array, e.g. from ReadLandmarksBatch
+    :param pairs: (first, second) landmark names
+    :return: (..., len(pairs)) array, NaN where a landmark is missing
+
+    >>> LandmarkDistances(np.array([[[0., 0., 0.], [3., 4., 0.]]]), ['RE', 'LE'], [('RE', 'LE')])
+    array([[5.]])
+    """
+    points = np.asarray(points, dtype=np.float64)
+    first = [names.index(pair[0]) for pair in pairs]
+    second = [names.index(pair[1]) for pair in pairs]
+    return np.linalg.norm(points[..., first, :] - points[..., second, :], axis=-1)
+
+
+def WriteLandmarks(fcsvFileName, landmarks, coordinateSystem='LPS', fileVersion=SLICER4_FCSV):
+    """ Write landmarks, a mapping of name: (x, y, z) in coordinateSystem, as an RAS fcsv file
+
+    The Slicer 4 version is the file WriteITKtoSlicer3Lmk writes for BRAINSConstellationDetector.
+    """
+    _CheckCoordinateSystem(coordinateSystem)
+    names = list(landmarks.keys())
+    points = _ConvertPoints([landmarks[name] for name in names], coordinateSystem, 'RAS').reshape(-1, 3)
+    with open(fcsvFileName, 'w') as fcsvFile:
+        if fileVersion == SLICER4_FCSV:
+            fcsvFile.write('# Markups fiducial file version = 4.6\n'
+                           '# CoordinateSystem = 0\n'
+                           '# columns = {0}\n'.format(','.join(SLICER4_COLUMNS)))
+            for index, (name, point) in enumerate(zip(names, points)):
+                fcsvFile.write('vtkMRMLMarkupsFiducialNode_{0},{1!r},{2!r},{3!r},0,0,0,1,1,1,0,{4},,\n'.format(
+                    index, float(point[0]), float(point[1]), float(point[2]), name))
+        elif fileVersion == SLICER3_FCSV:
+            fcsvFile.write('#Fiducial List file {0}\n'
+                           '#numPoints = {1}\n'
+                           '#symbolScale = 5\n'
+                           '#visibility = 1\n'
+                           '#textScale = 4.5\n'
+                           '#color = 0.4,1,1\n'
+                           '#selectedColor = 1,0.5,0.5\n'
+                           '#label,x,y,z,sel,vis\n'.format(fcsvFileName, len(names)))
+            for name, point in zip(names, points):
+                fcsvFile.write('{0},{1!r},{2!r},{3!r},1,1\n'.format(name, float(point[0]), float(point[1]),
+                                                                  float(point[2])))
+        else:
+            raise ValueError("Unknown fcsv file version {0}".format(fileVersion))
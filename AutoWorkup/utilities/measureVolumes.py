@@ -41,25 +41,70 @@ print(labelDict)
 """
 
 
-def GetLabelVolumes(labelVolume, RefVolume, labelDictionary):
+def CountLabelVoxels(labelArray, chunkVoxels=2 ** 22):
     """
-    Get label volumes using
-    1. reference volume and
-    2. labeldictionary
+    Count the voxels of every label value with a single np.bincount pass.
+
+    The label buffer is processed in chunks so that the intp temporary np.bincount
+    creates stays small regardless of the image size or the label pixel type.
+    Returns a dictionary {label value: voxel count} of the labels present.
+    """
+    import numpy as np
+    flatLabels = labelArray.reshape(-1)
+    if flatLabels.size == 0:
+        return dict()
+    if flatLabels.dtype.kind == 'f':
+        # Same truncation as the previous cast to an integer label image
+        flatLabels = flatLabels.astype(np.int64)
+    minLabel = int(flatLabels.min())
+    maxLabel = int(flatLabels.max())
+    counts = np.zeros(maxLabel - minLabel + 1, dtype=np.int64)
+    for start in range(0, flatLabels.size, chunkVoxels):
+        chunk = flatLabels[start:start + chunkVoxels]
+        if minLabel != 0:
+            chunk = chunk.astype(np.int64) - minLabel
+        counts += np.bincount(chunk, minlength=counts.size)
+    presentLabels = np.flatnonzero(counts)
+    return dict([(int(index) + minLabel, int(counts[index])) for index in presentLabels])
+
+
+def LabelVoxelVolume(labelImg, RefVolume=None):
+    """
+    Volume in mm^3 of one voxel of labelImg: from the spacing of the reference image RefVolume
+    (only its header is read) when given, as in the pipeline, from labelImg otherwise.
+    Both the single session and the batch measurements use this rule.
+    """
+    import SimpleITK as sitk
+    ImageSpacing = labelImg.GetSpacing()
+    if RefVolume is not None:
+        refReader = sitk.ImageFileReader()
+        refReader.SetFileName(RefVolume)
+        refReader.ReadImageInformation()
+        ImageSpacing = refReader.GetSpacing()
+    return ImageSpacing[0] * ImageSpacing[1] * ImageSpacing[2]
+
+
+def ComputeLabelVolumes(labelVolume, labelDictionary, RefVolume=None):
+    """
+    Compute the volume of every label in labelVolume from voxel counts.
+
+    The label image is read in its native (usually uint8/uint16) pixel type and counted
+    through a NumPy view; no intensity image is needed.  If RefVolume is given only its
+    header is read, to take the voxel spacing from the reference image as before.
+    Returns a list of dictionaries sorted by label code, used for both the CSV and JSON outputs.
     """
     import SimpleITK as sitk
     import os
-    labelImg = sitk.ReadImage(labelVolume, sitk.sitkInt64)
-    RefImg = sitk.ReadImage(RefVolume, sitk.sitkFloat64)
-    labelStatFilter = sitk.LabelStatisticsImageFilter()
-    labelStatFilter.Execute(RefImg, labelImg)
-    ImageSpacing = RefImg.GetSpacing()
+    from utilities.measureVolumes import CountLabelVoxels, LabelVoxelVolume
+    labelImg = sitk.ReadImage(labelVolume)
+    voxelVolume = LabelVoxelVolume(labelImg, RefVolume)
+    labelCounts = CountLabelVoxels(sitk.GetArrayViewFromImage(labelImg))
+    del labelImg
 
     outputLabelVolumes = list()
-    for value in labelStatFilter.GetLabels():
-        structVolume = ImageSpacing[0] * ImageSpacing[1] * ImageSpacing[2] * labelStatFilter.GetCount(value)
+    for value in sorted(labelCounts.keys()):
         labelVolDict = dict()
-        labelVolDict['Volume_mm3'] = structVolume
+        labelVolDict['Volume_mm3'] = voxelVolume * labelCounts[value]
 
         if value in labelDictionary.keys():
             print("{0} --> {1}".format(value, labelDictionary[value]))
@@ -73,6 +118,16 @@ def GetLabelVolumes(labelVolume, RefVolume, labelDictionary):
     return outputLabelVolumes
 
 
+def GetLabelVolumes(labelVolume, RefVolume, labelDictionary):
+    """
+    Get label volumes using
+    1. reference volume (spacing only) and
+    2. labeldictionary
+    """
+    from utilities.measureVolumes import ComputeLabelVolumes
+    return ComputeLabelVolumes(labelVolume, labelDictionary, RefVolume)
+
+
 """
 #Unit test::
 labelName="/Shared/sinapse/CACHE/20160405_PREDICTHD_long_Results/PHD_024/0138/49757/TissueClassify/JointFusion_HDAtlas20_2015_label.nii.gz"
@@ -86,15 +141,15 @@ print(labelVolDict)
 def WriteDictionaryToCSV(inputList, outputFilename):
     import csv
     import os
-    csvFile = open(outputFilename, 'w')
-    dWriter = csv.DictWriter(csvFile,
-                             ['LabelCode', 'LabelName', 'Volume_mm3', 'FileName'],
-                             restval='',
-                             extrasaction='raise',
-                             dialect='excel')
-    dWriter.writeheader()
-    for line in inputList:
-        dWriter.writerow(line)
+    with open(outputFilename, 'w') as csvFile:
+        dWriter = csv.DictWriter(csvFile,
+                                 ['LabelCode', 'LabelName', 'Volume_mm3', 'FileName'],
+                                 restval='',
+                                 extrasaction='raise',
+                                 dialect='excel')
+        dWriter.writeheader()
+        for line in inputList:
+            dWriter.writerow(line)
     return os.path.abspath(outputFilename)
 
 
@@ -119,49 +174,251 @@ WriteDictionaryToJson(labelVolDict, "~/Desktop/test.json")
 """
 
 
+def MeasureLabelVolumes(labelVolume, labelDictionary, csvFilename, jsonFilename, RefVolume=None):
+    """
+    Compute the label volumes once and write the CSV and JSON reports from the same result.
+    """
+    from utilities.measureVolumes import ComputeLabelVolumes, WriteDictionaryToCSV, WriteDictionaryToJson
+    measurementsList = ComputeLabelVolumes(labelVolume, labelDictionary, RefVolume)
+    csvFilename = WriteDictionaryToCSV(measurementsList, csvFilename)
+    jsonFilename = WriteDictionaryToJson(measurementsList, jsonFilename)
+    return (csvFilename, jsonFilename)
+
+
 def VolumeMeasure(inputColorLookUpTableFilename,
                   labelFilename,
                   inputReferenceFilename,
                   outputFileBasename):
     labelDict = MakeLabelDictionary(inputColorLookUpTableFilename)
-    measurementsList = GetLabelVolumes(labelFilename, inputReferenceFilename, labelDict)
-    csvFilename = outputFileBasename + "CSV.csv"
-    jsonFilename = outputFileBasename + "JSON.json"
-    WriteDictionaryToCSV(measurementsList, csvFilename)
-    WriteDictionaryToJson(measurementsList, jsonFilename)
+    return MeasureLabelVolumes(labelFilename, labelDict,
+                               outputFileBasename + "CSV.csv",
+                               outputFileBasename + "JSON.json",
+                               inputReferenceFilename or None)
+
+
+BATCH_LABEL_MAP_PATTERNS = ['JointFusion/JointFusion_HDAtlas20_2015_dustCleaned_label.nii.gz',
+                            'JointFusion/JointFusion_HDAtlas20_2015_lobe_label.nii.gz',
+                            'CleanedDenoisedRFSegmentations/allLabels_seg.nii.gz']
+## The reference image of a session, whose spacing the pipeline measures the label volumes with
+## (the subj_t1_image of WorkupComputeLabelVolume, t1_average of the TissueClassify results)
+BATCH_REFERENCE_PATTERN = 'TissueClassify/t1_average_BRAINSABC.nii.gz'
+## The label maps named by the labelmap_colorlookup_table of the pipeline (see WorkupJointFusion)
+BATCH_COLOR_TABLE_PATTERNS = ['JointFusion/JointFusion_HDAtlas20_2015_dustCleaned_label.nii.gz',
+                              'JointFusion/JointFusion_HDAtlas20_2015_lobe_label.nii.gz']
+
 
+def FindResultLabelMaps(resultdir, labelMapPatterns=BATCH_LABEL_MAP_PATTERNS):
+    """
+    Find the label maps of every session in an experiment results directory laid out as
+    resultdir/project/subject/session/... (see GenerateOutputPattern).
+
+    Returns a sorted list of (project, subject, session, labelMapPattern, labelMapFilename).
+    """
+    import glob
     import os
-    csvFilename = os.path.abspath(csvFilename)
-    jsonFilename = os.path.abspath(jsonFilename)
-    return (csvFilename, jsonFilename)
+    found = list()
+    for labelMapPattern in labelMapPatterns:
+        for labelMapFilename in glob.glob(os.path.join(resultdir, '*', '*', '*', labelMapPattern)):
+            sessionDir = labelMapFilename[:-len(labelMapPattern)].rstrip(os.sep)
+            subjectDir, session = os.path.split(sessionDir)
+            projectDir, subject = os.path.split(subjectDir)
+            project = os.path.basename(projectDir)
+            found.append((project, subject, session, labelMapPattern, labelMapFilename))
+    return sorted(found)
+
+
+def _LabelMapSignature(labelMapFilename, useHash):
+    import hashlib
+    import os
+    if useHash:
+        sha1 = hashlib.sha1()
+        with open(labelMapFilename, 'rb') as fid:
+            for block in iter(lambda: fid.read(2 ** 20), b''):
+                sha1.update(block)
+        return sha1.hexdigest()
+    fileStat = os.stat(labelMapFilename)
+    return "{0}:{1}".format(fileStat.st_size, fileStat.st_mtime)
+
+
+def _SessionReferenceVolume(labelMapFilename, labelMapPattern):
+    """ The BATCH_REFERENCE_PATTERN image of the session of a label map, None if it does not exist """
+    import os
+    sessionDir = labelMapFilename[:-len(labelMapPattern)].rstrip(os.sep)
+    refVolume = os.path.join(sessionDir, BATCH_REFERENCE_PATTERN)
+    if os.path.exists(refVolume):
+        return refVolume
+    return None
+
+
+def _MeasureLabelMapVolumes(labelMapFilename, RefVolume=None):
+    """ Return {label code: volume in mm^3} for one label map """
+    import SimpleITK as sitk
+    labelImg = sitk.ReadImage(labelMapFilename)
+    voxelVolume = LabelVoxelVolume(labelImg, RefVolume)
+    labelCounts = CountLabelVoxels(sitk.GetArrayViewFromImage(labelImg))
+    return dict([(value, voxelVolume * count) for value, count in list(labelCounts.items())])
+
+
+def _MeasureLabelMapVolumesWorker(labelMapAndRefVolume):
+    """ Process pool worker of _MeasureLabelMapVolumes """
+    return _MeasureLabelMapVolumes(*labelMapAndRefVolume)
+
+
+def _WriteVolumeTable(tableBasename, labelMaps, cache, labelDictionary, outputFormats):
+    """ Write the cached volumes of labelMaps, all of one kind, as one table per output format """
+    import csv
+    import os
+    import numpy as np
+
+    labelCodes = sorted(set([int(code) for entry in labelMaps for code in cache[entry[4]]['volumes']]))
+    volumes = np.zeros((len(labelMaps), len(labelCodes)), dtype=np.float64)
+    codeIndex = dict([(code, index) for index, code in enumerate(labelCodes)])
+    for row, entry in enumerate(labelMaps):
+        for code, volume in list(cache[entry[4]]['volumes'].items()):
+            volumes[row, codeIndex[int(code)]] = volume
+    labelNames = list()
+    for code in labelCodes:
+        labelName = labelDictionary.get(code, 'NA')
+        labelNames.append("{0}_{1}".format(code, labelName))
+    keyColumns = ['project', 'subject', 'session', 'labelmap', 'FileName']
+
+    outputFilenames = list()
+    if 'csv' in outputFormats:
+        csvFilename = os.path.abspath(tableBasename + "CSV.csv")
+        with open(csvFilename, 'w') as csvFile:
+            writer = csv.writer(csvFile, dialect='excel')
+            writer.writerow(keyColumns + labelNames)
+            for row, entry in enumerate(labelMaps):
+                writer.writerow(list(entry) + volumes[row].tolist())
+        outputFilenames.append(csvFilename)
+    if 'npz' in outputFormats:
+        npzFilename = os.path.abspath(tableBasename + "NPZ.npz")
+        keys = np.array(labelMaps, dtype=str).reshape(len(labelMaps), len(keyColumns))
+        np.savez_compressed(npzFilename, volumes=volumes, label_codes=np.array(labelCodes, dtype=np.int64),
+                            label_names=np.array(labelNames, dtype=str),
+                            **dict([(column, keys[:, index]) for index, column in enumerate(keyColumns)]))
+        outputFilenames.append(npzFilename)
+    if 'parquet' in outputFormats:
+        import pandas as pd
+        parquetFilename = os.path.abspath(tableBasename + "PARQUET.parquet")
+        table = pd.DataFrame(volumes, columns=labelNames)
+        for index, column in reversed(list(enumerate(keyColumns))):
+            table.insert(0, column, [entry[index] for entry in labelMaps])
+        table.to_parquet(parquetFilename, index=False)
+        outputFilenames.append(parquetFilename)
+    return outputFilenames
+
+
+def BatchVolumeMeasure(resultdir, labelDictionaries, outputFileBasename, workers=1, outputFormats=('csv',),
+                       useHash=False, labelMapPatterns=BATCH_LABEL_MAP_PATTERNS):
+    """
+    Measure every label map found under resultdir on a process pool and write one table per
+    label map pattern, with a row per (project, subject, session) label map and a column per
+    label code found in the label maps of that pattern.
+
+    The voxel volume follows the rule of the pipeline (LabelVoxelVolume): it is taken from the
+    spacing of the session T1 image (BATCH_REFERENCE_PATTERN), the subj_t1_image that the
+    WorkupComputeLabelVolume node measures with, and from the label map only for sessions
+    without it.  The batch and per-session tables therefore agree.
+
+    Measurements are cached in outputFileBasename + "cache.json" keyed by the label map
+    path and its size/mtime (or content sha1 with useHash) and by the reference image used;
+    label maps that are unchanged since the last run are not read again.
+
+    :param labelDictionaries: {label map pattern: {label code: label name}}; the labels of
+                              patterns without a dictionary are named 'NA'
+    :param outputFormats: any of 'csv', 'npz', 'parquet' (parquet requires pandas with pyarrow)
+    :return: list of written filenames
+    """
+    import json
+    import multiprocessing
+    import os
+
+    cacheFilename = outputFileBasename + "cache.json"
+    cache = dict()
+    if os.path.exists(cacheFilename):
+        with open(cacheFilename, 'r') as fid:
+            cache = json.load(fid)
+
+    labelMaps = FindResultLabelMaps(resultdir, labelMapPatterns)
+    refVolumes = dict([(entry[4], _SessionReferenceVolume(entry[4], entry[3])) for entry in labelMaps])
+    signatures = dict()
+    for labelMapFilename, refVolume in list(refVolumes.items()):
+        signatures[labelMapFilename] = _LabelMapSignature(labelMapFilename, useHash)
+        if refVolume is not None:
+            signatures[labelMapFilename] += ";" + _LabelMapSignature(refVolume, False)
+    toMeasure = [labelMapFilename for labelMapFilename, signature in sorted(signatures.items())
+                 if cache.get(labelMapFilename, {}).get('signature') != signature]
+    print("Measuring {0} of {1} label maps ({2} unchanged)".format(len(toMeasure), len(labelMaps),
+                                                                    len(labelMaps) - len(toMeasure)))
+    if len(toMeasure) > 0:
+        if workers > 1:
+            pool = multiprocessing.Pool(processes=workers)
+            try:
+                measured = pool.map(_MeasureLabelMapVolumesWorker,
+                                    [(labelMapFilename, refVolumes[labelMapFilename]) for labelMapFilename in toMeasure],
+                                    chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            measured = [_MeasureLabelMapVolumes(labelMapFilename, refVolumes[labelMapFilename])
+                        for labelMapFilename in toMeasure]
+        for labelMapFilename, volumes in zip(toMeasure, measured):
+            cache[labelMapFilename] = {'signature': signatures[labelMapFilename],
+                                       'volumes': dict([(str(k), v) for k, v in list(volumes.items())])}
+    cache = dict([(labelMapFilename, cache[labelMapFilename]) for labelMapFilename in signatures])
+    with open(cacheFilename, 'w') as fid:
+        json.dump(cache, fid)
+
+    outputFilenames = list()
+    for labelMapPattern in labelMapPatterns:
+        patternLabelMaps = [entry for entry in labelMaps if entry[3] == labelMapPattern]
+        if len(patternLabelMaps) == 0:
+            continue
+        tableBasename = "{0}{1}_".format(outputFileBasename, os.path.basename(labelMapPattern).split('.')[0])
+        outputFilenames.extend(_WriteVolumeTable(tableBasename, patternLabelMaps, cache,
+                                                 labelDictionaries.get(labelMapPattern, dict()), outputFormats))
+    return outputFilenames
 
 
 import sys
 import getopt
 
 
+USAGE = ("measureVolumes.py -c <colorTable> -l <labelFilename> [-r <referenceFilename>] -o <outputFileBasename>\n"
+         "measureVolumes.py -c <colorTable> -d <resultDir> [-w <workers>] [-f csv,npz,parquet] [--hash] "
+         "-o <outputFileBasename>")
+
+
 def main():
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hc:l:r:o:",
+        opts, args = getopt.getopt(sys.argv[1:], "hc:l:r:o:d:w:f:",
                                    ["help",
                                     "colorTable=",
                                     "labelFilename=",
                                     "referenceFilename=",
-                                    "outputFileBasename="])
+                                    "outputFileBasename=",
+                                    "resultDir=",
+                                    "workers=",
+                                    "formats=",
+                                    "hash"])
     except getopt.GetoptError as err:
         print(str(err))
-        print(
-            "WorkupComputeLabelVolume.py -c <colorTable> -l <labelFilename>  -r <referenceFilename> -o <outputFileBasename>")
+        print(USAGE)
         sys.exit(2)
     colorTable = ""
     labelFilename = ""
     outputFileBasename = ""
     referenceFilename = ""
+    resultDir = ""
+    workers = 1
+    outputFormats = ['csv']
+    useHash = False
     for opt, arg in opts:
-        if opt == '-h':
-            print(
-                "WorkupComputeLabelVolume.py -c <colorTable> -l <labelFilename>  -r <referenceFilename> -o <outputFileBasename>")
-            sys.ext()
+        if opt in ("-h", "--help"):
+            print(USAGE)
+            sys.exit()
         elif opt in ("-c", "--colorTable"):
             colorTable = arg
         elif opt in ("-l", "--labelFilename"):
@@ -170,8 +427,29 @@ def main():
             referenceFilename = arg
         elif opt in ("-o", "--outputFileBasename"):
             outputFileBasename = arg
-
-    if (colorTable and labelFilename and outputFileBasename):
+        elif opt in ("-d", "--resultDir"):
+            resultDir = arg
+        elif opt in ("-w", "--workers"):
+            workers = int(arg)
+        elif opt in ("-f", "--formats"):
+            outputFormats = arg.split(',')
+        elif opt == "--hash":
+            useHash = True
+
+    if (colorTable and resultDir and outputFileBasename):
+        print(""" Arguments:
+        color table: {0}
+        resultDir: {1}
+        workers: {2}
+        outputFileBasename: {3}""".format(colorTable, resultDir, workers, outputFileBasename))
+
+        labelDictionary = MakeLabelDictionary(colorTable)
+        labelDictionaries = dict([(labelMapPattern, labelDictionary) for labelMapPattern in BATCH_COLOR_TABLE_PATTERNS])
+        outputFiles = BatchVolumeMeasure(resultDir, labelDictionaries, outputFileBasename,
+                                         workers=workers, outputFormats=outputFormats, useHash=useHash)
+        print(outputFiles)
+    elif (colorTable and labelFilename and outputFileBasename):
+        # The reference image is optional; it only supplies the voxel spacing.
         print(""" Arguments:
         color table: {0}
         labelFile: {1}
@@ -181,7 +459,7 @@ def main():
         outputFiles = VolumeMeasure(colorTable, labelFilename, referenceFilename, outputFileBasename)
         print(outputFiles)
     else:
-        print("WorkupComputeLabelVolume.py -c <colorTable> -l <labelFilename> -o <outputFileBasename>")
+        print(USAGE)
 
 
 if __name__ == "__main__":
@@ -317,3 +317,27 @@ def GenerateOutputPattern(projectid, subjectid, sessionid, DefaultNodeName):
     patternList.append((find_pat, replace_pat))
     # print "HACK: ", patternList
     return patternList
+
+
+def IntermediateImageName(fileName, master_config):
+    """ fileName ('*.nii.gz') of an image that stays in the cache directory (i.e. is not DataSink'd), with the
+    extension chosen by UNCOMPRESSED_INTERMEDIATE_IMAGES in the experiment configuration
+
+    >>> IntermediateImageName('atlas_2_subj_lbl.nii.gz', {'intermediate_image_extension': '.nii'})
+    'atlas_2_subj_lbl.nii'
+    >>> IntermediateImageName('atlas_2_subj_lbl.nii.gz', {})
+    'atlas_2_subj_lbl.nii.gz'
+    """
+    assert fileName.endswith('.nii.gz'), "Intermediate image names must end with .nii.gz: {0}".format(fileName)
+    return fileName[:-len('.nii.gz')] + master_config.get('intermediate_image_extension', '.nii.gz')
+
+
+def getPeakMemoryMB():
+    """ Peak resident memory, in MB, of this process and of its finished child processes """
+    import resource
+    import sys
+    peakMemory = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                     resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    if sys.platform == 'darwin':  # bytes on OS X, kilobytes on Linux
+        return peakMemory / (1024.0 * 1024.0)
+    return peakMemory / 1024.0
@@ -21,6 +21,8 @@ import glob
 import os.path
 import shutil
 
+from utilities.subjectListReader import parseImageFiles
+
 
 def onlyT1T2(src, names):
     if src.endswith('TissueClassify'):
@@ -77,7 +79,7 @@ def main(REPORT, EXPERIMENT, outdir=None, OUTFILE='/tmp/autoworkup_report.csv',
                 # END HACK
                 print(outpath)
             outdict = {}
-            olddict = eval(row['imagefiles'])
+            olddict = parseImageFiles(row['imagefiles'])
             for key in list(olddict.keys()):
                 if key.startswith('T1'):
                     fname = os.path.join(path, 't1_average_BRAINSABC.nii.gz')
@@ -0,0 +1,194 @@
+"""
+subjectListReader.py
+====================
+
+Streaming reader for the AutoWorkup subject list csv format::
+
+    project,subject,session,"{'T1-30': ['/path/T1_1.nii.gz', '/path/T1_2.nii.gz'], 'T2-30': ['/path/T2.nii.gz']}"
+
+Rows starting with '#', empty rows and the 'project' header row are skipped.  The image
+dictionary column is parsed with a restricted parser that only accepts a dictionary of
+quoted strings mapping to lists (or tuples) of quoted strings, so no Python code from the
+csv is ever evaluated.
+
+The older BAWScreenShots input format, one Python tuple literal per line::
+
+    ('project', 'subject', 'session', "{'T1-30': ['/path/T1_1.nii.gz']}")
+
+is read by readSessionLiteralList with the same restricted parser.
+"""
+from __future__ import print_function
+
+import csv
+import re
+from collections import OrderedDict
+from collections import namedtuple
+
+SessionRecord = namedtuple('SessionRecord', ['project', 'subject', 'session', 'imagefiles', 'line', 'row'])
+
+_TOKEN = re.compile(r"""\s*(?:'((?:[^'\\]|\\.)*)'|"((?:[^"\\]|\\.)*)"|([{}\[\](),:]))""")
+_ESCAPE = re.compile(r"\\(.)")
+_CLOSING = {'[': ']', '(': ')'}
+
+
+def _unescape(text):
+    if '\\' not in text:
+        return text
+    return _ESCAPE.sub(r"\1", text)
+
+
+def _tokenize(text):
+    """ Split text into (kind, value, start) string and punctuation tokens, ending with an 'end' token """
+    tokens = list()
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None or match.end() == position:
+            while text[position].isspace():
+                position += 1
+            raise ValueError("unexpected {0!r} at character {1}".format(text[position:position + 10], position))
+        single, double, punct = match.groups()
+        if punct is None:
+            tokens.append(('str', _unescape(single if single is not None else double), match.start()))
+        else:
+            tokens.append((punct, punct, match.start()))
+        position = match.end()
+    tokens.append(('end', None, len(text)))
+    return tokens
+
+
+def _parser(tokens):
+    """ (peek, expect) functions walking through tokens """
+    index = [0]
+
+    def peek():
+        return tokens[index[0]][0]
+
+    def expect(*kinds):
+        kind, value, start = tokens[index[0]]
+        if kind not in kinds:
+            raise ValueError("expected {0} at character {1}".format(" or ".join(["'{0}'".format(k) for k in kinds]),
+                                                                    start))
+        index[0] += 1
+        return kind, value
+
+    return peek, expect
+
+
+def _parseStrings(peek, expect):
+    """ Quoted strings of a list or tuple, whose opening bracket is the next token """
+    opening, _ = expect('[', '(')
+    values = list()
+    while peek() != _CLOSING[opening]:
+        values.append(expect('str')[1])
+        if peek() != _CLOSING[opening]:
+            expect(',')
+    expect(_CLOSING[opening])
+    return opening, values
+
+
+def parseImageFiles(text):
+    """ Parse the image dictionary column of a subject list row
+
+    >>> parseImageFiles("{'T1-30': ['/a.nii.gz', '/b.nii.gz'], 'T2-30': ('/c.nii.gz',)}")
+    OrderedDict([('T1-30', ['/a.nii.gz', '/b.nii.gz']), ('T2-30', ['/c.nii.gz'])])
+    >>> parseImageFiles("{'T1-30': __import__('os').getcwd()}")
+    Traceback (most recent call last):
+        ...
+    ValueError: unexpected '__import__' at character 10
+    """
+    peek, expect = _parser(_tokenize(text))
+    expect('{')
+    imagefiles = OrderedDict()
+    while peek() != '}':
+        _, scantype = expect('str')
+        expect(':')
+        imagefiles[scantype] = _parseStrings(peek, expect)[1]
+        if peek() != '}':
+            expect(',')
+    expect('}')
+    expect('end')
+    return imagefiles
+
+
+def parseSessionLiteral(text):
+    """ Parse a line of the older literal format, a tuple or list of quoted strings
+
+    :return: ('(' or '[', [strings])
+
+    >>> parseSessionLiteral("('P1', 'S1', 'ses1', '{}')")
+    ('(', ['P1', 'S1', 'ses1', '{}'])
+    """
+    peek, expect = _parser(_tokenize(text))
+    opening, values = _parseStrings(peek, expect)
+    expect('end')
+    return opening, values
+
+
+def readSubjectList(subject_data_file, errors=None):
+    """ Lazily yield a SessionRecord for every session row of a subject list csv file
+
+    :param subject_data_file: path to the csv file
+    :param errors: if None a ValueError naming the line is raised for the first malformed row,
+                   otherwise each malformed row is appended to this list as a ValueError and skipped
+    """
+    with open(subject_data_file, 'rt') as subjectFile:
+        subjData = csv.reader(subjectFile, delimiter=',', quotechar='"')
+        for row in subjData:
+            if len(row) < 1 or not any(row):
+                # continue if it is an empty row
+                continue
+            if row[0].startswith('#'):
+                # if the first character is a #, then it is commented out
+                continue
+            if row[0] == 'project':
+                # continue if header line
+                continue
+            try:
+                if len(row) != 4:
+                    raise ValueError("invalid number of elements in row ({0} instead of 4)".format(len(row)))
+                imagefiles = parseImageFiles(row[3])
+            except ValueError as err:
+                err = ValueError("{0}:{1}: {2}: {3}".format(subject_data_file, subjData.line_num, err, row))
+                if errors is None:
+                    raise err
+                errors.append(err)
+                continue
+            yield SessionRecord(row[0], row[1], row[2], imagefiles, subjData.line_num, tuple(row))
+
+
+def readSessionLiteralList(subject_data_file, errors=None):
+    """ Lazily yield a SessionRecord for every tuple line of a file in the older literal format
+
+    Lines holding a list, e.g. a header, are skipped, as are empty and '#' lines.
+    :param errors: as for readSubjectList
+    """
+    with open(subject_data_file, 'rt') as subjectFile:
+        for line_num, line in enumerate(subjectFile, 1):
+            if line.strip() == '' or line.lstrip().startswith('#'):
+                continue
+            try:
+                opening, row = parseSessionLiteral(line)
+                if opening == '[':
+                    continue
+                if len(row) != 4:
+                    raise ValueError("invalid number of elements in row ({0} instead of 4)".format(len(row)))
+                imagefiles = parseImageFiles(row[3])
+            except ValueError as err:
+                err = ValueError("{0}:{1}: {2}: {3}".format(subject_data_file, line_num, err, line.strip()))
+                if errors is None:
+                    raise err
+                errors.append(err)
+                continue
+            yield SessionRecord(row[0], row[1], row[2], imagefiles, line_num, tuple(row))
+
+
+def isSessionLiteralList(subject_data_file):
+    """ True if the first session line of the file is a Python tuple or list literal, not a csv row """
+    with open(subject_data_file, 'rt') as subjectFile:
+        for line in subjectFile:
+            line = line.strip()
+            if line != '' and not line.startswith('#'):
+                return line[0] in _CLOSING
+    return False
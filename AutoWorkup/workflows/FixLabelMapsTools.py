@@ -4,112 +4,76 @@
 ##
 
 def FixLabelMapFromNeuromorphemetrics2012(fusionFN, FixedHeadFN, posterior_dict, LeftHemisphereFN, outFN, OUT_DICT):
+    """Insert blood, CSF and brainstem from the BRAINSABC labels and posteriors into the fused label map.
+
+    All masks are NumPy boolean arrays computed once, and the insertions are ordered boolean
+    writes into a single uint16 (uint32 if the labels need it) output buffer."""
     import SimpleITK as sitk
+    import numpy as np
     import os
-
-    def ForceMaskInsert(inlabels, newmask, newmaskvalue):
-        inlabels = sitk.Cast(inlabels, sitk.sitkUInt32)
-        newmask = sitk.Cast((newmask > 0), sitk.sitkUInt32)
-        outlabels = inlabels * sitk.Cast((1 - newmask), sitk.sitkUInt32)
-        outlabels = outlabels + newmask * newmaskvalue
-        return sitk.Cast(outlabels, sitk.sitkUInt32)
-
-    ## TODO: GetLargestLabel is copied from elsewhere
-    def GetLargestLabel(inputMask, UseErosionCleaning):
-        LargestComponentCode = 1
-        if UseErosionCleaning:
-            erosionMask = sitk.ErodeObjectMorphology(inputMask, 1)
-        else:
-            erosionMask = inputMask
-        CC = sitk.ConnectedComponent(erosionMask)
-        Rlabel = sitk.RelabelComponent(CC)
-        largestMask = (Rlabel == LargestComponentCode)
-        if UseErosionCleaning:
-            dilateMask = sitk.DilateObjectMorphology(largestMask, 1)
-        else:
-            dilateMask = largestMask
-
-        return (largestMask * dilateMask > 0)
-
-    def RecodeNonLargest(outlabels, keepCode, UNKNOWN_LABEL_CODE):
-        orig_mask = (outlabels == keepCode)
-        connected_mask = GetLargestLabel(orig_mask, False)
-        small_regions = (orig_mask - connected_mask)
-        outlabels = ForceMaskInsert(outlabels, connected_mask, keepCode)
-        outlabels = ForceMaskInsert(outlabels, small_regions, UNKNOWN_LABEL_CODE)
-        return outlabels
-
-    def MinimizeSizeOfImage(outlabels):
-        """This function will find the largest integer value in the labelmap, and
-        cast the image to the smallest possible integer size so that no loss of data
-        results."""
-        measureFilt = sitk.StatisticsImageFilter()
-        measureFilt.Execute(outlabels)
-        imgMin = measureFilt.GetMinimum()
-        imgMax = measureFilt.GetMaximum()
-        if imgMax < (2 ** 8) - 1:
-            outlabels = sitk.Cast(outlabels, sitk.sitkUInt8)
-        elif imgMax < (2 ** 16) - 1:
-            outlabels = sitk.Cast(outlabels, sitk.sitkUInt16)
-        elif imgMax < (2 ** 32) - 1:
-            outlabels = sitk.Cast(outlabels, sitk.sitkUInt32)
-        elif imgMax < (2 ** 64) - 1:
-            outlabels = sitk.Cast(outlabels, sitk.sitkUInt64)
-        return outlabels
-
-    fusionIm = sitk.Cast(sitk.ReadImage(fusionFN), sitk.sitkUInt32)
-    FixedHead = sitk.Cast(sitk.ReadImage(FixedHeadFN), sitk.sitkUInt32)
+    from utilities.labelMaps import MinimizeSizeOfImage
+    from utilities.labelTopology import RecodeNonLargest
+    from utilities.misc import getPeakMemoryMB
 
     BRAINSABC_DICT = {'BRAINSTEM': 30, 'CSF': 4, 'BLOOD': 5}
 
-    ## Intialize by cloning
-    outlabels = sitk.Image(fusionIm)
-    lbl_orig_mask = (outlabels > 0)
-    lbl_outter_ring = sitk.BinaryDilate(lbl_orig_mask, 2) - lbl_orig_mask
-    # DEBUG sitk.WriteImage(lbl_outter_ring,"/tmp/lbl_outter_ring.nii.gz")
+    fusionIm = sitk.ReadImage(fusionFN)
+    outlabels = sitk.GetArrayFromImage(fusionIm)
+    maxLabel = max([int(outlabels.max())] + [value for key, value in OUT_DICT.items() if key != 'CONNECTED'])
+    if maxLabel < 2 ** 16:
+        labelType = np.uint16
+    else:
+        labelType = np.uint32
+    outlabels = outlabels.astype(labelType, copy=False)
+    FixedHead = sitk.GetArrayFromImage(sitk.ReadImage(FixedHeadFN))
 
+    lbl_orig_mask = (outlabels > 0)
+    lbl_orig_maskImage = sitk.GetImageFromArray(lbl_orig_mask.astype(np.uint8))
+    lbl_orig_maskImage.CopyInformation(fusionIm)
+    lbl_outter_ring = sitk.GetArrayFromImage(sitk.BinaryDilate(lbl_orig_maskImage, [2, 2, 2])).astype(bool)
+    lbl_outter_ring &= ~lbl_orig_mask
+    del lbl_orig_maskImage
+
+    def PosteriorMasks(posteriorFN):
+        posterior = sitk.GetArrayViewFromImage(sitk.ReadImage(posteriorFN))
+        ring = lbl_outter_ring & (posterior >= 0.5) & (posterior <= 1.01)  # just outside mask
+        inner = lbl_orig_mask & (posterior >= 0.85) & (posterior <= 1.01)  # inside mask, but very high probability
+        return ring | inner
 
-    vb_post = sitk.ReadImage(posterior_dict["VB"])
-    ring_vb = lbl_outter_ring * sitk.BinaryThreshold(vb_post, 0.5, 1.01, 1, 0)  # just outside mask
-    # DEBUG sitk.WriteImage(ring_vb,"/tmp/ring_vb.nii.gz")
-    inner_vb = lbl_orig_mask * sitk.BinaryThreshold(vb_post, 0.85, 1.01, 1, 0)  # inside mask, but very high probability
-    # DEBUG sitk.WriteImage(inner_vb,"/tmp/inner_vb.nii.gz")
     # background = 0 , suspicous = 999
+    # NOTE: the original "(outlabels == 0 | outlabels == 999)" image expression evaluated to
+    #       (outlabels == 999) because of operator precedence; that behavior is kept.
     ## Add blood from BRAINSABC to mask as as value OUT_DICT['BLOOD']
-    blood_labels = (FixedHead == BRAINSABC_DICT['BLOOD']) * (outlabels == 0 | outlabels == 999) | ring_vb | inner_vb
-    # DEBUG sitk.WriteImage(blood_labels,"/tmp/blood_labels.nii.gz")
-    outlabels = ForceMaskInsert(outlabels, blood_labels, OUT_DICT['BLOOD'])
+    vb_labels = PosteriorMasks(posterior_dict["VB"])
+    blood_labels = ((FixedHead == BRAINSABC_DICT['BLOOD']) & (outlabels == 999)) | vb_labels
+    outlabels[blood_labels] = OUT_DICT['BLOOD']
+    del blood_labels
 
-    csf_post = sitk.ReadImage(posterior_dict["CSF"])
-    ring_csf = lbl_outter_ring * sitk.BinaryThreshold(csf_post, 0.5, 1.01, 1, 0)  # just outside mask
-    # DEBUG sitk.WriteImage(ring_csf,"/tmp/ring_csf.nii.gz")
-    inner_csf = lbl_orig_mask * sitk.BinaryThreshold(csf_post, 0.85, 1.01, 1,
-                                                     0)  # inside mask, but very high probability
-    # DEBUG sitk.WriteImage(inner_csf,"/tmp/inner_csf.nii.gz")
     ## Add CSF from BRAINSABC to mask as as value OUT_DICT['RH_CSF']
-    csf_labels = (FixedHead == BRAINSABC_DICT['CSF']) * (outlabels == 0 | outlabels == 999) | ring_csf | inner_csf
-    # DEBUG sitk.WriteImage(csf_labels,"/tmp/csf_labels.nii.gz")
-    outlabels = ForceMaskInsert(outlabels, csf_labels, OUT_DICT['RH_CSF'])
-    # DEBUG sitk.WriteImage(outlabels,"/tmp/outlabels.nii.gz")
+    csf_labels = PosteriorMasks(posterior_dict["CSF"])
+    VALID_REGION = (FixedHead > 0) | vb_labels | csf_labels
+    del vb_labels
+    csf_labels |= (FixedHead == BRAINSABC_DICT['CSF']) & (outlabels == 999)
+    outlabels[csf_labels] = OUT_DICT['RH_CSF']
+    del csf_labels, lbl_orig_mask, lbl_outter_ring
 
     ## Now split CSF based on LeftHemisphereMask
     if LeftHemisphereFN != None:
-        LeftHemisphereIm = sitk.Cast(sitk.ReadImage(LeftHemisphereFN), sitk.sitkUInt32)
-        left_hemi_pre = (outlabels == OUT_DICT['LH_CSF'])
-        outlabels = ForceMaskInsert(outlabels, left_hemi_pre, OUT_DICT['RH_CSF'])  ## Make all CSF Right hemisphere
-        left_hemi_post = (LeftHemisphereIm * sitk.Cast((outlabels == OUT_DICT['RH_CSF']),
-                                                       sitk.sitkUInt32) > 0)  # SplitCSF with LeftHemisphereMask
-        outlabels = ForceMaskInsert(outlabels, left_hemi_post, OUT_DICT['LH_CSF'])  ## Make all CSF Right hemisphere
+        LeftHemisphereIm = sitk.GetArrayViewFromImage(sitk.ReadImage(LeftHemisphereFN))
+        outlabels[outlabels == OUT_DICT['LH_CSF']] = OUT_DICT['RH_CSF']  ## Make all CSF Right hemisphere
+        left_hemi_post = (LeftHemisphereIm > 0) & (outlabels == OUT_DICT['RH_CSF'])  # SplitCSF with LeftHemisphereMask
+        outlabels[left_hemi_post] = OUT_DICT['LH_CSF']
+        del left_hemi_post
     ## Now extend brainstem lower
     ## BrainStem often mislabled to Cerebellum WM (label 7 and 46)
     ## Fix for brainstem for the mislabeld Cerebellum as well.
     misLabelDict = {"none": 0, "leftCrblWM": 7, "rightCrblWM": 46}
+    brain_stem_region = (FixedHead == BRAINSABC_DICT['BRAINSTEM'])
     for misLabel in misLabelDict:
-        brain_stem = (FixedHead == BRAINSABC_DICT['BRAINSTEM']) * (outlabels == misLabelDict[misLabel])
-        outlabels = ForceMaskInsert(outlabels, brain_stem, OUT_DICT['BRAINSTEM'])  ## Make all CSF Right hemisphere
+        outlabels[brain_stem_region & (outlabels == misLabelDict[misLabel])] = OUT_DICT['BRAINSTEM']
+    del brain_stem_region, FixedHead
 
-    VALID_REGION = sitk.Cast((FixedHead > 0) | ring_csf | inner_csf | ring_vb | inner_vb, sitk.sitkUInt32)
-    outlabels = outlabels * VALID_REGION
+    outlabels[~VALID_REGION] = 0
     ## Caudate = 36 37
     ## Putamen = 57 58
     ## Pallidus = 55,56
@@ -118,46 +82,35 @@ def FixLabelMapFromNeuromorphemetrics2012(fusionFN, FixedHeadFN, posterior_dict,
     ## Accumbens  = 23,30
     UNKNOWN_LABEL_CODE = OUT_DICT['UNKNOWN']
     labels_to_ensure_connected = OUT_DICT['CONNECTED']
-    for keepCode in labels_to_ensure_connected:
-        outlabels = RecodeNonLargest(outlabels, keepCode, UNKNOWN_LABEL_CODE)
+    outlabelsImage = sitk.GetImageFromArray(outlabels)
+    outlabelsImage.CopyInformation(fusionIm)
+    del outlabels
+    ## Components of all labels_to_ensure_connected are computed in one pass
+    outlabelsImage = RecodeNonLargest(outlabelsImage, labels_to_ensure_connected, UNKNOWN_LABEL_CODE)
 
     ## FILL IN HOLES
-    unkown_holes = (VALID_REGION > 0) * (outlabels == 0)
-    outlabels = ForceMaskInsert(outlabels, unkown_holes, UNKNOWN_LABEL_CODE)  ## Fill unkown regions with unkown code
-    outlabels = MinimizeSizeOfImage(outlabels)
+    outlabels = sitk.GetArrayFromImage(outlabelsImage)
+    outlabels[VALID_REGION & (outlabels == 0)] = UNKNOWN_LABEL_CODE  ## Fill unkown regions with unkown code
+    del VALID_REGION
+    filledImage = sitk.GetImageFromArray(outlabels)
+    filledImage.CopyInformation(outlabelsImage)
+    del outlabels, outlabelsImage
+    outlabelsImage = MinimizeSizeOfImage(filledImage)
 
     fixedFusionLabelFN = os.path.realpath(outFN)
-    sitk.WriteImage(outlabels, fixedFusionLabelFN)
-    # print("\n\n\n\n\n\n{0}\n\n\n\nXXXXXXXX".format(fixedFusionLabelFN))
+    sitk.WriteImage(outlabelsImage, fixedFusionLabelFN)
+    print("FixLabelMapFromNeuromorphemetrics2012 peak RSS: {0:.1f} MB".format(getPeakMemoryMB()))
     return fixedFusionLabelFN
 
 
 def RecodeLabelMap(InputFileName, OutputFileName, RECODE_TABLE):
+    """Recode the labels with the (old, new) pairs of RECODE_TABLE, applied in order, in a single
+    lookup table pass, and write the result with the smallest unsigned pixel type."""
     import SimpleITK as sitk
     import os
+    from utilities.labelMaps import RecodeLabelImage
 
-    def MinimizeSizeOfImage(outlabels):
-        """This function will find the largest integer value in the labelmap, and
-        cast the image to the smallest possible integer size so that no loss of data
-        results."""
-        measureFilt = sitk.StatisticsImageFilter()
-        measureFilt.Execute(outlabels)
-        imgMin = measureFilt.GetMinimum()
-        imgMax = measureFilt.GetMaximum()
-        if imgMax < (2 ** 8) - 1:
-            outlabels = sitk.Cast(outlabels, sitk.sitkUInt8)
-        elif imgMax < (2 ** 16) - 1:
-            outlabels = sitk.Cast(outlabels, sitk.sitkUInt16)
-        elif imgMax < (2 ** 32) - 1:
-            outlabels = sitk.Cast(outlabels, sitk.sitkUInt32)
-        elif imgMax < (2 ** 64) - 1:
-            outlabels = sitk.Cast(outlabels, sitk.sitkUInt64)
-        return outlabels
-
-    LabelImage = sitk.Cast(sitk.ReadImage(InputFileName), sitk.sitkUInt32)
-    for (old, new) in RECODE_TABLE:
-        LabelImage = sitk.Cast((LabelImage == old), sitk.sitkUInt32) * (new - old) + LabelImage
-    LabelImage = MinimizeSizeOfImage(LabelImage)
+    LabelImage = RecodeLabelImage(sitk.ReadImage(InputFileName), RECODE_TABLE)
     recodedFN = os.path.realpath(OutputFileName)
     sitk.WriteImage(LabelImage, recodedFN)
     return recodedFN
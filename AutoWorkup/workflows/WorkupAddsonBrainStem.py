@@ -19,6 +19,7 @@ def brainStem(tissueLabelFilename,
               ouputTissuelLabelFilename):
     import os
     import SimpleITK as sitk
+    from utilities.landmarkIO import ReadLandmarks
 
     def cropAndResampleInPlace(inputBrainLabelFilename,
                                physBB1, physBB2, thresholdUpper, thresholdLower,
@@ -69,32 +70,7 @@ def brainStem(tissueLabelFilename,
         import os
         return os.path.abspath(outputImageFilename)
 
-    myLandmark = dict()
-    with open(landmarkFilename, 'r') as myLandmarkFile:
-        all_lines = myLandmarkFile.readlines()
-
-    if "Markups fiducial file version " in all_lines[0]:
-        ## New slicer format
-        landmark = all_lines[3:]
-        for row in landmark:
-            lmk = row.split(',')
-            lmkID = lmk[11]
-            lmkX = float(lmk[1])
-            lmkY = float(lmk[2])
-            lmkZ = float(lmk[3])
-            # RAS to LPS
-            myLandmark[lmkID] = (-lmkX, -lmkY, lmkZ)
-    else:
-        ## Old slicer format
-        landmark = all_lines[8:]
-        for row in landmark:
-            lmk = row.split(',')
-            lmkID = lmk[0]
-            lmkX = float(lmk[1])
-            lmkY = float(lmk[2])
-            lmkZ = float(lmk[3])
-            # RAS to LPS
-            myLandmark[lmkID] = (-lmkX, -lmkY, lmkZ)
+    myLandmark = ReadLandmarks(landmarkFilename, coordinateSystem='LPS')
 
     """
     brain stem
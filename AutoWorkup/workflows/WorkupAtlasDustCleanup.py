@@ -6,7 +6,7 @@ from nipype.interfaces.utility import Function, IdentityInterface
 
 def runAutomaticCleanupScript(inFN1, inAtlas, outAtlas, maxIslandCount,
                               useFullyConnected, forceLabelChange, noDilation,
-                              inFN2=None, includeList=None, excludeList=None):
+                              inFN2=None, includeList=None, excludeList=None, workers=None):
     arguments = {'--inputT1Path': inFN1,
                  '--inputT2Path': inFN2,
                  '--inputAtlasPath': inAtlas,
@@ -16,17 +16,37 @@ def runAutomaticCleanupScript(inFN1, inAtlas, outAtlas, maxIslandCount,
                  '--forceSuspiciousLabelChange': forceLabelChange,
                  '--noDilation': noDilation,
                  '--includeLabelsList': includeList,
-                 '--excludeLabelsList': excludeList
+                 '--excludeLabelsList': excludeList,
+                 '--workers': workers
                  }
 
-    from atlasSmallIslandCleanup import DustCleanup
-    localDustCleanupObject = DustCleanup(arguments=arguments)
+    from atlasSmallIslandCleanup import VectorizedDustCleanup
+    localDustCleanupObject = VectorizedDustCleanup(arguments=arguments)
     localDustCleanupObject.main()
 
     import os
     return os.path.abspath(outAtlas)
 
 
+def runAutomaticCleanupStages(inFN1, inAtlas, outAtlas, stages, inFN2=None, writeStageStatistics=False):
+    """
+    Runs the cleanup stages (dictionaries of runAutomaticCleanupScript style keyword arguments:
+    maxIslandCount, useFullyConnected, forceLabelChange, noDilation, includeList, excludeList, workers)
+    in order on the in memory atlas, writing only the final atlas and the json island statistics
+    report of all stages
+    """
+    import os
+    if writeStageStatistics:
+        stageStatisticsPrefix = os.path.abspath(outAtlas).replace('.nii.gz', '')
+    else:
+        stageStatisticsPrefix = None
+
+    from atlasSmallIslandCleanup import runDustCleanupStages, getIslandReportPath
+    runDustCleanupStages(inAtlas, outAtlas, inFN1, stages, inputT2Path=inFN2,
+                         stageStatisticsPrefix=stageStatisticsPrefix)
+    return os.path.abspath(outAtlas), os.path.abspath(getIslandReportPath(outAtlas))
+
+
 def CreateDustCleanupWorkflow(workflowFileName, onlyT1, master_config):
     #if onlyT1:
     #    n_modality = 1
@@ -44,51 +64,30 @@ def CreateDustCleanupWorkflow(workflowFileName, onlyT1, master_config):
                          run_without_submitting=True,
                          name='inputspec')
 
-    outputsSpec = pe.Node(interface=IdentityInterface(fields=['JointFusion_HDAtlas20_2015_dustCleaned_label']),
+    outputsSpec = pe.Node(interface=IdentityInterface(fields=['JointFusion_HDAtlas20_2015_dustCleaned_label',
+                                                              'JointFusion_HDAtlas20_2015_dustCleaned_statistics']),
                           run_without_submitting=True,
                           name='outputspec')
 
     """
-    Multimodal atlas dust cleanup if T2 exists to clean 'suspicious' dust. This stage builds islands
-    using four-neighbor connectivity (useFullyConnected = False), has a max island count of 6 (instead
-    of 5 as in the next stage), forces labels to change for these islands, does NOT dilate the label
-    mask in order to clean all dust particles even clusters, and only suspicious (999) is cleaned.
-    """
-    sessionRunDustCleanupOnSuspicious = pe.Node(Function(function=runAutomaticCleanupScript,
-                                                         input_names=['inFN1', 'inFN2', 'inAtlas', 'outAtlas',
-                                                                      'maxIslandCount', 'useFullyConnected',
-                                                                      'forceLabelChange', 'noDilation',
-                                                                      'includeList', 'excludeList'],
-                                                         output_names=['cleanedLabelImage']),
-                                                run_without_submitting=True, name="sessionRunDustCleanupOnSuspicious")
-    dustCleanupWF.connect(inputsSpec, 'subj_t1_image', sessionRunDustCleanupOnSuspicious, 'inFN1')
-    if not onlyT1:
-        dustCleanupWF.connect(inputsSpec, 'subj_t2_image', sessionRunDustCleanupOnSuspicious, 'inFN2')
-    else:
-        pass
-
-    dustCleanupWF.connect(inputsSpec, 'subj_label_atlas', sessionRunDustCleanupOnSuspicious, 'inAtlas')
-    sessionRunDustCleanupOnSuspicious.inputs.outAtlas = 'JointFusion_HDAtlas20_2015_dustCleaned_label_suspicious_maxIsland6.nii.gz'
-    sessionRunDustCleanupOnSuspicious.inputs.maxIslandCount = 6
-    sessionRunDustCleanupOnSuspicious.inputs.useFullyConnected = False
-    sessionRunDustCleanupOnSuspicious.inputs.forceLabelChange = True
-    sessionRunDustCleanupOnSuspicious.inputs.noDilation = True
-    sessionRunDustCleanupOnSuspicious.inputs.includeList = '999'
-    sessionRunDustCleanupOnSuspicious.inputs.excludeList = None
-
-    """
-    Multimodal atlas dust cleanup if T2 exists to clean most labels after suspicious has been cleaned.
-    Labels excluded from this cleaning stage may have viable isolated islands that should not be changed.
-    This stage builds islands using eight-neighbor connectivity (useFullyConnected = True), has a max
-    island count of 5 (instead of 6 as in the previous stage), forces labels to change for these islands,
-    does dilate the label mask to avoid cleaning clustered dust, and several labels are excluded.
+    Multimodal atlas dust cleanup if T2 exists, run as two stages in one node so the atlas and the
+    intensity images are only read once and only the final atlas is written.
+
+    The first stage cleans 'suspicious' dust. It builds islands using four-neighbor connectivity
+    (useFullyConnected = False), has a max island count of 6 (instead of 5 as in the next stage),
+    forces labels to change for these islands, does NOT dilate the label mask in order to clean all
+    dust particles even clusters, and only suspicious (999) is cleaned.
+
+    The second stage cleans most labels after suspicious has been cleaned. Labels excluded from this
+    cleaning stage may have viable isolated islands that should not be changed. This stage builds islands
+    using eight-neighbor connectivity (useFullyConnected = True), has a max island count of 5 (instead
+    of 6 as in the previous stage), forces labels to change for these islands, does dilate the label
+    mask to avoid cleaning clustered dust, and several labels are excluded.
     """
-    sessionRunDustCleanup = pe.Node(Function(function=runAutomaticCleanupScript,
-                                             input_names=['inFN1', 'inFN2', 'inAtlas', 'outAtlas',
-                                                          'maxIslandCount', 'useFullyConnected',
-                                                          'forceLabelChange', 'noDilation',
-                                                          'includeList', 'excludeList'],
-                                             output_names=['cleanedLabelImage']),
+    sessionRunDustCleanup = pe.Node(Function(function=runAutomaticCleanupStages,
+                                             input_names=['inFN1', 'inFN2', 'inAtlas', 'outAtlas', 'stages',
+                                                          'writeStageStatistics'],
+                                             output_names=['cleanedLabelImage', 'islandStatisticsReport']),
                                     run_without_submitting=True, name="sessionRunDustCleanup")
     dustCleanupWF.connect(inputsSpec, 'subj_t1_image', sessionRunDustCleanup, 'inFN1')
     if not onlyT1:
@@ -96,16 +95,25 @@ def CreateDustCleanupWorkflow(workflowFileName, onlyT1, master_config):
     else:
         pass
 
-    dustCleanupWF.connect(sessionRunDustCleanupOnSuspicious, 'cleanedLabelImage', sessionRunDustCleanup, 'inAtlas')
+    dustCleanupWF.connect(inputsSpec, 'subj_label_atlas', sessionRunDustCleanup, 'inAtlas')
     sessionRunDustCleanup.inputs.outAtlas = 'JointFusion_HDAtlas20_2015_dustCleaned_label.nii.gz'
-    sessionRunDustCleanup.inputs.maxIslandCount = 5
-    sessionRunDustCleanup.inputs.useFullyConnected = True
-    sessionRunDustCleanup.inputs.forceLabelChange = True
-    sessionRunDustCleanup.inputs.noDilation = False
-    sessionRunDustCleanup.inputs.includeList = None
-    sessionRunDustCleanup.inputs.excludeList = '4,5,14,15,21,24,31,43,44,63,72,85,98,128,219,15000'
+    sessionRunDustCleanup.inputs.stages = [{'maxIslandCount': 6,
+                                            'useFullyConnected': False,
+                                            'forceLabelChange': True,
+                                            'noDilation': True,
+                                            'includeList': '999',
+                                            'excludeList': None},
+                                           {'maxIslandCount': 5,
+                                            'useFullyConnected': True,
+                                            'forceLabelChange': True,
+                                            'noDilation': False,
+                                            'includeList': None,
+                                            'excludeList': '4,5,14,15,21,24,31,43,44,63,72,85,98,128,219,15000'}]
+    sessionRunDustCleanup.inputs.writeStageStatistics = False
 
     dustCleanupWF.connect(sessionRunDustCleanup, 'cleanedLabelImage', outputsSpec,
                           'JointFusion_HDAtlas20_2015_dustCleaned_label')
+    dustCleanupWF.connect(sessionRunDustCleanup, 'islandStatisticsReport', outputsSpec,
+                          'JointFusion_HDAtlas20_2015_dustCleaned_statistics')
 
     return dustCleanupWF
@@ -29,11 +29,13 @@ def CreateVolumeMeasureWorkflow(WFname, master_config):
     Measure volumes according to
     1) label image
     2) label look up table (following format for 3D Slicer color lookup table)
-    3) Reference image
 
     and produce measured volumes in
     1) CSV format
     2) JSON Format
+
+    Both reports are written by one node from a single counting pass over the label map;
+    only the header of subj_t1_image is read, for the voxel spacing.
     """
 
     volumeMeasureWF = pe.Workflow(name=WFname)
@@ -44,38 +46,23 @@ def CreateVolumeMeasureWorkflow(WFname, master_config):
                          name='makeLabelDict')
     makeDictND.inputs.inputColorLookUpTableFilename = master_config['labelmap_colorlookup_table']
 
-    getVolumesND = pe.Node(Function(function=GetLabelVolumes,
-                                    input_names=['labelVolume', 'RefVolume', 'labelDictionary'],
-                                    output_names=['outputLabelVolumes']),
-                           run_without_submitting=False,
-                           name='getVolumes')
+    measureVolumesND = pe.Node(Function(function=MeasureLabelVolumes,
+                                        input_names=['labelVolume', 'labelDictionary',
+                                                     'csvFilename', 'jsonFilename', 'RefVolume'],
+                                        output_names=['csvFilename', 'jsonFilename']),
+                               run_without_submitting=False,
+                               name='measureVolumes')
+    measureVolumesND.inputs.csvFilename = 'labelVolume.csv'
+    measureVolumesND.inputs.jsonFilename = 'labelVolume.json'
     volumeMeasureWF.connect(makeDictND, 'labelDictionary',
-                            getVolumesND, 'labelDictionary')
+                            measureVolumesND, 'labelDictionary')
     volumeMeasureWF.connect(inputsSpec, 'subj_t1_image',
-                            getVolumesND, 'RefVolume')
+                            measureVolumesND, 'RefVolume')
     volumeMeasureWF.connect(inputsSpec, 'subj_label_image',
-                            getVolumesND, 'labelVolume')
-
-    writeCSVND = pe.Node(Function(function=WriteDictionaryToCSV,
-                                  input_names=['inputList', 'outputFilename'],
-                                  output_names=['outputFilename']),
-                         run_without_submitting=False,
-                         name='writeCSV')
-    volumeMeasureWF.connect(getVolumesND, 'outputLabelVolumes',
-                            writeCSVND, 'inputList')
-    writeCSVND.inputs.outputFilename = 'labelVolume.csv'
-    volumeMeasureWF.connect(writeCSVND, 'outputFilename',
+                            measureVolumesND, 'labelVolume')
+    volumeMeasureWF.connect(measureVolumesND, 'csvFilename',
                             outputsSpec, 'csvFilename')
-
-    writeJSONND = pe.Node(Function(function=WriteDictionaryToJson,
-                                   input_names=['inputList', 'outputFilename'],
-                                   output_names=['outputFilename']),
-                          run_without_submitting=False,
-                          name='writeJSON')
-    volumeMeasureWF.connect(getVolumesND, 'outputLabelVolumes',
-                            writeJSONND, 'inputList')
-    writeJSONND.inputs.outputFilename = 'labelVolume.json'
-    volumeMeasureWF.connect(writeJSONND, 'outputFilename',
+    volumeMeasureWF.connect(measureVolumesND, 'jsonFilename',
                             outputsSpec, 'jsonFilename')
 
     return volumeMeasureWF
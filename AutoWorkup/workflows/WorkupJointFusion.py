@@ -15,8 +15,9 @@ from nipype.interfaces.semtools.utilities.brains import BRAINSLandmarkInitialize
 from nipype.interfaces.utility import Merge, Split, Function, Rename, IdentityInterface
 
 from utilities.distributed import modify_qsub_args
+from utilities.labelMaps import readRecodingList
 from utilities.misc import *
-from utilities.misc import CommonANTsRegistrationSettings
+from utilities.misc import CommonANTsRegistrationSettings, IntermediateImageName
 from .WorkupAtlasDustCleanup import CreateDustCleanupWorkflow
 from .WorkupComputeLabelVolume import *
 
@@ -62,23 +63,6 @@ def adjustMergeList(allList, n_modality):
     return [fname for fname in list(yieldList(asciiAllList, n_modality))]
 
 
-def readRecodingList(recodeLabelFilename):
-    recodeLabelPairList = []
-    import csv
-    with open(recodeLabelFilename, 'r') as f:
-        reader = csv.reader(f, delimiter=',')
-        for line in reader:
-            if line[0].startswith("#"):
-                pass
-            else:
-                origLbl, origName, targetLbl, targetName = line
-                origLbl = int(origLbl)
-                targetLbl = int(targetLbl)
-                recodeLabelPairList.append((origLbl, targetLbl))
-                # print(" relabel: {0:30} ({1:5d}) --> {2:30} ({3:5d})".format(origName, origLbl, targetName, targetLbl))
-    return recodeLabelPairList
-
-
 def readMalfAtlasDbBase(dictionaryFilename):
     jointFusionAtlasDict = {}
     # scanID, ['atlasID', 't1', 't2' ,'label', 'lmks']
@@ -130,6 +114,7 @@ def CreateJointFusionWorkflow(WFname, onlyT1, master_config, runFixFusionLabelMa
                                                               'JointFusion_HDAtlas20_2015_lobe_label',
                                                               'JointFusion_extended_snapshot',
                                                               'JointFusion_HDAtlas20_2015_dustCleaned_label',
+                                                              'JointFusion_HDAtlas20_2015_dustCleaned_statistics',
                                                               'JointFusion_volumes_csv',
                                                               'JointFusion_volumes_json',
                                                               'JointFusion_lobe_volumes_csv',
@@ -166,7 +151,7 @@ def CreateJointFusionWorkflow(WFname, onlyT1, master_config, runFixFusionLabelMa
                                          'overwrite': True}
         subjectT2Resample.inputs.pixelType = 'short'
         subjectT2Resample.inputs.interpolationMode = 'Linear'
-        subjectT2Resample.inputs.outputVolume = "t2_resampled_in_t1.nii.gz"
+        subjectT2Resample.inputs.outputVolume = IntermediateImageName("t2_resampled_in_t1.nii.gz", master_config)
         # subjectT2Resample.inputs.warpTransform= "Identity" # Default is "Identity"
 
         JointFusionWF.connect(inputsSpec, 'subj_t1_image', subjectT2Resample, 'referenceVolume')
@@ -199,7 +184,7 @@ def CreateJointFusionWorkflow(WFname, onlyT1, master_config, runFixFusionLabelMa
 
         fixedROIAuto = pe.Node(interface=BRAINSROIAuto(), name="fixedROIAUTOMask")
         fixedROIAuto.inputs.ROIAutoDilateSize = 10
-        fixedROIAuto.inputs.outputROIMaskVolume = "fixedImageROIAutoMask.nii.gz"
+        fixedROIAuto.inputs.outputROIMaskVolume = IntermediateImageName("fixedImageROIAutoMask.nii.gz", master_config)
         JointFusionWF.connect(inputsSpec, 'subj_t1_image', fixedROIAuto, 'inputVolume')
 
     for jointFusion_atlas_subject in list(jointFusionAtlasDict.keys()):
@@ -248,7 +233,7 @@ def CreateJointFusionWorkflow(WFname, onlyT1, master_config, runFixFusionLabelMa
             antsRegistrationNode=A2SantsRegistrationPreJointFusion_SyN[jointFusion_atlas_subject],
             registrationTypeDescription=JFregistrationTypeDescription,
             output_transform_prefix=jointFusion_atlas_subject + '_ToSubjectPreJointFusion_SyN',
-            output_warped_image=jointFusion_atlas_subject + '_2subject.nii.gz',
+            output_warped_image=IntermediateImageName(jointFusion_atlas_subject + '_2subject.nii.gz', master_config),
             output_inverse_warped_image=None,  # NO NEED FOR THIS
             save_state=None,  # NO NEED FOR THIS
             invert_initial_moving_transform=False,
@@ -315,7 +300,8 @@ def CreateJointFusionWorkflow(WFname, onlyT1, master_config, runFixFusionLabelMa
             t2Resample[jointFusion_atlas_subject].plugin_args = many_cpu_t2Resample_options_dictionary
             t2Resample[jointFusion_atlas_subject].inputs.num_threads = -1
             t2Resample[jointFusion_atlas_subject].inputs.dimension = 3
-            t2Resample[jointFusion_atlas_subject].inputs.output_image = jointFusion_atlas_subject + '_t2.nii.gz'
+            t2Resample[jointFusion_atlas_subject].inputs.output_image = IntermediateImageName(
+                jointFusion_atlas_subject + '_t2.nii.gz', master_config)
             t2Resample[jointFusion_atlas_subject].inputs.interpolation = 'BSpline'
             t2Resample[jointFusion_atlas_subject].inputs.default_value = 0
             t2Resample[jointFusion_atlas_subject].inputs.invert_transform_flags = [False]
@@ -342,7 +328,8 @@ def CreateJointFusionWorkflow(WFname, onlyT1, master_config, runFixFusionLabelMa
         labelMapResample[jointFusion_atlas_subject].inputs.num_threads = -1
         labelMapResample[jointFusion_atlas_subject].inputs.dimension = 3
         labelMapResample[
-            jointFusion_atlas_subject].inputs.output_image = jointFusion_atlas_subject + '_2_subj_lbl.nii.gz'
+            jointFusion_atlas_subject].inputs.output_image = IntermediateImageName(
+            jointFusion_atlas_subject + '_2_subj_lbl.nii.gz', master_config)
         labelMapResample[jointFusion_atlas_subject].inputs.interpolation = 'MultiLabel'
         labelMapResample[jointFusion_atlas_subject].inputs.default_value = 0
         labelMapResample[jointFusion_atlas_subject].inputs.invert_transform_flags = [False]
@@ -366,7 +353,8 @@ def CreateJointFusionWorkflow(WFname, onlyT1, master_config, runFixFusionLabelMa
         NewlabelMapResample[jointFusion_atlas_subject].inputs.num_threads = -1
         NewlabelMapResample[jointFusion_atlas_subject].inputs.dimension = 3
         NewlabelMapResample[
-            jointFusion_atlas_subject].inputs.output_image = jointFusion_atlas_subject + 'fswm_2_subj_lbl.nii.gz'
+            jointFusion_atlas_subject].inputs.output_image = IntermediateImageName(
+            jointFusion_atlas_subject + 'fswm_2_subj_lbl.nii.gz', master_config)
         NewlabelMapResample[jointFusion_atlas_subject].inputs.interpolation = 'MultiLabel'
         NewlabelMapResample[jointFusion_atlas_subject].inputs.default_value = 0
         NewlabelMapResample[jointFusion_atlas_subject].inputs.invert_transform_flags = [False]
@@ -523,6 +511,9 @@ def CreateJointFusionWorkflow(WFname, onlyT1, master_config, runFixFusionLabelMa
     #                      [('output_label_image', 'inputBinaryVolumes')])
     #                   ])
 
+    JointFusionWF.connect(myLocalDustCleanup, 'outputspec.JointFusion_HDAtlas20_2015_dustCleaned_statistics',
+                          outputsSpec, 'JointFusion_HDAtlas20_2015_dustCleaned_statistics')
+
     """
     Compute label volumes
     """
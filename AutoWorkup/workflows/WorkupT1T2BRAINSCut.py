@@ -174,7 +174,8 @@ def CreateBRAINSCutWorkflow(projectid,
     cutWF = pe.Workflow(name=GenerateWFName(projectid, subjectid, sessionid, WFName))
 
     inputsSpec = pe.Node(interface=IdentityInterface(fields=['T1Volume', 'T2Volume',
-                                                             'posteriorDictionary', 'RegistrationROI',
+                                                             'posteriorDictionary', 'candidateRegion',
+                                                             'RegistrationROI',
                                                              'atlasToSubjectTransform', 'template_t1_denoised_gaussian',
                                                              'rho', 'phi', 'theta',
                                                              'l_caudate_ProbabilityMap', 'r_caudate_ProbabilityMap',
@@ -261,14 +262,8 @@ def CreateBRAINSCutWorkflow(projectid,
 
     cutWF.connect(DenoisedT1, 'outputVolume', RF12BC, 'inputSubjectT1Filename')
 
-    from PipeLineFunctionHelpers import MakeInclusionMaskForGMStructures
-    makeCandidateRegionNode = pe.Node(interface=Function(['posteriorDictionary', 'candidateRegionFileName'],
-                                                         ['outputCandidateRegionFileName'],
-                                                         function=MakeInclusionMaskForGMStructures),
-                                      name="MakeCandidateRegion")
-    makeCandidateRegionNode.inputs.candidateRegionFileName = "RF12_CandidateRegionMask.nii.gz"
-    cutWF.connect(inputsSpec, 'posteriorDictionary', makeCandidateRegionNode, 'posteriorDictionary')
-    cutWF.connect(makeCandidateRegionNode, 'outputCandidateRegionFileName', RF12BC, 'candidateRegion')
+    ## The GM structures inclusion mask is made by PostProcessPosteriors from the posteriors it already read
+    cutWF.connect(inputsSpec, 'candidateRegion', RF12BC, 'candidateRegion')
 
     cutWF.connect([(inputsSpec, RF12BC, [('template_t1_denoised_gaussian', 'inputTemplateT1'),
                                          # ('template_brain', 'inputTemplateRegistrationROIFilename'),
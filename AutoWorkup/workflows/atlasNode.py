@@ -259,6 +259,8 @@ def CreateAtlasXMLAndCleanedDeformedAverages(t1_image, deformed_list, AtlasTempl
         'AVG_template_WMPM2_labels.nii.gz',
         'AVG_template_rightHemisphere.nii.gz',
     ]
+    from utilities.imageIO import ImageWriter
+    imageWriter = ImageWriter()  # the clipped priors are compressed while the next one is computed
     clean_deformed_list = deformed_list
     T2File = None
     PDFile = None
@@ -269,8 +271,7 @@ def CreateAtlasXMLAndCleanedDeformedAverages(t1_image, deformed_list, AtlasTempl
             ### Make Brain Mask Binary
             clipped_name = 'CLIPPED_' + base_name
             patternDict[clipped_name] = patternDict[base_name]
-            sitk.WriteImage(binmask, clipped_name)
-            clean_deformed_list[index] = os.path.realpath(clipped_name)
+            clean_deformed_list[index] = imageWriter.Write(binmask, clipped_name)
         elif base_name == 'AVG_T2.nii.gz':
             T2File = full_pathname
         elif base_name == 'AVG_PD.nii.gz':
@@ -281,8 +282,7 @@ def CreateAtlasXMLAndCleanedDeformedAverages(t1_image, deformed_list, AtlasTempl
             curr = curr * brainmask_dilatedBy5
             clipped_name = 'CLIPPED_' + base_name
             patternDict[clipped_name] = patternDict[base_name]
-            sitk.WriteImage(curr, clipped_name)
-            clean_deformed_list[index] = os.path.realpath(clipped_name)
+            clean_deformed_list[index] = imageWriter.Write(curr, clipped_name)
             # print "HACK: ", clean_deformed_list[index]
             curr = None
         elif base_name in exteriorPriors:
@@ -291,8 +291,7 @@ def CreateAtlasXMLAndCleanedDeformedAverages(t1_image, deformed_list, AtlasTempl
             curr = curr * inv_brainmask_erodedBy5
             clipped_name = 'CLIPPED_' + base_name
             patternDict[clipped_name] = patternDict[base_name]
-            sitk.WriteImage(curr, clipped_name)
-            clean_deformed_list[index] = os.path.realpath(clipped_name)
+            clean_deformed_list[index] = imageWriter.Write(curr, clipped_name)
             # print "HACK: ", clean_deformed_list[index]
             curr = None
         elif base_name in extraFiles:
@@ -304,6 +303,7 @@ def CreateAtlasXMLAndCleanedDeformedAverages(t1_image, deformed_list, AtlasTempl
                                                                                'AVG_PD.nii.gz', interiorPriors,
                                                                                exteriorPriors]))
             sys.exit(-1)
+    imageWriter.Close()
 
     binmask = None
     brainmask_dilatedBy5 = None
@@ -30,7 +30,7 @@ package_check('networkx', '1.0', 'tutorial1')
 package_check('IPython', '0.10', 'tutorial1')
 
 from utilities.distributed import modify_qsub_args
-from PipeLineFunctionHelpers import convertToList, FixWMPartitioning, AccumulateLikeTissuePosteriors
+from PipeLineFunctionHelpers import convertToList, PostProcessPosteriors
 from PipeLineFunctionHelpers import UnwrapPosteriorImagesFromDictionaryFunction
 
 from .WorkupT1T2LandmarkInitialization import CreateLandmarkInitializeWorkflow
@@ -78,8 +78,6 @@ def getAllT1sLength(allT1s):
     return len(allT1s)
 
 
-##TODO:  Move to module that can be re-used
-##       GetLargestLabel is copied elsewhere
 def CreateLeftRightWMHemispheres(BRAINLABELSFile,
                                  HDCMARegisteredVentricleMaskFN,
                                  LeftHemisphereMaskName,
@@ -89,22 +87,7 @@ def CreateLeftRightWMHemispheres(BRAINLABELSFile,
                                  WM_RightHemisphereFileName):
     import SimpleITK as sitk
     import os
-
-    def GetLargestLabel(inputMask, UseErosionCleaning):
-        LargestComponentCode = 1
-        if UseErosionCleaning:
-            erosionMask = sitk.ErodeObjectMorphology(inputMask, 1)
-        else:
-            erosionMask = inputMask
-        CC = sitk.ConnectedComponent(erosionMask)
-        Rlabel = sitk.RelabelComponent(CC)
-        largestMask = (Rlabel == LargestComponentCode)
-        if UseErosionCleaning:
-            dilateMask = sitk.DilateObjectMorphology(largestMask, 1)
-        else:
-            dilateMask = largestMask
-
-        return (largestMask * dilateMask > 0)
+    from utilities.labelTopology import GetLargestLabel
 
     ABCLabelsImage = sitk.Cast(sitk.ReadImage(BRAINLABELSFile), sitk.sitkUInt32)
     # # Remove brain stem and cerebellum
@@ -180,26 +163,8 @@ def image_autounwrap(wrapped_inputfn, unwrapped_outputbasefn):
     that the resulting head is not split across the
     image boundaries"""
     import SimpleITK as sitk
-    import numpy as np
-    from scipy.signal import savgol_filter
-
-    def FlipPermuteToIdentity(sitkImageIn):
-        dc = np.array(sitkImageIn.GetDirection())
-        dc = dc.reshape(3, 3)
-        permute_values = [7, 7, 7]
-        for i in range(0, 3):
-            permute_values[i] = np.argmax(np.abs(dc[i, :]))
-        permuted_image = sitk.PermuteAxes(sitkImageIn, [ int(x) for x in permute_values ] )
-
-        dc = np.array(permuted_image.GetDirection())
-        dc = dc.reshape(3, 3)
-        flip_values = [False, False, False]
-        for i in range(0, 3):
-            if dc[i, i] < 0:
-                flip_values[i] = True
-        flipped_permuted_image = sitk.Flip(permuted_image, flip_values)
-
-        return flipped_permuted_image
+    from utilities.image_processing import AutoUnwrapImage, FlipPermuteToIdentity
+    from utilities.imageIO import PassThroughImageFile, WriteImage
 
     # ensure that normal strings are used here
     # via typecasting.  ReadImage requires types
@@ -207,82 +172,24 @@ def image_autounwrap(wrapped_inputfn, unwrapped_outputbasefn):
     wrapped_inputfn = [str(ii) for ii in wrapped_inputfn]
     unwrapped_outputbasefn = [str(ii) for ii in unwrapped_outputbasefn]
 
-    def one_axis_unwrap(wrapped_image, axis):
-        slice_values = list()
-        sitkAxis = wrapped_image.GetDimension() - 1 - axis;
-
-        last_slice = wrapped_image.GetSize()[sitkAxis]
-        mask = 1.0 - sitk.OtsuThreshold(wrapped_image)
-        mask = sitk.BinaryClosingByReconstruction(mask, 6)  ## Fill some small holes
-
-        image_as_np = sitk.GetArrayFromImage(
-            wrapped_image * sitk.Cast(mask, wrapped_image.GetPixelIDValue())
-        )
-        for ii in range(0, last_slice):
-            next_index = (ii + 1) % last_slice
-            if axis == 0:
-                curr_slice = image_as_np[ii, :, :].flatten()
-                next_slice = image_as_np[next_index, :, :].flatten()
-            elif axis == 1:
-                curr_slice = image_as_np[:, ii, :].flatten()
-                next_slice = image_as_np[:, next_index, :].flatten()
-            elif axis == 2:
-                curr_slice = image_as_np[:, :, ii].flatten()
-                next_slice = image_as_np[:, :, next_index].flatten()
-            else:
-                curr_slice = 0
-                next_slice = 0
-                metric_value = 0
-                print("FATAL ERROR")
-            diff = curr_slice - next_slice
-            diff = diff * diff
-            metric_value = np.sum(diff)
-            if ii == 0:
-                ref_slice_limit = 5 * metric_value
-            if metric_value > ref_slice_limit:
-                metric_value = ref_slice_limit
-            slice_values.append(metric_value)
-        del image_as_np
-        ## Call smoothing function to remove small noise
-        # return slice_values,slice_values
-        window_length = 3  # 2*(208/2)+1
-        polyorder = 1
-        slice_values = savgol_filter(np.array(slice_values),
-                                     window_length, polyorder, deriv=1, mode='wrap')
-
-        min_slice = np.argmax(slice_values)
-
-        axis_max = wrapped_image.GetSize()[sitkAxis] - 1
-        if min_slice > axis_max / 2:
-            zRoll = min_slice - axis_max
-        else:
-            zRoll = min_slice
-        orig_image_as_np = sitk.GetArrayFromImage(wrapped_image)
-        unwrapped_image_as_np = np.roll(orig_image_as_np, zRoll, axis)
-        outim = sitk.GetImageFromArray(unwrapped_image_as_np)
-        outim.CopyInformation(wrapped_image)
-        return outim, zRoll, slice_values
-
     unwrapped_outputfn = []
     for index in range(0, len(wrapped_inputfn)):
         ii = wrapped_inputfn[index]
         wrapped_image = sitk.ReadImage(str(ii))
+        ## One strided view of the voxels, or the image itself when it is already closest to identity
         identdc_wrapped_image = FlipPermuteToIdentity(wrapped_image)
-        del wrapped_image
-        if 0 == 1:  # THIS DOES NOT WORK ROBUSTLY YET
-            unwrapped_image, rotationZ, zslicevalues = one_axis_unwrap(identdc_wrapped_image, 0)
-            unwrapped_image, rotationY, yslicevalues = one_axis_unwrap(unwrapped_image, 1)
-            unwrapped_image, rotationX, xslicevalues = one_axis_unwrap(unwrapped_image, 2)
-
-            new_origin = identdc_wrapped_image.TransformContinuousIndexToPhysicalPoint(
-                (-rotationX, -rotationY, -rotationZ))
-            del identdc_wrapped_image
-            unwrapped_image.SetOrigin(new_origin)
-        else:
-            unwrapped_image = identdc_wrapped_image
-        import os
-        unwrapped_outputfn1 = os.path.realpath(unwrapped_outputbasefn[index])
-        sitk.WriteImage(unwrapped_image, unwrapped_outputfn1)
+        ## Only the axes along which the head is split across the image boundaries are rolled
+        unwrapped_image, rolls = AutoUnwrapImage(identdc_wrapped_image)
+        del identdc_wrapped_image
+        if any(rolls):
+            print("Unwrapped {0} by {1} (z, y, x) slices".format(ii, rolls))
+        unwrapped_outputfn1 = None
+        if unwrapped_image is wrapped_image:
+            ## Nothing changed: link the input instead of encoding the same voxels again
+            unwrapped_outputfn1 = PassThroughImageFile(ii, unwrapped_outputbasefn[index])
+        if unwrapped_outputfn1 is None:
+            unwrapped_outputfn1 = WriteImage(unwrapped_image, unwrapped_outputbasefn[index])
+        del wrapped_image, unwrapped_image
         unwrapped_outputfn.append(unwrapped_outputfn1)
 
     return unwrapped_outputfn
@@ -724,17 +631,28 @@ def generate_single_session_template_WF(projectid, subjectid, sessionid, onlyT1,
         baw201.connect(outputsSpec, 'pd_average', DataSinkTissuePD, 'TissueClassify.@pd')
 
 
-        currentFixWMPartitioningName = "_".join(['FixWMPartitioning', str(subjectid), str(sessionid)])
-        FixWMNode = pe.Node(interface=Function(function=FixWMPartitioning,
-                                               input_names=['brainMask', 'PosteriorsList'],
-                                               output_names=['UpdatedPosteriorsList', 'MatchingFGCodeList',
-                                                             'MatchingLabelList', 'nonAirRegionMask']),
-                            name=currentFixWMPartitioningName)
-
-        baw201.connect([(myLocalTCWF, FixWMNode, [('outputspec.outputLabels', 'brainMask'),
+        currentPostProcessPosteriorsName = "_".join(['PostProcessPosteriors', str(subjectid), str(sessionid)])
+        PostProcessPosteriorsNode = pe.Node(interface=Function(function=PostProcessPosteriors,
+                                                               input_names=['brainMask', 'PosteriorsList',
+                                                                            'candidateRegionFileName',
+                                                                            'backgroundWriter',
+                                                                            'nonAirRegionMaskFileName'],
+                                                               output_names=['UpdatedPosteriorsList',
+                                                                             'MatchingFGCodeList',
+                                                                             'MatchingLabelList', 'nonAirRegionMask',
+                                                                             'AccumulatePriorsList',
+                                                                             'AccumulatePriorsNames',
+                                                                             'outputCandidateRegionFileName']),
+                                            name=currentPostProcessPosteriorsName)
+        PostProcessPosteriorsNode.inputs.candidateRegionFileName = 'RF12_CandidateRegionMask.nii.gz'
+        PostProcessPosteriorsNode.inputs.backgroundWriter = True
+        PostProcessPosteriorsNode.inputs.nonAirRegionMaskFileName = IntermediateImageName('NonAirMask.nii.gz',
+                                                                                          master_config)
+
+        baw201.connect([(myLocalTCWF, PostProcessPosteriorsNode, [('outputspec.outputLabels', 'brainMask'),
                                                   (('outputspec.posteriorImages',
                                                     UnwrapPosteriorImagesFromDictionaryFunction), 'PosteriorsList')]),
-                        (FixWMNode, outputsSpec, [('UpdatedPosteriorsList', 'UpdatedPosteriorsList')]),
+                        (PostProcessPosteriorsNode, outputsSpec, [('UpdatedPosteriorsList', 'UpdatedPosteriorsList')]),
                         ])
 
         currentBRAINSCreateLabelMapName = 'BRAINSCreateLabelMapFromProbabilityMaps_' + str(subjectid) + "_" + str(
@@ -746,7 +664,7 @@ def generate_single_session_template_WF(projectid, subjectid, sessionid, onlyT1,
         BRAINSCreateLabelMapNode.inputs.dirtyLabelVolume = 'fixed_headlabels_seg.nii.gz'
         BRAINSCreateLabelMapNode.inputs.cleanLabelVolume = 'fixed_brainlabels_seg.nii.gz'
 
-        baw201.connect([(FixWMNode, BRAINSCreateLabelMapNode, [('UpdatedPosteriorsList', 'inputProbabilityVolume'),
+        baw201.connect([(PostProcessPosteriorsNode, BRAINSCreateLabelMapNode, [('UpdatedPosteriorsList', 'inputProbabilityVolume'),
                                                                ('MatchingFGCodeList', 'foregroundPriors'),
                                                                ('MatchingLabelList', 'priorLabelCodes'),
                                                                ('nonAirRegionMask', 'nonAirRegionMask')]) ])
@@ -762,20 +680,12 @@ def generate_single_session_template_WF(projectid, subjectid, sessionid, onlyT1,
                                                  'TissueClassify.@atlas2sessionInverse_tx')])
            ])
         baw201.connect([
-                       (FixWMNode, DataSinkTissue, [('UpdatedPosteriorsList', 'TissueClassify.@posteriors')]),
+                       (PostProcessPosteriorsNode, DataSinkTissue, [('UpdatedPosteriorsList', 'TissueClassify.@posteriors')]),
                        ])
 
-        currentAccumulateLikeTissuePosteriorsName = 'AccumulateLikeTissuePosteriors_' + str(subjectid) + "_" + str(
-            sessionid)
-        AccumulateLikeTissuePosteriorsNode = pe.Node(interface=Function(function=AccumulateLikeTissuePosteriors,
-                                                                        input_names=['posteriorImages'],
-                                                                        output_names=['AccumulatePriorsList',
-                                                                                      'AccumulatePriorsNames']),
-                                                     name=currentAccumulateLikeTissuePosteriorsName)
-
-        baw201.connect([(FixWMNode, AccumulateLikeTissuePosteriorsNode, [('UpdatedPosteriorsList', 'posteriorImages')]),
-                        (AccumulateLikeTissuePosteriorsNode, DataSinkTissue, [('AccumulatePriorsList',
-                                                                         'ACCUMULATED_POSTERIORS.@AccumulateLikeTissuePosteriorsOutputDir')])])
+        baw201.connect([(PostProcessPosteriorsNode, DataSinkTissue,
+                         [('AccumulatePriorsList', 'ACCUMULATED_POSTERIORS.@AccumulateLikeTissuePosteriorsOutputDir'),
+                          ('outputCandidateRegionFileName', 'TissueClassify.@candidateRegion')])])
 
         """
         brain stem adds on feature
@@ -855,7 +765,9 @@ def generate_single_session_template_WF(projectid, subjectid, sessionid, onlyT1,
                                               ]),
                         (myLocalLMIWF, segWF, [('outputspec.atlasToSubjectTransform', 'inputspec.LMIatlasToSubject_tx')
                                                ]),
-                        (FixWMNode, segWF, [('UpdatedPosteriorsList', 'inputspec.UpdatedPosteriorsList')
+                        (PostProcessPosteriorsNode, segWF, [('UpdatedPosteriorsList', 'inputspec.UpdatedPosteriorsList'),
+                                                            ('outputCandidateRegionFileName',
+                                                             'inputspec.candidateRegion')
                                             ]),
                         ])
         if not onlyT1:
@@ -1012,6 +924,8 @@ def generate_single_session_template_WF(projectid, subjectid, sessionid, onlyT1,
         # baw201.connect(myLocalJointFusion,'outputspec.JointFusion_extended_snapshot',DataSinkSegmentation,'JointFusion.@JointFusion_extended_snapshot')
         baw201.connect(myLocalJointFusion, 'outputspec.JointFusion_HDAtlas20_2015_dustCleaned_label', DataSinkSegmentation,
                        'JointFusion.@JointFusion_HDAtlas20_2015_dustCleaned_label')
+        baw201.connect(myLocalJointFusion, 'outputspec.JointFusion_HDAtlas20_2015_dustCleaned_statistics',
+                       DataSinkSegmentation, 'JointFusion.@JointFusion_HDAtlas20_2015_dustCleaned_statistics')
 
         baw201.connect(myLocalJointFusion, 'outputspec.JointFusion_volumes_csv', DataSinkSegmentation,
                        'JointFusion.allVol.@JointFusion_volumesCSV')
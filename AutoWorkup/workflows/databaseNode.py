@@ -126,11 +126,11 @@ def OpenSubjectDatabase(ExperimentBaseDirectoryCache, single_subject, mountPrefi
     import os.path
     import SessionDB
     subjectDatabaseFile = os.path.join(ExperimentBaseDirectoryCache, 'InternalWorkflowSubjectDB.db')
-    ## TODO:  Only make DB if db is older than subject_data_file.
+    ## Only refresh the DB if it is older than subject_data_file; unchanged csv rows are reused.
     if (not os.path.exists(subjectDatabaseFile)) or \
             (os.path.getmtime(subjectDatabaseFile) < os.path.getmtime(subject_data_file)):
         ExperimentDatabase = SessionDB.SessionDB(subjectDatabaseFile, single_subject)
-        ExperimentDatabase.MakeNewDB(subject_data_file, mountPrefix)
+        ExperimentDatabase.UpdateDB(subject_data_file, mountPrefix)
         ExperimentDatabase = None
         ExperimentDatabase = SessionDB.SessionDB(subjectDatabaseFile, single_subject)
     else:
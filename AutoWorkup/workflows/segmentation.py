@@ -70,6 +70,7 @@ def segmentation(projectid, subjectid, sessionid, master_config, onlyT1=True, pi
                                                              'inputHeadLabels',
                                                              'posteriorImages',
                                                              'UpdatedPosteriorsList',
+                                                             'candidateRegion',
                                                              'atlasToSubjectRegistrationState',
                                                              'rho',
                                                              'phi',
@@ -145,6 +146,7 @@ def segmentation(projectid, subjectid, sessionid, master_config, onlyT1=True, pi
     baw200.connect([(inputsSpec, myLocalSegWF, [('t1_average', 'inputspec.T1Volume'),
                                                 ('template_t1', 'inputspec.template_t1'),
                                                 ('posteriorImages', "inputspec.posteriorDictionary"),
+                                                ('candidateRegion', 'inputspec.candidateRegion'),
                                                 ('inputLabels', 'inputspec.RegistrationROI'), ]),
                     (inputsSpec, MergeStage2AverageImages, [('t1_average', 'in1')]),
                     (A2SantsRegistrationPostABCSyN, myLocalSegWF, [('composite_transform',
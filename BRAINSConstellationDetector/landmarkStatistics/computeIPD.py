@@ -22,21 +22,27 @@ Example:
 """
 from __future__ import print_function
 
+import csv
+import os
+import sys
+
+## The landmark file reader shared with AutoWorkup
+try:
+    from utilities.landmarkIO import LandmarkDistances, ReadLandmarksArray
+except ImportError:
+    raise ImportError("""
+Cannot import utilities.landmarkIO, the landmark file reader of AutoWorkup.  Put the AutoWorkup
+directory of BRAINSTools on the PYTHONPATH:
+  export PYTHONPATH=/path/to/BRAINSTools/AutoWorkup:${PYTHONPATH}
+""")
+
 def csv_file_reader(fcsvFile,dataList):
-  import csv
-  import numpy
+  """ Append [sessionID, IPD] of a Slicer 3 or Slicer 4 fcsv file to dataList; the IPD is nan when RE or LE is missing """
   sessionID = os.path.basename(os.path.dirname(os.path.dirname(fcsvFile)))
-  with open(fcsvFile) as lf:
-       reader = csv.reader(lf, delimiter=',')
-       for line in reader:
-         lmkName = line[0]
-         if lmkName == "RE":
-           REpoint=numpy.array((float(line[1]), float(line[2]), float(line[3])))
-         elif lmkName == "LE":
-           LEpoint=numpy.array((float(line[1]), float(line[2]), float(line[3])))
-         else:
-           continue
-  IPD = numpy.linalg.norm(REpoint - LEpoint)
+  names, points = ReadLandmarksArray(fcsvFile, names=['RE', 'LE'])
+  IPD = LandmarkDistances(points, names, [('RE', 'LE')])[0]
+  if IPD != IPD:
+    print("WARNING: RE or LE missing from {0}".format(fcsvFile))
   dataList.append([sessionID,IPD])
 
 def csv_file_writer(outputCSVFile,data):
@@ -47,11 +53,6 @@ def csv_file_writer(outputCSVFile,data):
       wr.writerows(data)
 
 if __name__ == '__main__':
-  import os
-  import glob
-  import sys
-  import csv
-
   from docopt import docopt
   argv = docopt(__doc__, version='1.0')
   print(argv)
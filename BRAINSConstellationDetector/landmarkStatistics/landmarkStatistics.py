@@ -0,0 +1,224 @@
+#! /usr/bin/env python
+"""
+landmarkStatistics.py
+=====================
+
+This program takes a list of input fcsv files (e.g. the BCD_ACPC_Landmarks.fcsv files of a cohort), reads
+them in parallel, and computes for every session the distances between the requested pairs of landmarks and
+the Mahalanobis distance of every landmark to its distribution over all sessions (mean and covariance of
+its 3 coordinates).  Landmarks whose Mahalanobis distance is larger than the outlier threshold are flagged.
+
+The results are placed into a single summary CSV file, with one row per session:
+  sessionID,fcsvFile,<first>_<second> distances...,<landmark> Mahalanobis distances...,numberOfOutliers,outlierLandmarks
+and, optionally, the mean and covariance of every landmark into a landmark statistics CSV file.
+
+The sessionID is the name of the directory two levels above the fcsv file (<session>/ACPCAlign/*.fcsv).
+Coordinates are reported in the coordinate system of --coordinateSystem (RAS, as in the files, by default).
+The default outlier threshold, 4.03, is the square root of the 99.9% quantile of the chi-square distribution
+with 3 degrees of freedom (16.27).
+
+Usage:
+  landmarkStatistics.py --inputFilesList INPUTLIST --outputSummary SUMMARY [--outputLandmarkStatistics STATISTICS]
+                        [--distances PAIRS] [--landmarks NAMES] [--outlierThreshold THRESHOLD]
+                        [--coordinateSystem SYSTEM] [--workers WORKERS]
+  landmarkStatistics.py -v | --version
+  landmarkStatistics.py -h | --help
+
+Options:
+  -h --help                               Show this help and exit
+  -v --version                            Print the version and exit
+  --inputFilesList INPUTLIST              List of input fcsv files, one per line
+  --outputSummary SUMMARY                 Output CSV file with one row per session
+  --outputLandmarkStatistics STATISTICS   Output CSV file with the mean and covariance of every landmark
+  --distances PAIRS                       Comma separated landmark pairs first:second [default: RE:LE]
+  --landmarks NAMES                       Comma separated landmarks of the Mahalanobis distances, all by default
+  --outlierThreshold THRESHOLD            Mahalanobis distance above which a landmark is an outlier [default: 4.03]
+  --coordinateSystem SYSTEM               RAS or LPS [default: RAS]
+  --workers WORKERS                       Number of processes reading the files, NSLOTS or the number of cpus by default
+
+Example:
+  landmarkStatistics.py --inputFilesList PREDICTDataFCSVList.txt --outputSummary PREDICTLandmarkSummary.csv \\
+    --distances RE:LE,AC:PC --outputLandmarkStatistics PREDICTLandmarkStatistics.csv
+"""
+from __future__ import print_function
+
+import csv
+import os
+import sys
+from multiprocessing import cpu_count
+
+import numpy as np
+
+## The landmark file reader shared with AutoWorkup
+try:
+    from utilities.landmarkIO import LandmarkDistances, ReadLandmarksBatch
+except ImportError:
+    raise ImportError("""
+Cannot import utilities.landmarkIO, the landmark file reader of AutoWorkup.  Put the AutoWorkup
+directory of BRAINSTools on the PYTHONPATH:
+  export PYTHONPATH=/path/to/BRAINSTools/AutoWorkup:${PYTHONPATH}
+""")
+
+DEFAULT_OUTLIER_THRESHOLD = 4.03
+
+
+def read_input_files_list(inputFilesList):
+    """ fcsv files of a list file, one per line (the first comma separated field), '#' lines skipped """
+    fcsvFiles = []
+    with open(inputFilesList) as lf:
+        for line in csv.reader(lf):
+            if len(line) == 0 or line[0].strip() == '' or line[0].startswith('#'):
+                continue
+            fcsvFiles.append(line[0].strip())
+    return fcsvFiles
+
+
+def session_id(fcsvFile):
+    return os.path.basename(os.path.dirname(os.path.dirname(os.path.abspath(fcsvFile))))
+
+
+def parse_pairs(pairs):
+    """
+    >>> parse_pairs('RE:LE, AC:PC')
+    [('RE', 'LE'), ('AC', 'PC')]
+    >>> parse_pairs('RE:LE,AC')
+    Traceback (most recent call last):
+      ...
+    ValueError: Landmark pair AC is not of the form first:second
+    """
+    result = []
+    for pair in pairs.split(','):
+        if pair.strip() == '':
+            continue
+        names = tuple(name.strip() for name in pair.split(':'))
+        if len(names) != 2 or '' in names:
+            raise ValueError("Landmark pair {0} is not of the form first:second".format(pair.strip()))
+        result.append(names)
+    return result
+
+
+def landmark_mean_and_covariance(points):
+    """ Mean and covariance of every landmark over the sessions where it is present
+
+    :param points: sessions x landmarks x 3 array, NaN for missing landmarks
+    :return: landmarks x 3 means, landmarks x 3 x 3 covariances (NaN with fewer than 2 sessions) and
+             the number of sessions of every landmark
+    """
+    present = ~np.isnan(points).any(axis=-1)
+    counts = present.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(present[..., np.newaxis], points, 0.0).sum(axis=0) / counts[:, np.newaxis]
+        centered = np.where(present[..., np.newaxis], points - mean, 0.0)
+        covariance = np.einsum('sli,slj->lij', centered, centered) / (counts - 1)[:, np.newaxis, np.newaxis]
+    mean[counts == 0] = np.nan
+    covariance[counts < 2] = np.nan
+    return mean, covariance, counts
+
+
+def mahalanobis_distances(points, mean, covariance):
+    """ Mahalanobis distance of every landmark of every session to its distribution, NaN where missing
+
+    The pseudo-inverse of the covariance is used, so that landmarks with a degenerate distribution (e.g. on
+    the midsagittal plane of ACPC aligned images) are measured within the directions they vary in.
+    """
+    inverse = np.full(covariance.shape, np.nan)
+    defined = ~np.isnan(covariance).any(axis=(1, 2))
+    if defined.any():
+        inverse[defined] = np.linalg.pinv(covariance[defined])
+    centered = points - mean
+    squared = np.einsum('sli,lij,slj->sl', centered, inverse, centered)
+    return np.sqrt(np.maximum(squared, 0.0))
+
+
+def compute_landmark_statistics(fcsvFiles, pairs, landmarks=None, coordinateSystem='RAS', workers=1,
+                                outlierThreshold=DEFAULT_OUTLIER_THRESHOLD):
+    """ Distances, landmark statistics and outliers of a list of fcsv files
+
+    :return: a dictionary with the sessionIDs, names, points (sessions x names x 3), distances
+             (sessions x pairs), mean, covariance, counts, mahalanobis (sessions x names) and outliers
+             (boolean sessions x names)
+    """
+    names, points = ReadLandmarksBatch(fcsvFiles, names=None, coordinateSystem=coordinateSystem, workers=workers)
+    if landmarks is None:
+        landmarks = names
+    for name in list(landmarks) + [name for pair in pairs for name in pair]:
+        if name not in names:
+            raise ValueError("Landmark {0} is not in any of the files".format(name))
+    keep = [names.index(name) for name in landmarks]
+
+    distances = LandmarkDistances(points, names, pairs)
+    mean, covariance, counts = landmark_mean_and_covariance(points[:, keep])
+    mahalanobis = mahalanobis_distances(points[:, keep], mean, covariance)
+    with np.errstate(invalid='ignore'):
+        outliers = mahalanobis > outlierThreshold
+    return {'sessionIDs': [session_id(fcsvFile) for fcsvFile in fcsvFiles],
+            'fcsvFiles': list(fcsvFiles),
+            'names': [names[index] for index in keep],
+            'points': points[:, keep],
+            'pairs': pairs,
+            'distances': distances,
+            'mean': mean,
+            'covariance': covariance,
+            'counts': counts,
+            'mahalanobis': mahalanobis,
+            'outliers': outliers}
+
+
+def write_summary(outputSummary, statistics):
+    with open(outputSummary, 'w') as lf:
+        wr = csv.writer(lf, delimiter=',')
+        wr.writerow(['#sessionID', 'fcsvFile'] +
+                    ['{0}_{1}'.format(first, second) for first, second in statistics['pairs']] +
+                    ['mahalanobis_{0}'.format(name) for name in statistics['names']] +
+                    ['numberOfOutliers', 'outlierLandmarks'])
+        for session, sessionID in enumerate(statistics['sessionIDs']):
+            outlierNames = [name for name, outlier in zip(statistics['names'], statistics['outliers'][session])
+                            if outlier]
+            wr.writerow([sessionID, statistics['fcsvFiles'][session]] +
+                        ['{0:.4f}'.format(value) for value in statistics['distances'][session]] +
+                        ['{0:.4f}'.format(value) for value in statistics['mahalanobis'][session]] +
+                        [len(outlierNames), ';'.join(outlierNames)])
+
+
+def write_landmark_statistics(outputLandmarkStatistics, statistics):
+    with open(outputLandmarkStatistics, 'w') as lf:
+        wr = csv.writer(lf, delimiter=',')
+        wr.writerow(['#landmark', 'numberOfSessions', 'numberOfOutliers', 'mean_x', 'mean_y', 'mean_z',
+                     'cov_xx', 'cov_xy', 'cov_xz', 'cov_yy', 'cov_yz', 'cov_zz'])
+        upper = np.triu_indices(3)
+        for index, name in enumerate(statistics['names']):
+            wr.writerow([name, statistics['counts'][index], int(statistics['outliers'][:, index].sum())] +
+                        ['{0:.4f}'.format(value) for value in statistics['mean'][index]] +
+                        ['{0:.4f}'.format(value) for value in statistics['covariance'][index][upper]])
+
+
+if __name__ == '__main__':
+    from docopt import docopt
+    argv = docopt(__doc__, version='1.0')
+    print(argv)
+
+    INPUTLIST = argv['--inputFilesList']
+    assert os.path.exists(INPUTLIST), "Input files list is not found: %s" % INPUTLIST
+    coordinateSystem = argv['--coordinateSystem']
+    assert coordinateSystem in ('RAS', 'LPS'), "Unknown coordinate system: %s" % coordinateSystem
+    if argv['--workers'] is not None:
+        workers = int(argv['--workers'])
+    else:
+        workers = int(os.environ.get('NSLOTS', cpu_count()))
+    landmarks = None
+    if argv['--landmarks'] is not None:
+        landmarks = [name.strip() for name in argv['--landmarks'].split(',') if name.strip() != '']
+
+    print('=' * 100)
+
+    fcsvFiles = read_input_files_list(INPUTLIST)
+    statistics = compute_landmark_statistics(fcsvFiles, parse_pairs(argv['--distances']), landmarks,
+                                             coordinateSystem, max(1, workers), float(argv['--outlierThreshold']))
+    write_summary(argv['--outputSummary'], statistics)
+    if argv['--outputLandmarkStatistics'] is not None:
+        write_landmark_statistics(argv['--outputLandmarkStatistics'], statistics)
+    print("{0} sessions, {1} landmarks, {2} outlier landmarks in {3} sessions".format(
+        len(fcsvFiles), len(statistics['names']), int(statistics['outliers'].sum()),
+        int(statistics['outliers'].any(axis=1).sum())))
+
+    sys.exit(0)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+"""
+BatchDefaceAfterBAW.py
+======================
+
+Deface the images of many BAW sessions with DefaceAfterBAW, for data sharing releases.
+
+The sessions are either discovered under a results root, as the directories containing
+ACPCAlign/BCD_ACPC_Landmarks.fcsv, with the images to deface given by glob patterns relative
+to the session directory, or listed in a manifest of image file names (one per line, '#'
+comments allowed), whose session directory is the parent of the image directory.
+
+Sessions are defaced in parallel worker processes; the landmarks and the dilated brain label
+of a session are computed once for all of its images.  Images whose outputs all exist are
+skipped unless --overwrite is given, so an interrupted batch can be restarted.  Every image
+gets a row in the index CSV (written as sessions finish): its status (defaced, skipped,
+missing_inputs or failed), its output files (defaced image, preserve mask and the right and
+left eye snapshot PNGs to review) and the time spent.
+
+The landmarks are read with utilities.landmarkIO, so the AutoWorkup directory must be on the PYTHONPATH:
+
+    export PYTHONPATH=/path/to/BRAINSTools/AutoWorkup:${PYTHONPATH}
+    python BatchDefaceAfterBAW.py --resultsRoot /Shared/.../20160520_PREDICTHD_long_Results \\
+        --indexCSV deface_index.csv --workers 8
+    python BatchDefaceAfterBAW.py --manifest images_to_deface.list --indexCSV deface_index.csv
+"""
+from __future__ import print_function
+
+import argparse
+import csv
+import glob
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import cpu_count
+
+from DefaceAfterBAW import BRAIN_LABEL_RELATIVE_FN, LANDMARKS_RELATIVE_FN, DefaceAfterBAW, DefaceSessionInputs, \
+    getDefaceOutputFileNames, getExperimentDir, isDefaced
+
+DEFAULT_IMAGE_PATTERNS = ["TissueClassify/t1_average_BRAINSABC.nii.gz", "DEFACE/*_acpc.nii.gz"]
+INDEX_COLUMNS = ['session_dir', 'image', 'status', 'deface_image', 'preserve_mask', 'right_eye_png',
+                 'left_eye_png', 'seconds', 'message']
+
+
+def findSessionDirs(results_root):
+    """
+    Session directories under results_root, i.e. the directories with ACPCAlign/BCD_ACPC_Landmarks.fcsv,
+    without descending into them
+    """
+    session_dirs = list()
+    for dir_name, sub_dirs, _ in os.walk(results_root):
+        if os.path.isfile(os.path.join(dir_name, LANDMARKS_RELATIVE_FN)):
+            session_dirs.append(dir_name)
+            del sub_dirs[:]
+        else:
+            sub_dirs.sort()
+    return session_dirs
+
+
+def findSessionImages(session_dir, image_patterns):
+    images = list()
+    for pattern in image_patterns:
+        for image_fn in sorted(glob.glob(os.path.join(session_dir, pattern))):
+            if image_fn not in images and not image_fn.endswith("_deface.nii.gz"):
+                images.append(image_fn)
+    return images
+
+
+def findSessions(results_root, image_patterns):
+    """
+    The sessions under results_root that have images matching image_patterns
+    :return: a list of (session directory, images)
+    """
+    sessions = [(session_dir, findSessionImages(session_dir, image_patterns))
+                for session_dir in findSessionDirs(results_root)]
+    return [(session_dir, images) for session_dir, images in sessions if len(images) > 0]
+
+
+def readManifest(manifest_fn):
+    """
+    Image file names of a manifest, grouped by session directory
+    :return: a list of (session directory, images) in manifest order
+    """
+    sessions = dict()
+    with open(manifest_fn, 'r') as fid:
+        for line in fid:
+            image_fn = line.strip().split(',')[0]
+            if image_fn == '' or image_fn.startswith('#'):
+                continue
+            image_fn = os.path.abspath(image_fn)
+            sessions.setdefault(getExperimentDir(image_fn), list()).append(image_fn)
+    return sorted(sessions.items())
+
+
+def _indexRow(session_dir, image_fn, status, seconds=0.0, message=''):
+    row = dict(getDefaceOutputFileNames(image_fn), session_dir=session_dir, image=image_fn, status=status,
+               seconds='{0:.1f}'.format(seconds), message=message)
+    if status not in ('defaced', 'skipped'):
+        row.update((key, '') for key in ['deface_image', 'preserve_mask', 'right_eye_png', 'left_eye_png'])
+    return row
+
+
+def defaceSession(session_dir, images, overwrite=False):
+    """
+    Deface images of one session; errors are reported in the index rows instead of being raised, so
+    that one bad session does not stop the batch
+    :return: the index rows of the images
+    """
+    rows = list()
+    todo = list()
+    for image_fn in images:
+        if not overwrite and isDefaced(image_fn):
+            rows.append(_indexRow(session_dir, image_fn, 'skipped'))
+        else:
+            todo.append(image_fn)
+    if len(todo) == 0:
+        return rows
+
+    missing = [fn for fn in [LANDMARKS_RELATIVE_FN, BRAIN_LABEL_RELATIVE_FN] + todo
+               if not os.path.isfile(os.path.join(session_dir, fn))]
+    if len(missing) > 0:
+        return rows + [_indexRow(session_dir, image_fn, 'missing_inputs', message=' '.join(missing))
+                       for image_fn in todo]
+
+    start = time.time()
+    try:
+        session_inputs = DefaceSessionInputs(session_dir)
+    except Exception:
+        message = traceback.format_exc().strip().splitlines()[-1]
+        return rows + [_indexRow(session_dir, image_fn, 'failed', time.time() - start, message) for image_fn in todo]
+    for image_fn in todo:
+        try:
+            defacer = DefaceAfterBAW(image_fn, session_inputs)
+            defacer.do_defacing()
+            defacer.write_outputs()
+            rows.append(_indexRow(session_dir, image_fn, 'defaced', time.time() - start))
+        except Exception:
+            rows.append(_indexRow(session_dir, image_fn, 'failed', time.time() - start,
+                                  traceback.format_exc().strip().splitlines()[-1]))
+        start = time.time()
+    return rows
+
+
+def defaceSessions(sessions, index_csv_fn, workers=1, overwrite=False):
+    """
+    Deface the images of sessions, a list of (session directory, images), with a pool of worker
+    processes, writing the index rows of every session to index_csv_fn as soon as it is done; the
+    images of a session whose worker process failed are recorded as failed
+    :return: the number of images per status
+    """
+    status_counts = dict()
+    with open(index_csv_fn, 'w') as index_file:
+        writer = csv.DictWriter(index_file, fieldnames=INDEX_COLUMNS)
+        writer.writeheader()
+
+        def record(rows):
+            for row in rows:
+                writer.writerow(row)
+                status_counts[row['status']] = status_counts.get(row['status'], 0) + 1
+            index_file.flush()
+
+        if workers == 1:
+            for session_dir, images in sessions:
+                record(defaceSession(session_dir, images, overwrite))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = dict((pool.submit(defaceSession, session_dir, images, overwrite), (session_dir, images))
+                               for session_dir, images in sessions)
+                for future in as_completed(futures):
+                    try:
+                        rows = future.result()
+                    except Exception:
+                        ## e.g. BrokenProcessPool, when a worker was killed (out of memory) or crashed
+                        session_dir, images = futures[future]
+                        message = traceback.format_exc().strip().splitlines()[-1]
+                        rows = [_indexRow(session_dir, image_fn, 'failed', message=message) for image_fn in images]
+                    record(rows)
+    return status_counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument('--resultsRoot', help='directory tree of BAW session results to search for sessions')
+    inputs.add_argument('--manifest', help='file listing the images to deface, one per line')
+    parser.add_argument('--imagePattern', action='append', dest='imagePatterns',
+                        help='glob of images to deface, relative to a session directory found under --resultsRoot '
+                             '(may be repeated, default: {0})'.format(' '.join(DEFAULT_IMAGE_PATTERNS)))
+    parser.add_argument('--indexCSV', required=True, help='output CSV listing the outputs of every image')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('NSLOTS', cpu_count())),
+                        help='number of worker processes (default: NSLOTS, or the number of cpus)')
+    parser.add_argument('--overwrite', action='store_true', help='deface images whose outputs exist again')
+    args = parser.parse_args()
+
+    if args.manifest is not None:
+        sessions = readManifest(args.manifest)
+    else:
+        sessions = findSessions(args.resultsRoot, args.imagePatterns or DEFAULT_IMAGE_PATTERNS)
+    print("Defacing {0} images of {1} sessions".format(sum(len(images) for _, images in sessions), len(sessions)))
+
+    status_counts = defaceSessions(sessions, args.indexCSV, max(1, args.workers), args.overwrite)
+    print("Done: " + ", ".join("{0} {1}".format(count, status) for status, count in sorted(status_counts.items())))
+    return 1 if status_counts.get('failed', 0) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
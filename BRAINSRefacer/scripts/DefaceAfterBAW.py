@@ -1,12 +1,104 @@
 import os
+import sys
 
 ##https://www.hindawi.com/journals/joph/2014/503645/tab1/
 GLB_EYE_DIAMETER = 19.0  ## CHANGE TO EYE_RADIUS with extra margins
 GLB_MAX_SIZE = 3000
+GLB_ABOVE_EYE_MARGIN = 20.0  ## the top of the head is kept from this far above the right eye
+GLB_BELOW_AC_MARGIN = 55.0  ## the back of the head is kept from this far below AC
+
+## The brain label is dilated HEAD_MASK_DILATIONS times by HEAD_MASK_DILATION_RADIUS voxels of the 1 mm grid
+HEAD_MASK_DILATIONS = 4
+HEAD_MASK_DILATION_RADIUS = 5
+## Face smoothing: a recursive Gaussian of SMOOTHING_SIGMA mm, then two median filters of MEDIAN_RADIUS voxels
+SMOOTHING_SIGMA = 7.0
+MEDIAN_RADIUS = 7
+
+## BAW outputs of a session directory used for defacing its images
+LANDMARKS_RELATIVE_FN = "ACPCAlign/BCD_ACPC_Landmarks.fcsv"
+BRAIN_LABEL_RELATIVE_FN = "JointFusion/JointFusion_HDAtlas20_2015_lobe_label.nii.gz"
 
 from support import *
 
 
+def getExperimentDir(acpc_aligned_face_image_fn):
+    """
+    The BAW session directory of an image in one of its subdirectories (e.g. TissueClassify or DEFACE)
+    """
+    return os.path.dirname(os.path.dirname(os.path.abspath(acpc_aligned_face_image_fn)))
+
+
+def getDefaceOutputFileNames(acpc_aligned_face_image_fn):
+    """
+    The files written for an image, in the DEFACE directory of its session
+    :return: a dictionary with the deface_image, preserve_mask, right_eye_png and left_eye_png file names
+    """
+    result_dir = os.path.join(getExperimentDir(acpc_aligned_face_image_fn), "DEFACE")
+    ## -- DEBUG: result_dir = "/tmp"
+    out_deface_image_fn = os.path.join(result_dir, os.path.basename(acpc_aligned_face_image_fn).replace(
+        ".nii.gz", "_deface.nii.gz"))
+    return {'deface_image': out_deface_image_fn,
+            'preserve_mask': out_deface_image_fn.replace("_deface.nii.gz", "_deface_mask.nii.gz"),
+            'right_eye_png': out_deface_image_fn.replace("_deface.nii.gz", "_right_eye.png"),
+            'left_eye_png': out_deface_image_fn.replace("_deface.nii.gz", "_left_eye.png")}
+
+
+def isDefaced(acpc_aligned_face_image_fn):
+    """
+    True when all outputs of the image exist; the defaced image is written last
+    """
+    return all(os.path.exists(fn) for fn in getDefaceOutputFileNames(acpc_aligned_face_image_fn).values())
+
+
+def getDefaceROI(in_mask):
+    """
+    Index box of the voxels of the preserve mask in_mask that are not kept, i.e. the complement of
+    the top of head and behind AC boxes, the eyes and the head mask; only these are smoothed
+    :return: lower and upper (exclusive) index, None when everything is kept
+    """
+    not_kept = sitk.GetArrayViewFromImage(in_mask) == 0
+    if not not_kept.any():
+        return None
+    lower_idx = list()
+    upper_idx = list()
+    for axis in (2, 1, 0):  ## x, y and z index axes of the z, y, x array
+        present = np.flatnonzero(not_kept.any(axis=tuple(other for other in (0, 1, 2) if other != axis)))
+        lower_idx.append(int(present[0]))
+        upper_idx.append(int(present[-1]) + 1)
+    return lower_idx, upper_idx
+
+
+class DefaceSessionInputs():
+    """
+    The landmarks and the dilated brain label of a BAW session directory; they are the same for
+    all images of the session, so they are computed once.  The brain label is dilated in the part
+    of the 1 mm identity grid around its labeled voxels only.
+    """
+
+    def __init__(self, experiment_dir):
+        self.experiment_dir = experiment_dir
+        self.lndmk_pts = readFCSV(os.path.join(self.experiment_dir, LANDMARKS_RELATIVE_FN))
+
+        self.IDTXFM = sitk.Transform()
+        brain_label = sitk.ReadImage(os.path.join(self.experiment_dir, BRAIN_LABEL_RELATIVE_FN))
+        self.head_mask = None
+        shape_stats = sitk.LabelShapeStatisticsImageFilter()
+        shape_stats.Execute(sitk.Cast(brain_label > 0, sitk.sitkUInt8))
+        if not shape_stats.HasLabel(1):
+            return
+        bbox = shape_stats.GetBoundingBox(1)
+        label_lower, label_upper = getPhysicalBounds(brain_label[bbox[0]:bbox[0] + bbox[3],
+                                                                 bbox[1]:bbox[1] + bbox[4],
+                                                                 bbox[2]:bbox[2] + bbox[5]])
+        ## the dilation does not reach further, and the nearest neighbor resampling not further than a label voxel
+        dilation_margin = HEAD_MASK_DILATIONS * HEAD_MASK_DILATION_RADIUS + 1 + max(brain_label.GetSpacing())
+        head_mask_space = makeIdentitySubImage(label_lower - dilation_margin, label_upper + dilation_margin)
+        if head_mask_space is not None:
+            _tmp = sitk.Resample(brain_label, head_mask_space, self.IDTXFM, sitk.sitkNearestNeighbor)
+            self.head_mask = quickDilate(_tmp, HEAD_MASK_DILATIONS, HEAD_MASK_DILATION_RADIUS)
+            del _tmp
+
+
 class DefaceAfterBAW():
     """
     A class to obscure recognizable facial features from a subject by using
@@ -14,103 +106,140 @@ class DefaceAfterBAW():
     are both used to identify regions of the image that must be preseved.
     """
 
-    def __init__(self, acpc_aligned_face_image):
+    def __init__(self, acpc_aligned_face_image, session_inputs=None):
+        """
+        :param acpc_aligned_face_image: the image to deface, in a subdirectory of its BAW session directory
+        :param session_inputs: DefaceSessionInputs of the session, to share them between images of a session
+        """
         self.acpc_aligned_face_image_fn = acpc_aligned_face_image
-        self.experiment_dir = os.path.dirname(os.path.dirname(self.acpc_aligned_face_image_fn))
-        out_base_fn = os.path.basename(self.acpc_aligned_face_image_fn)
-
-        self.result_dir = os.path.join(self.experiment_dir,"DEFACE")
-        ## -- DEBUG: self.result_dir = "/tmp"
+        self.experiment_dir = getExperimentDir(self.acpc_aligned_face_image_fn)
 
-        self.out_preserve_mask_fn = os.path.join(self.result_dir, out_base_fn.replace(".nii.gz", "_deface_mask.nii.gz"))
-        self.out_deface_image_fn = os.path.join(self.result_dir, out_base_fn.replace(".nii.gz", "_deface.nii.gz"))
-        if os.path.exists(self.out_deface_image_fn):
-            print("FILE EXISTS SO QUITTING: {0}".format(self.out_deface_image_fn))
-            sys.exit(-1)
-        self.out_re_png_fn = self.out_deface_image_fn.replace("_deface.nii.gz", "_right_eye.png")
-        self.out_le_png_fn = self.out_deface_image_fn.replace("_deface.nii.gz", "_left_eye.png")
+        out_fns = getDefaceOutputFileNames(self.acpc_aligned_face_image_fn)
+        self.result_dir = os.path.dirname(out_fns['deface_image'])
+        self.out_preserve_mask_fn = out_fns['preserve_mask']
+        self.out_deface_image_fn = out_fns['deface_image']
+        self.out_re_png_fn = out_fns['right_eye_png']
+        self.out_le_png_fn = out_fns['left_eye_png']
 
-        self.brain_label_fn = os.path.join(self.experiment_dir,
-                                           "JointFusion/JointFusion_HDAtlas20_2015_lobe_label.nii.gz")
-
-        lmks_fn = os.path.join(self.experiment_dir, "ACPCAlign/BCD_ACPC_Landmarks.fcsv")
-        self.lndmk_pts = readFCSV(lmks_fn)
-        del lmks_fn
+        if session_inputs is None:
+            session_inputs = DefaceSessionInputs(self.experiment_dir)
+        self.lndmk_pts = session_inputs.lndmk_pts
 
         self.IDTXFM = sitk.Transform()
         self.reference_image = sitk.ReadImage(self.acpc_aligned_face_image_fn)
         self.reference_image_storage_type = self.reference_image.GetPixelID()
 
-        _tmp = makeIdentityImage()
-        self.idimg = sitk.Cast(sitk.Resample(self.reference_image, _tmp, self.IDTXFM, sitk.sitkLinear),
-                               self.reference_image_storage_type)
-        mask = sitk.Image(self.idimg) * 0.0
-        del _tmp
-
-        _tmp = sitk.Resample(sitk.ReadImage(self.brain_label_fn), self.idimg, self.IDTXFM, sitk.sitkNearestNeighbor)
-        self.head_mask = quickDilate(_tmp, 4, 5)
-        del _tmp
+        self.head_mask = session_inputs.head_mask
 
     def do_defacing(self):
+        """
+        Smooth the face: the preserve mask is computed in the part of the 1 mm identity grid covering the
+        reference image, and the filters run on the crop of the reference image around the voxels it does
+        not keep (getDefaceROI) only, which are pasted back
+        """
+        self.out_img = sitk.Image(self.reference_image) #Copy image
+        ## two voxels more for the linear interpolation and for the exclusive upper corner of makeMaskFromBBCorners
+        idimg = makeIdentitySubImage(*getPhysicalBounds(self.reference_image), pad=2)
+
         # UPPER_CORNER=(-MAX_SIZE,self.lndmk_pts["RE"][1]+EYE_DIAMETER, self.lndmk_pts["RE"][2]-EYE_DIAMETER)
         # LOWER_CORNER=(+MAX_SIZE,+MAX_SIZE,self.lndmk_pts["RE"][2]-MAX_SIZE)
-        # out_mask = makeMaskFromBBCorners(LOWER_CORNER,UPPER_CORNER,self.idimg)
+        # out_mask = makeMaskFromBBCorners(LOWER_CORNER,UPPER_CORNER,idimg)
 
-        UPPER_CORNER = (-GLB_MAX_SIZE, self.lndmk_pts["RE"][1] + GLB_EYE_DIAMETER, self.lndmk_pts["RE"][2] + 20.0)
-        # -- LOWER_CORNER=(+MAX_SIZE,+MAX_SIZE, self.lndmk_pts["RE"][2]+MAX_SIZE)
-        LOWER_CORNER = (+GLB_MAX_SIZE, +GLB_MAX_SIZE, +GLB_MAX_SIZE)
-        top_of_head_mask = makeMaskFromBBCorners(LOWER_CORNER, UPPER_CORNER, self.idimg)
-        UPPER_CORNER = (-GLB_MAX_SIZE, self.lndmk_pts["AC"][1], self.lndmk_pts["AC"][2] - 55)
-        LOWER_CORNER = (+GLB_MAX_SIZE, self.lndmk_pts["RE"][1] + GLB_MAX_SIZE, +GLB_MAX_SIZE)
-        behind_acpnt = makeMaskFromBBCorners(LOWER_CORNER, UPPER_CORNER, self.idimg)
+        if idimg is None:
+            force_keep_InIDIMG = None
+        else:
+            UPPER_CORNER = (-GLB_MAX_SIZE, self.lndmk_pts["RE"][1] + GLB_EYE_DIAMETER,
+                            self.lndmk_pts["RE"][2] + GLB_ABOVE_EYE_MARGIN)
+            # -- LOWER_CORNER=(+MAX_SIZE,+MAX_SIZE, self.lndmk_pts["RE"][2]+MAX_SIZE)
+            LOWER_CORNER = (+GLB_MAX_SIZE, +GLB_MAX_SIZE, +GLB_MAX_SIZE)
+            top_of_head_mask = makeMaskFromBBCorners(LOWER_CORNER, UPPER_CORNER, idimg)
+            UPPER_CORNER = (-GLB_MAX_SIZE, self.lndmk_pts["AC"][1], self.lndmk_pts["AC"][2] - GLB_BELOW_AC_MARGIN)
+            LOWER_CORNER = (+GLB_MAX_SIZE, self.lndmk_pts["RE"][1] + GLB_MAX_SIZE, +GLB_MAX_SIZE)
+            behind_acpnt = makeMaskFromBBCorners(LOWER_CORNER, UPPER_CORNER, idimg)
 
-        left_eye = DrawEye(self.lndmk_pts["LE"], self.head_mask)
-        right_eye = DrawEye(self.lndmk_pts["RE"], self.head_mask)
+            eyes_mask = DrawEyes([self.lndmk_pts["LE"], self.lndmk_pts["RE"]], idimg)
 
-        force_keep_InIDIMG = ((left_eye > 0) + (right_eye > 0) + (top_of_head_mask > 0) + (behind_acpnt > 0) + (
-            self.head_mask > 0)) > 0
+            force_keep_InIDIMG = (eyes_mask > 0) + (top_of_head_mask > 0) + (behind_acpnt > 0)
+            if self.head_mask is not None:
+                force_keep_InIDIMG += sitk.Resample(self.head_mask, idimg, self.IDTXFM, sitk.sitkNearestNeighbor) > 0
+            force_keep_InIDIMG = force_keep_InIDIMG > 0
 
-        force_keep = sitk.Resample(force_keep_InIDIMG,self.reference_image,self.IDTXFM)
+        if force_keep_InIDIMG is None:  ## the image is outside of the identity grid
+            force_keep = sitk.Image(self.reference_image.GetSize(), sitk.sitkUInt8)
+            force_keep.CopyInformation(self.reference_image)
+        else:
+            force_keep = sitk.Resample(force_keep_InIDIMG, self.reference_image, self.IDTXFM)
         self.in_mask = sitk.Cast(force_keep, self.reference_image_storage_type)
         del force_keep, force_keep_InIDIMG
 
-        not_in_mask = sitk.Cast((1 - self.in_mask), self.reference_image_storage_type)
+        roi_bounds = getDefaceROI(self.in_mask)
+        if roi_bounds is None:
+            return
+        roi_lower_idx, roi_upper_idx = roi_bounds
+        roi_reference_image = self.reference_image[roi_lower_idx[0]:roi_upper_idx[0],
+                                                   roi_lower_idx[1]:roi_upper_idx[1],
+                                                   roi_lower_idx[2]:roi_upper_idx[2]]
+        in_mask = self.in_mask[roi_lower_idx[0]:roi_upper_idx[0],
+                               roi_lower_idx[1]:roi_upper_idx[1],
+                               roi_lower_idx[2]:roi_upper_idx[2]]
+        not_in_mask = sitk.Cast((1 - in_mask), self.reference_image_storage_type)
 
-        self.out_img = sitk.Image(self.reference_image) #Copy image
+        ## the filters see the image up to their reach around the ROI
+        spacing = self.reference_image.GetSpacing()
+        filter_margin = [2 * MEDIAN_RADIUS + int(np.ceil(3 * SMOOTHING_SIGMA / spacing[i])) for i in (0, 1, 2)]
+        filter_lower_idx = [max(0, roi_lower_idx[i] - filter_margin[i]) for i in (0, 1, 2)]
+        filter_upper_idx = [min(self.reference_image.GetSize()[i], roi_upper_idx[i] + filter_margin[i])
+                            for i in (0, 1, 2)]
+        filter_reference_image = self.reference_image[filter_lower_idx[0]:filter_upper_idx[0],
+                                                      filter_lower_idx[1]:filter_upper_idx[1],
+                                                      filter_lower_idx[2]:filter_upper_idx[2]]
 
-        smoothable_image_pixel_type = sitk.Cast(self.reference_image, sitk.sitkInt32)
-        build_up_img = sitk.Cast(sitk.SmoothingRecursiveGaussian(smoothable_image_pixel_type, 7), self.reference_image_storage_type)
+        smoothable_image_pixel_type = sitk.Cast(filter_reference_image, sitk.sitkInt32)
+        build_up_img = sitk.Cast(sitk.SmoothingRecursiveGaussian(smoothable_image_pixel_type, SMOOTHING_SIGMA),
+                                 self.reference_image_storage_type)
         del smoothable_image_pixel_type
 
         mif = sitk.MedianImageFilter()
-        mif.SetRadius(7)
+        mif.SetRadius(MEDIAN_RADIUS)
         smoothed_img = mif.Execute(build_up_img)
         smoothed_img = mif.Execute(smoothed_img)
+        del build_up_img
+        offset = [roi_lower_idx[i] - filter_lower_idx[i] for i in (0, 1, 2)]
+        smoothed_img = smoothed_img[offset[0]:offset[0] + roi_reference_image.GetSize()[0],
+                                    offset[1]:offset[1] + roi_reference_image.GetSize()[1],
+                                    offset[2]:offset[2] + roi_reference_image.GetSize()[2]]
+        smoothed_img.CopyInformation(roi_reference_image)
 
-        self.out_img = sitk.Cast((self.in_mask * self.reference_image + not_in_mask * smoothed_img),
-                                 self.reference_image_storage_type)
-
-
-        re_2dimg, le_2dimg = defacer.get_eye_images()
-        sitk.WriteImage(re_2dimg, self.out_re_png_fn)
-        sitk.WriteImage(le_2dimg, self.out_le_png_fn)
+        out_roi_img = sitk.Cast((in_mask * roi_reference_image + not_in_mask * smoothed_img),
+                                self.reference_image_storage_type)
+        self.out_img = sitk.Paste(self.out_img, out_roi_img, out_roi_img.GetSize(), [0, 0, 0], roi_lower_idx)
 
     def get_eye_images(self):
-        id_space_out_img=sitk.Resample(self.out_img,self.idimg,self.IDTXFM)
-        right_eye = get_eye_image(self.lndmk_pts["RE"], id_space_out_img, GLB_EYE_DIAMETER * 3)
-        left_eye = get_eye_image(self.lndmk_pts["LE"], id_space_out_img, GLB_EYE_DIAMETER * 3)
+        fov = GLB_EYE_DIAMETER * 3
+        eye_pnts = np.array([self.lndmk_pts["RE"], self.lndmk_pts["LE"]])
+        ## the part of the 1 mm identity grid the snapshots are cut from
+        idimg = makeIdentitySubImage(eye_pnts.min(axis=0) - fov, eye_pnts.max(axis=0) + fov, pad=1)
+        id_space_out_img=sitk.Resample(self.out_img,idimg,self.IDTXFM)
+        right_eye = get_eye_image(self.lndmk_pts["RE"], id_space_out_img, fov)
+        left_eye = get_eye_image(self.lndmk_pts["LE"], id_space_out_img, fov)
         return right_eye, left_eye
 
     def write_outputs(self):
+        if not os.path.isdir(self.result_dir):
+            os.makedirs(self.result_dir)
         sitk.WriteImage(self.in_mask, self.out_preserve_mask_fn)
         # sitk.WriteImage(self.idimg, os.path.join(self.result_dir, "resamp.nii.gz"))
-        sitk.WriteImage(self.out_img, self.out_deface_image_fn)
+        re_2dimg, le_2dimg = self.get_eye_images()
+        sitk.WriteImage(re_2dimg, self.out_re_png_fn)
+        sitk.WriteImage(le_2dimg, self.out_le_png_fn)
+        ## The defaced image marks the image as done (see isDefaced), so it is written last and renamed into place
+        partial_deface_image_fn = self.out_deface_image_fn.replace("_deface.nii.gz", "_deface_partial.nii.gz")
+        sitk.WriteImage(self.out_img, partial_deface_image_fn)
+        os.rename(partial_deface_image_fn, self.out_deface_image_fn)
 
 
 
 if __name__ == '__main__':
-    import sys
-
     print(sys.argv[1])
     if len(sys.argv) != 2:
         print("""USAGE: {0} <FullPathToUnDefacedImage.nii.gz>\n
@@ -118,6 +247,10 @@ if __name__ == '__main__':
         sys.exit(-1)
     print("Defacing: {0}".format(sys.argv[1]))
     ref_img = sys.argv[1]
+    out_deface_image_fn = getDefaceOutputFileNames(ref_img)['deface_image']
+    if os.path.exists(out_deface_image_fn):
+        print("FILE EXISTS SO QUITTING: {0}".format(out_deface_image_fn))
+        sys.exit(-1)
     defacer = DefaceAfterBAW(ref_img)
     defacer.do_defacing()
     defacer.write_outputs()
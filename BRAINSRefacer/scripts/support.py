@@ -1,28 +1,25 @@
-import math
+import itertools
 
+import numpy as np
 import SimpleITK as sitk
 
+## The landmark file reader shared with AutoWorkup
+try:
+    from utilities.landmarkIO import ReadLandmarks
+except ImportError:
+    raise ImportError("""
+Cannot import utilities.landmarkIO, the landmark file reader of AutoWorkup.  Put the AutoWorkup
+directory of BRAINSTools on the PYTHONPATH:
+  export PYTHONPATH=/path/to/BRAINSTools/AutoWorkup:${PYTHONPATH}
+""")
+
 
 def readFCSV(lmks_fn):
     """
-      lmks_fn: A slicer complant fcsv fiducial file
-      This function returns a map of named landmark points.
+      lmks_fn: A slicer complant fcsv fiducial file (Slicer 3 or Slicer 4 version)
+      This function returns a map of named landmark points, in LPS physical space.
     """
-    lmks_map = dict()
-    with open(lmks_fn, 'r') as fid:
-        lines = fid.readlines()
-        for line in lines:
-            if line[0] == '#':
-                continue
-            string_list = line.split(",")
-            lmkName = string_list[0]
-            lmk_pnt = [float(v) for v in (string_list[1:4])]
-            lmk_pnt[0] *= -1  # R -> L
-            lmk_pnt[1] *= -1  # A -> P
-            lmk_pnt[2] *= +1  # P -> S
-            lmks_map[lmkName] = lmk_pnt
-
-    return lmks_map
+    return dict((lmkName, list(lmk_pnt)) for lmkName, lmk_pnt in ReadLandmarks(lmks_fn, coordinateSystem='LPS').items())
 
 
 def makeIdentityImage(img_size=320):
@@ -36,6 +33,33 @@ def makeIdentityImage(img_size=320):
     return idimg
 
 
+def makeIdentitySubImage(lower_pnt, upper_pnt, img_size=320, pad=0):
+    """
+    The part of the makeIdentityImage(img_size) grid covering the physical box between lower_pnt and
+    upper_pnt, extended by pad voxels; its voxels are at the same physical points as in the full grid
+    :return: the sub image, None if the box is outside of the grid
+    """
+    origin_pnt = -(img_size - 1) / 2.0
+    lower_idx = [max(0, int(np.floor(lower_pnt[i] - origin_pnt)) - pad) for i in (0, 1, 2)]
+    upper_idx = [min(img_size, int(np.ceil(upper_pnt[i] - origin_pnt)) + 1 + pad) for i in (0, 1, 2)]
+    if any(upper_idx[i] <= lower_idx[i] for i in (0, 1, 2)):
+        return None
+    subimg = sitk.Image([upper_idx[i] - lower_idx[i] for i in (0, 1, 2)], sitk.sitkInt32)
+    subimg.SetSpacing([1.0, 1.0, 1.0])
+    subimg.SetOrigin([origin_pnt + lower_idx[i] for i in (0, 1, 2)])
+    return subimg
+
+
+def getPhysicalBounds(img):
+    """
+    Lower and upper physical corners of the box containing the voxel centers of img
+    """
+    size = img.GetSize()
+    corners = np.array([img.TransformIndexToPhysicalPoint([int(corner[i] * (size[i] - 1)) for i in (0, 1, 2)])
+                        for corner in itertools.product((0, 1), repeat=3)])
+    return corners.min(axis=0), corners.max(axis=0)
+
+
 def zero_bnd_idx(pnt, img):
     """
     Get the index from a point, but use edge of image if out of bounds
@@ -108,24 +132,86 @@ def quickDilate(img, count, iterdilate):
     """
     outlbl = sitk.Image(img)
     for it in range(0, count):
-        outlbl = sitk.DilateObjectMorphology((outlbl > 0), iterdilate)
+        outlbl = sitk.DilateObjectMorphology((outlbl > 0), [iterdilate] * 3)
     return outlbl
 
 
+def physicalIndexBounds(center_pnt, radii, ref_img):
+    """
+    Index range of ref_img covering the physical box center_pnt +/- radii, clipped to the image
+    :return: lower and upper (exclusive) index, None if the box is outside of the image
+    """
+    corners = [[float(center_pnt[i] + sign[i] * radii[i]) for i in (0, 1, 2)]
+               for sign in itertools.product((-1, 1), repeat=3)]
+    corner_indices = np.array([ref_img.TransformPhysicalPointToContinuousIndex(corner) for corner in corners])
+    lower = np.maximum(np.floor(corner_indices.min(axis=0)).astype(int), 0)
+    upper = np.minimum(np.ceil(corner_indices.max(axis=0)).astype(int) + 1, ref_img.GetSize())
+    if np.any(upper <= lower):
+        return None
+    return lower, upper
+
+
+def makeEllipsoidMask(center_pnts, radii, ref_img):
+    """
+    Rasterize axis aligned (in physical space) ellipsoids into a new mask in the space of ref_img
+
+    A voxel is inside when its physical center is inside one of the ellipsoids, so the image
+    spacing and direction are accounted for.  Each ellipsoid is evaluated with NumPy only on the
+    index box that covers it.
+    :param center_pnts: physical centers, one point or a list of points
+    :param radii: physical radius, one value, one value per physical axis, or one of those per center
+    :param ref_img: the image defining the output space
+    :return: a UInt8 mask with the geometry of ref_img
+    """
+    center_pnts = np.atleast_2d(np.asarray(center_pnts, dtype=np.float64))
+    radii = np.asarray(radii, dtype=np.float64)
+    if radii.ndim == 0:
+        radii = np.repeat(radii, 3)
+    radii = np.broadcast_to(radii, center_pnts.shape)
+    origin = np.array(ref_img.GetOrigin())
+    index_to_physical = np.array(ref_img.GetDirection()).reshape(3, 3) * np.array(ref_img.GetSpacing())
+
+    mask_as_np = np.zeros(ref_img.GetSize()[::-1], dtype=np.uint8)
+    for center_pnt, center_radii in zip(center_pnts, radii):
+        bounds = physicalIndexBounds(center_pnt, center_radii, ref_img)
+        if bounds is None:
+            continue
+        lower, upper = bounds
+        ## physical point = origin + sum over index axes k of index_to_physical[:, k] * idx_k, so the offsets
+        ## to the center, in radii, are sums of one term per index axis
+        offset = (origin - center_pnt) / center_radii
+        axis_terms = [np.outer(np.arange(lower[k], upper[k]), index_to_physical[:, k] / center_radii)
+                      for k in (0, 1, 2)]
+        scaled = (axis_terms[2][:, np.newaxis, np.newaxis, :] + axis_terms[1][np.newaxis, :, np.newaxis, :] +
+                  axis_terms[0][np.newaxis, np.newaxis, :, :] + offset)
+        ## voxels on the surface are outside, also when rounding puts them just inside
+        mask_as_np[lower[2]:upper[2], lower[1]:upper[1], lower[0]:upper[0]] |= \
+            (np.einsum('zyxi,zyxi->zyx', scaled, scaled) < 1.0 - 1e-9)
+    out_mask = sitk.GetImageFromArray(mask_as_np)
+    out_mask.CopyInformation(ref_img)
+    return out_mask
+
+
+def makeSphereMask(center_pnts, radius, ref_img):
+    """
+    Rasterize spheres of one physical radius around each of center_pnts into a new mask in the space of ref_img
+    """
+    return makeEllipsoidMask(center_pnts, [radius, radius, radius], ref_img)
+
+
+## Eye diameters are less than 30mm (typically average about 24mm)
+EYE_MAX_RADIUS = 15
+
+
+def DrawEyes(pnts, img):
+    """
+    A new mask in the space of img with a sphere of EYE_MAX_RADIUS mm around each eye landmark
+    """
+    return makeSphereMask(pnts, EYE_MAX_RADIUS, img)
+
+
 def DrawEye(pnt, img):
     """
-    Eye diameters are less than 30mm (typically average about 24mm)
-    """
-    index = img.TransformPhysicalPointToIndex(pnt)
-    spacing = img.GetSpacing()
-    EYE_MAX_RADIUS = 15
-    indexstart = [int(math.floor(-EYE_MAX_RADIUS * e)) for e in spacing]
-    indexstop = [int(math.ceil(+EYE_MAX_RADIUS * e)) for e in spacing]
-    for x in range(indexstart[0], indexstop[0]):
-        for y in range(indexstart[1], indexstop[1]):
-            for z in range(indexstart[2], indexstop[2]):
-                if x ** 2 + y ** 2 + z ** 2 < EYE_MAX_RADIUS ** 2:
-                    offset = (x, y, z)
-                    setidx = [index[i] + offset[i] for i in (0, 1, 2)]
-                    img[setidx] = 1
-    return img
+    A new mask in the space of img with a sphere of EYE_MAX_RADIUS mm around the eye landmark pnt
+    """
+    return DrawEyes([pnt], img)